@@ -2,97 +2,238 @@
 # It provides a command-line interface (CLI) for users to interact with the system,
 # allowing them to build the knowledge base from scratch, update it, or simply query it.
 
+import time
+# Measure the time spent importing, reported with the rest of the startup time.
+START_TIME = time.perf_counter()
+
+import argparse
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 import os
-import faiss
-from sentence_transformers import SentenceTransformer
-from src.rag_airbnb_config import LIMIT as CONFIG_LIMIT, FAISS_INDEX_PATH, EMBED_MODEL, SQLITE_PATH
-from src.rag_airbnb_database import load_reviews
-from src.rag_airbnb_embedding import build_embeddings_with_sqlite
-from src.rag_airbnb_faiss_index import build_faiss_index, load_faiss_index_and_metadata, METADATA_PATH
-from src.rag_airbnb_llm import load_hf_model, answer_query
+import shutil
+# Only lightweight modules are imported here. FAISS, Sentence Transformers, Transformers and
+# LangChain are imported by the code that needs them, so query-only startup does not pay for
+# the embedding pipeline and can import the models in parallel.
+from src.rag_airbnb_config import FAISS_INDEX_PATH, SQLITE_PATH, METRICS_PROMETHEUS_PATH
+from src.rag_airbnb_llm import load_hf_model, answer_query, answer_queries_from_file, query_cache
+from src import rag_airbnb_metrics as metrics
+
+# The duration of each startup stage in seconds, in the order the stages finished.
+startup_times = {"imports": time.perf_counter() - START_TIME}
+
+def timed(stage, func, *args, **kwargs):
+    """Calls `func` and records its duration as a startup stage."""
+    start = time.perf_counter()
+    try:
+        with metrics.span(f"startup.{stage}"):
+            return func(*args, **kwargs)
+    finally:
+        startup_times[stage] = time.perf_counter() - start
+
+def print_startup_report(total):
+    """Prints how long each startup stage took.
+
+    Stages loaded in parallel overlap, so they can add up to more than the total.
+    """
+    print(f"[+] Startup took {total:.1f}s:")
+    for stage, seconds in startup_times.items():
+        print(f"    {stage:<22} {seconds:6.1f}s")
+
+def start_instrumentation(profile_prefix=None):
+    """Turns on the pipeline metrics and, with a prefix, profiling, until the application exits.
+
+    On exit, the metrics are printed and written to METRICS_PROMETHEUS_PATH. With profiling,
+    the cProfile statistics of the main thread are written to `<prefix>.prof` (open them with
+    `python -m pstats` or snakeviz) and the spans of every thread to `<prefix>.speedscope.json`.
+
+    Args:
+        profile_prefix (str, optional): The path prefix of the profile files.
+    """
+    metrics.enable(trace=bool(profile_prefix))
+    profiler = None
+    if profile_prefix:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish():
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_prefix + ".prof")
+            metrics.write_trace(profile_prefix + ".speedscope.json")
+            print(f"[+] Profile saved to {profile_prefix}.prof and {profile_prefix}.speedscope.json")
+        metrics.write_prometheus(METRICS_PROMETHEUS_PATH)
+        print(metrics.format_report())
+        print(f"[+] Metrics saved to {METRICS_PROMETHEUS_PATH}")
+
+    atexit.register(finish)
 
 if __name__ == "__main__":
-    # --- WARNING: High Memory Usage for Large Datasets ---
-    # Processing a large number of reviews (e.g., millions) can be memory-intensive,
-    # potentially requiring 20GB+ of RAM. For initial testing or on systems with
-    # limited memory, it is highly recommended to set a 'LIMIT' in your .env file
-    # to a smaller number (e.g., 10000).
+    parser = argparse.ArgumentParser(description="Answer questions about destinations from Airbnb guest reviews.")
+    parser.add_argument("--batch", metavar="INPUT",
+                        help="Answer the questions of a JSONL file with the existing index (no menu) and exit.")
+    parser.add_argument("--serve", action="store_true",
+                        help="Serve questions over HTTP with the existing index (no menu) until interrupted.")
+    parser.add_argument("--output", default="answers.jsonl",
+                        help="The JSONL file batch mode writes answers and retrieved review IDs to.")
+    parser.add_argument("--top-k", type=int, default=5, help="The number of reviews retrieved per question.")
+    parser.add_argument("--city", nargs="+", help="Only retrieve reviews of listings in these cities.")
+    parser.add_argument("--country", nargs="+", help="Only retrieve reviews of listings in these countries.")
+    parser.add_argument("--lang", nargs="+", help="Only retrieve reviews written in these languages.")
+    parser.add_argument("--listing", nargs="+", help="Only retrieve reviews of these listing IDs.")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Record per-stage timings, token counts and memory, and report them on exit.")
+    parser.add_argument("--profile", nargs="?", const="rag_profile", metavar="PREFIX",
+                        help="Also profile the run and write PREFIX.prof and PREFIX.speedscope.json "
+                             "(default prefix: rag_profile). Implies --metrics.")
+    args = parser.parse_args()
+    if args.metrics or args.profile or metrics.is_enabled():
+        start_instrumentation(args.profile)
+
+    # Metadata filters applied to every retrieval (None when no filter flag is given).
+    filters = {
+        column: values for column, values in (
+            ("city", args.city), ("property_country", args.country),
+            ("review_lang", args.lang), ("listing_id", args.listing),
+        ) if values
+    } or None
+
+    # --- NOTE: Large Datasets ---
+    # Reviews are streamed from the primary database in BATCH_SIZE chunks while embedding,
+    # so loading no longer holds the whole table in memory. Building the FAISS index still
+    # needs every embedding in RAM; for initial testing it is recommended to set a 'LIMIT'
+    # in your .env file to a smaller number (e.g., 10000).
+    # An interrupted load resumes from the last saved batch on the next run.
     # -------------------------------------------------------
 
-    # Load the reviews from the primary database based on the LIMIT specified in the config.
-    all_reviews = load_reviews(limit=CONFIG_LIMIT)
-    if not all_reviews:
-        print("No reviews loaded from the database. Exiting.")
-    else:
-        print(f"[+] Total reviews loaded from database: {len(all_reviews)}")
-        index = None
-        embedder = None
-        reviews_for_faiss = None
+    index = None
+    embedder = None
+    reviews_for_faiss = None
 
-        # --- Application Startup Menu ---
-        # This menu provides the user with different options for starting the application.
+    # --- Application Startup Menu ---
+    # This menu provides the user with different options for starting the application.
+    # Batch and serving modes always use the existing index, as in option 3.
+    if args.batch or args.serve:
+        choice = '3'
+    else:
         print("\n--- Application Startup Menu ---")
         print("1. Resume/Build Embeddings & Index (Continue from last stop or build new)")
         print("2. Start from Scratch (Delete all embeddings/index and rebuild)")
         print("3. Load LLM (Query Only - use existing index if available, no embedding)")
         choice = input("Enter your choice (1, 2, or 3): ")
 
-        if choice == '1':
-            # Option 1: Resume or build the knowledge base.
-            # This will generate embeddings for new reviews and add them to the existing index.
-            print("[+] Resuming/Building embeddings and FAISS index...")
-            embeddings, embedder, reviews_for_faiss = build_embeddings_with_sqlite(all_reviews)
-            index = build_faiss_index(embeddings, reviews_for_faiss)
-
-        elif choice == '2':
-            # Option 2: Start from scratch.
-            # This will delete all existing cached data (FAISS index, metadata, and SQLite DB)
-            # and rebuild the entire knowledge base from the ground up.
-            print("[+] Starting from scratch: Deleting existing files...")
-            if os.path.exists(FAISS_INDEX_PATH):
-                os.remove(FAISS_INDEX_PATH)
-                print(f"[+] Deleted existing FAISS index file: {FAISS_INDEX_PATH}")
-            if os.path.exists(METADATA_PATH):
-                os.remove(METADATA_PATH)
-                print(f"[+] Deleted existing metadata file: {METADATA_PATH}")
-            if os.path.exists(SQLITE_PATH):
-                os.remove(SQLITE_PATH)
-                print(f"[+] Deleted existing SQLite embeddings cache: {SQLITE_PATH}")
-
-            print("[+] Rebuilding embeddings and FAISS index from scratch...")
-            embeddings, embedder, reviews_for_faiss = build_embeddings_with_sqlite(all_reviews)
-            index = build_faiss_index(embeddings, reviews_for_faiss)
-
-        elif choice == '3':
-            # Option 3: Query only.
-            # This will load the existing FAISS index and metadata, and start the query engine.
-            # No new embeddings will be generated.
-            print("[+] Loading existing FAISS index for query only...")
-            index, reviews_for_faiss, embedder = load_faiss_index_and_metadata()
-            if index is None or reviews_for_faiss is None or embedder is None:
-                print("⚠️ Warning: No complete FAISS index found. RAG queries will not have context.")
-            else:
-                print("[+] Successfully loaded existing FAISS index and metadata.")
+    # The time spent waiting at the menu is not part of the startup time.
+    ready_start = time.perf_counter()
+    llm = None
+
+    if choice == '1':
+        # Option 1: Resume or build the knowledge base.
+        # This will generate embeddings for new reviews and add only those to the existing index.
+        # With an ordered source, edited and deleted reviews are also applied to the cache and the index.
+        from src.rag_airbnb_embedding import update_embeddings_with_sqlite
+        from src.rag_airbnb_faiss_index import update_faiss_index
+        print("[+] Resuming/Building embeddings and FAISS index...")
+        embedder, changes = timed("embeddings", update_embeddings_with_sqlite)
+        index, reviews_for_faiss = timed("index", update_faiss_index, *changes)
+
+    elif choice == '2':
+        # Option 2: Start from scratch.
+        # This will delete all existing cached data (FAISS index, metadata, and SQLite DB)
+        # and rebuild the entire knowledge base from the ground up.
+        from src.rag_airbnb_embedding import build_embeddings_with_sqlite
+        from src.rag_airbnb_faiss_index import build_faiss_index, METADATA_PATH, LEGACY_METADATA_PATH, DELTA_PATH
+        print("[+] Starting from scratch: Deleting existing files...")
+        if os.path.exists(FAISS_INDEX_PATH):
+            os.remove(FAISS_INDEX_PATH)
+            print(f"[+] Deleted existing FAISS index file: {FAISS_INDEX_PATH}")
+        if os.path.exists(METADATA_PATH):
+            shutil.rmtree(METADATA_PATH)
+            print(f"[+] Deleted existing metadata store: {METADATA_PATH}")
+        if os.path.exists(LEGACY_METADATA_PATH):
+            os.remove(LEGACY_METADATA_PATH)
+            print(f"[+] Deleted existing metadata file: {LEGACY_METADATA_PATH}")
+        if os.path.exists(DELTA_PATH):
+            os.remove(DELTA_PATH)
+            print(f"[+] Deleted existing index delta log: {DELTA_PATH}")
+        if os.path.exists(SQLITE_PATH):
+            os.remove(SQLITE_PATH)
+            print(f"[+] Deleted existing SQLite embeddings cache: {SQLITE_PATH}")
+        # Also remove the write-ahead log files left next to the cache by WAL journaling.
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(SQLITE_PATH + suffix):
+                os.remove(SQLITE_PATH + suffix)
+
+        print("[+] Rebuilding embeddings and FAISS index from scratch...")
+        embeddings, embedder, reviews_for_faiss = timed("embeddings", build_embeddings_with_sqlite)
+        index, reviews_for_faiss = timed("index", build_faiss_index, embeddings, reviews_for_faiss)
+
+    elif choice == '3':
+        # Option 3: Query only.
+        # This will load the existing FAISS index and metadata, and start the query engine.
+        # No new embeddings will be generated and the primary database is never contacted.
+        # The index, the query embedder and the language model are independent, so they are
+        # imported and loaded on parallel threads; most of the work happens in native code.
+        from src.rag_airbnb_faiss_index import load_faiss_index_and_metadata, load_embedder
+        print("[+] Loading existing FAISS index, embedding model and Hugging Face model in parallel...")
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="rag-startup") as pool:
+            index_future = pool.submit(timed, "index + metadata", load_faiss_index_and_metadata, with_embedder=False)
+            embedder_future = pool.submit(timed, "embedding model", load_embedder)
+            llm_future = pool.submit(timed, "language model", load_hf_model)
+            index, reviews_for_faiss, _ = index_future.result()
+            embedder = embedder_future.result() if index is not None else None
+            llm = llm_future.result()
+        if index is None or reviews_for_faiss is None or embedder is None:
+            print("⚠️ Warning: No complete FAISS index found. RAG queries will not have context.")
         else:
-            print("Invalid choice. Exiting.")
-            exit()
+            print("[+] Successfully loaded existing FAISS index and metadata.")
+    else:
+        print("Invalid choice. Exiting.")
+        exit()
 
-        # Check if the FAISS index is available for querying.
-        if index is None or embedder is None or reviews_for_faiss is None or len(reviews_for_faiss) == 0:
-            print("⚠️ Warning: FAISS index with embeddings is not fully loaded or built. RAG queries might be limited or unavailable.")
+    # Check if the FAISS index is available for querying.
+    if index is None or embedder is None or reviews_for_faiss is None or len(reviews_for_faiss) == 0:
+        print("⚠️ Warning: FAISS index with embeddings is not fully loaded or built. RAG queries might be limited or unavailable.")
 
-        # Load the generative language model.
+    # Load the generative language model, unless it was loaded in parallel above.
+    if llm is None:
         print("[+] Loading Hugging Face model (may take a minute)...")
-        llm = load_hf_model()
-
-        # --- Interactive Query Loop ---
-        # This loop allows the user to ask questions and get answers from the RAG model.
-        while True:
-            q = input("\nAsk a question (or 'exit'): ")
-            if q.lower() == "exit":
-                break
-            try:
-                answer_query(q, index, reviews_for_faiss, embedder, llm)
-            except Exception as e:
-                print(f"\n❌ An error occurred while answering the query: {e}")
-                print("Please try a different query or check your model and environment setup.")
+        llm = timed("language model", load_hf_model)
+    print_startup_report(startup_times["imports"] + time.perf_counter() - ready_start)
+
+    # --- Batch Mode ---
+    # Answer every question of the input file with batched retrieval and generation, then exit.
+    if args.batch:
+        if index is None:
+            print("❌ Batch mode needs an existing FAISS index. Build one with option 1 or 2 first.")
+            exit(1)
+        answer_queries_from_file(args.batch, args.output, index, reviews_for_faiss, embedder, llm,
+                                 top_k=args.top_k, filters=filters)
+        exit()
+
+    # --- Serving Mode ---
+    # Keep the loaded models and index in memory and answer HTTP requests in micro-batches.
+    if args.serve:
+        if index is None:
+            print("❌ Serving mode needs an existing FAISS index. Build one with option 1 or 2 first.")
+            exit(1)
+        from src.rag_airbnb_server import serve
+        serve(index, reviews_for_faiss, embedder, llm)
+        exit()
+
+    # --- Interactive Query Loop ---
+    # This loop allows the user to ask questions and get answers from the RAG model.
+    while True:
+        q = input("\nAsk a question (or 'exit'): ")
+        if q.lower() == "exit":
+            break
+        try:
+            with metrics.span("query"):
+                answer_query(q, index, reviews_for_faiss, embedder, llm, top_k=args.top_k, filters=filters)
+        except Exception as e:
+            print(f"\n❌ An error occurred while answering the query: {e}")
+            print("Please try a different query or check your model and environment setup.")
+
+    # Report how often repeated questions were served from the query cache.
+    stats = query_cache.stats()
+    print(f"[+] Query cache: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_rate']:.0%} hit rate), {stats['size']} entries.")
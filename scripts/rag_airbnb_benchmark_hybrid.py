@@ -0,0 +1,134 @@
+import argparse
+import json
+import random
+import re
+import sys
+import os
+import time
+
+import numpy as np
+
+# Add project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.rag_airbnb_config import SQLITE_PATH
+from src.rag_airbnb_lexical import RETRIEVAL_MODES, STOPWORDS
+
+def known_item_queries(n, words_per_query, seed=0):
+    """Builds questions that each target one cached review.
+
+    Each question is made of distinctive words of a random review: its capitalized words
+    (place and street names) first, then its words found in the fewest reviews. The review it
+    was taken from is the relevant result, which measures how well each mode finds a review by
+    its specifics.
+
+    Returns:
+        list[dict]: {"question": str, "relevant": [review_id]} records.
+    """
+    import sqlite3
+    conn = sqlite3.connect(f"file:{SQLITE_PATH}?mode=ro", uri=True)
+    total = conn.execute("SELECT MAX(rowid) FROM reviews").fetchone()[0] or 0
+    rng = random.Random(seed)
+    queries, attempts = [], 0
+    while len(queries) < n and attempts < 20 * n and total:
+        attempts += 1
+        row = conn.execute("SELECT review_id, review_text FROM reviews WHERE rowid = ?",
+                           (rng.randint(1, total),)).fetchone()
+        if row is None or not row[1]:
+            continue
+        words = list(dict.fromkeys(w for w in re.findall(r"\w+", row[1])
+                                   if len(w) > 3 and w.lower() not in STOPWORDS))
+        # Capitalized words after the first one of a sentence are likely names.
+        names = [w for i, w in enumerate(words) if i and w[0].isupper()]
+        try:
+            doc_counts = dict(conn.execute(
+                f"SELECT term, doc FROM reviews_fts_vocab WHERE term IN ({', '.join('?' * len(words))})",
+                [w.lower() for w in words],
+            ))
+        except sqlite3.OperationalError:
+            # Without the full-text index, longer words stand in for rarer ones.
+            doc_counts = {w.lower(): -len(w) for w in words}
+        rare = sorted(words, key=lambda w: doc_counts.get(w.lower(), 0))
+        chosen = list(dict.fromkeys(names + rare))[:words_per_query]
+        if len(chosen) == words_per_query:
+            queries.append({"question": " ".join(chosen), "relevant": [str(row[0])]})
+    conn.close()
+    return queries
+
+def benchmark(args):
+    """Compares the latency and quality of the dense, hybrid and lexical-filter retrieval modes."""
+    from src.rag_airbnb_faiss_index import load_faiss_index_and_metadata, retrieve_from_faiss
+
+    if args.query_file:
+        with open(args.query_file, encoding="utf-8") as f:
+            queries = [json.loads(line) for line in f if line.strip()]
+    else:
+        queries = known_item_queries(args.queries, args.query_words, seed=args.seed)
+    if not queries:
+        print(f"❌ No queries: the cache at {SQLITE_PATH} is empty and no --query-file was given.")
+        return []
+    index, reviews, embedder = load_faiss_index_and_metadata()
+    if index is None:
+        print("❌ No FAISS index found. Build it first (option 1 or 2 of rag_airbnb_main.py).")
+        return []
+
+    print(f"[+] Comparing {args.modes} on {len(queries)} queries, top_k={args.top_k}.")
+    # Query encoding costs the same in every mode, so it is left out of the latencies.
+    vectors = np.asarray(embedder.encode([q["question"] for q in queries], normalize_embeddings=True), dtype=np.float32)
+    results, dense_ids = [], None
+    for mode in args.modes:
+        latencies, hits, reciprocal_ranks, found_ids = [], 0, [], []
+        for query, vector in zip(queries, vectors):
+            start = time.perf_counter()
+            docs = retrieve_from_faiss(vector[None, :], index, reviews, embedder, top_k=args.top_k,
+                                       query_text=query["question"], mode=mode)
+            latencies.append((time.perf_counter() - start) * 1000)
+            ids = [str(doc["review_id"]) for doc in docs]
+            found_ids.append(ids)
+            relevant = set(map(str, query.get("relevant", [])))
+            rank = next((i for i, review_id in enumerate(ids, start=1) if review_id in relevant), None)
+            hits += rank is not None
+            reciprocal_ranks.append(1 / rank if rank else 0.0)
+        if mode == "dense":
+            dense_ids = found_ids
+        # The share of the dense results a mode keeps shows how much it changes the context.
+        overlap = None if dense_ids is None else float(np.mean(
+            [len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(found_ids, dense_ids)]
+        ))
+        latencies = np.array(latencies)
+        results.append({
+            "mode": mode, "hit_rate": hits / len(queries), "mrr": float(np.mean(reciprocal_ranks)),
+            "overlap_with_dense": overlap, "mean_ms": float(latencies.mean()),
+            "p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95)),
+        })
+    reviews.close()
+
+    print(f"\n{'mode':<15} {'hit@k':>7} {'MRR':>7} {'overlap':>8} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for r in results:
+        overlap = "" if r["overlap_with_dense"] is None else f"{r['overlap_with_dense']:.2f}"
+        print(f"{r['mode']:<15} {r['hit_rate']:>7.3f} {r['mrr']:>7.3f} {overlap:>8} "
+              f"{r['mean_ms']:>8.2f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}")
+    print("\nhit@k is the fraction of queries with a relevant review among the top k, MRR the mean of "
+          "1/rank of the first one; overlap is the share of the dense results each mode also returns.")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[+] Results saved to {args.output}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the latency and quality of dense, hybrid (BM25 + FAISS) and lexical-filter retrieval."
+    )
+    parser.add_argument("--modes", type=lambda s: s.split(","), default=list(RETRIEVAL_MODES),
+                        help="Comma-separated retrieval modes to compare. List 'dense' first to measure the overlap.")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200, help="Number of known-item queries built from the cache.")
+    parser.add_argument("--query-words", type=int, default=4, help="Number of words per known-item query.")
+    parser.add_argument("--query-file",
+                        help='A JSONL file of judged queries, {"question": ..., "relevant": [review_id, ...]} '
+                             "per line, used instead of the known-item queries.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path of a JSON file to write the results to.")
+    benchmark(parser.parse_args())
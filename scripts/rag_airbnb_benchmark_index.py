@@ -0,0 +1,123 @@
+import argparse
+import json
+import sys
+import os
+import time
+
+import faiss
+import numpy as np
+
+# Add project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.rag_airbnb_config import FAISS_METRIC, EMBEDDING_DIM
+from src.rag_airbnb_faiss_index import create_faiss_index, set_search_params
+
+# Index types compared when none are given on the command line.
+DEFAULT_FACTORIES = ["IVF1024,Flat", "HNSW32", "IVF1024,PQ32"]
+
+def load_vectors(synthetic, dim):
+    """Loads the cached review embeddings, or generates clustered synthetic ones."""
+    if synthetic:
+        # Gaussian clusters on the unit sphere roughly mimic the topical structure of reviews.
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((max(synthetic // 500, 1), dim)).astype(np.float32)
+        vectors = centers[rng.integers(0, len(centers), synthetic)]
+        vectors += 0.5 * rng.standard_normal(vectors.shape).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    from src.rag_airbnb_embedding import init_sqlite, load_all_embeddings_from_sqlite
+    sqlite_conn = init_sqlite()
+    _, vectors = load_all_embeddings_from_sqlite(sqlite_conn)
+    sqlite_conn.close()
+    return vectors
+
+def measure(index, queries, top_k):
+    """Returns the search results, batched QPS and median single-query latency of an index."""
+    start = time.perf_counter()
+    _, I = index.search(queries, top_k)
+    qps = len(queries) / (time.perf_counter() - start)
+
+    latencies = []
+    for q in queries[:200]:
+        start = time.perf_counter()
+        index.search(q[None, :], top_k)
+        latencies.append(time.perf_counter() - start)
+    return I, qps, float(np.median(latencies)) * 1000
+
+def recall_at_k(I, ground_truth, top_k):
+    """Returns the mean fraction of the exact top-k neighbours found by the approximate search."""
+    hits = sum(len(set(found[:top_k]) & set(exact[:top_k])) for found, exact in zip(I, ground_truth))
+    return hits / (len(ground_truth) * top_k)
+
+def benchmark(args):
+    """Builds every requested index type and compares it against the exact flat baseline."""
+    vectors = load_vectors(args.synthetic, EMBEDDING_DIM)
+    if len(vectors) <= args.queries:
+        print(f"❌ Need more than {args.queries} vectors, found {len(vectors)}.")
+        return []
+
+    # Hold the last vectors out of the corpus and use them as queries.
+    corpus, queries = vectors[:-args.queries], np.ascontiguousarray(vectors[-args.queries:])
+    ids = np.arange(len(corpus), dtype=np.int64)
+    print(f"[+] Benchmarking on {len(corpus)} vectors with {len(queries)} queries, top_k={args.top_k}, metric={args.metric}.")
+
+    results = []
+    flat = create_faiss_index(corpus, ids, index_factory="Flat", metric=args.metric)
+    ground_truth, qps, latency_ms = measure(flat, queries, args.top_k)
+    results.append({
+        "index": "Flat", "params": {}, "recall": 1.0, "qps": qps, "latency_ms": latency_ms,
+        "memory_mb": len(faiss.serialize_index(flat)) / 2**20, "build_s": 0.0,
+    })
+
+    for factory in args.factory or DEFAULT_FACTORIES:
+        start = time.perf_counter()
+        index = create_faiss_index(corpus, ids, index_factory=factory, metric=args.metric)
+        build_s = time.perf_counter() - start
+        memory_mb = len(faiss.serialize_index(index)) / 2**20
+
+        # Sweep the search-time knob that applies to this index type.
+        if "IVF" in factory:
+            sweep = [{"nprobe": v} for v in args.nprobe]
+        elif "HNSW" in factory:
+            sweep = [{"ef_search": v} for v in args.ef_search]
+        else:
+            sweep = [{}]
+        for params in sweep:
+            set_search_params(index, **{"nprobe": None, "ef_search": None, **params})
+            I, qps, latency_ms = measure(index, queries, args.top_k)
+            results.append({
+                "index": factory, "params": params, "recall": recall_at_k(I, ground_truth, args.top_k),
+                "qps": qps, "latency_ms": latency_ms, "memory_mb": memory_mb, "build_s": build_s,
+            })
+
+    print(f"\n{'index':<20} {'params':<18} {'recall@k':>9} {'QPS':>10} {'p50 ms':>8} {'MB':>9} {'build s':>8}")
+    for r in results:
+        params = ",".join(f"{k}={v}" for k, v in r["params"].items())
+        print(f"{r['index']:<20} {params:<18} {r['recall']:>9.3f} {r['qps']:>10.0f} "
+              f"{r['latency_ms']:>8.3f} {r['memory_mb']:>9.1f} {r['build_s']:>8.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[+] Results saved to {args.output}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the recall@k, speed and memory of FAISS index types against exact search."
+    )
+    parser.add_argument("--factory", action="append",
+                        help=f"FAISS index factory string to benchmark (repeatable). Default: {DEFAULT_FACTORIES}")
+    parser.add_argument("--metric", default=FAISS_METRIC, choices=["ip", "l2"])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000, help="Number of held-out query vectors.")
+    parser.add_argument("--nprobe", type=lambda s: [int(v) for v in s.split(",")], default=[1, 4, 16, 64],
+                        help="Comma-separated nprobe values for IVF indexes.")
+    parser.add_argument("--ef-search", type=lambda s: [int(v) for v in s.split(",")], default=[16, 64, 256],
+                        help="Comma-separated efSearch values for HNSW indexes.")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Benchmark on this many synthetic vectors instead of the SQLite cache.")
+    parser.add_argument("--output", help="Optional path of a JSON file to write the results to.")
+    benchmark(parser.parse_args())
@@ -0,0 +1,570 @@
+import argparse
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import os
+import itertools
+import sqlite3
+import tempfile
+import time
+import types
+import zlib
+
+import numpy as np
+
+# Add project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Row counts benchmarked when none are given on the command line.
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+# Words the synthetic reviews are drawn from, roughly in order of frequency.
+VOCABULARY = (
+    "the and was a to we place great stay host very location is in for clean it apartment of with "
+    "nice everything would recommend again room really comfortable close easy everything helpful "
+    "beautiful perfect walking distance metro restaurants quiet neighborhood view friendly bed kitchen "
+    "check responsive lovely cozy spacious shops bathroom station bus city center cafes area safe value "
+    "communication welcoming balcony garden breakfast parking noisy street small stairs hot water wifi "
+    "towels shower terrace river park museum beach old town bars nightlife supermarket airport taxi "
+    "arrival instructions keys late early flexible amazing wonderful excellent good little bit but not "
+    "could better dirty broken uncomfortable loud thin walls windows air conditioning heating elevator "
+    "family kids couple business trip weekend week month return definitely highly thank you"
+).split()
+# Short reviews that many guests write word for word.
+COMMON_REVIEWS = [
+    "Great stay!", "Highly recommended.", "Great place to stay.", "Perfect location.",
+    "Everything was perfect.", "Would stay again!", "Great host, great location.", "Very clean and comfortable.",
+]
+# Cities and their countries, from the most to the least reviewed.
+CITIES = [
+    ("Paris", "France"), ("London", "United Kingdom"), ("New York", "United States"), ("Barcelona", "Spain"),
+    ("Rome", "Italy"), ("Amsterdam", "Netherlands"), ("Lisbon", "Portugal"), ("Berlin", "Germany"),
+    ("Tokyo", "Japan"), ("Sydney", "Australia"), ("Mexico City", "Mexico"), ("Cape Town", "South Africa"),
+]
+# Review languages and their shares.
+LANGUAGES = {"en": 0.75, "fr": 0.08, "es": 0.06, "de": 0.05, "it": 0.03, "pt": 0.03}
+
+# ----------------------------------------
+# Synthetic corpus
+# ----------------------------------------
+
+def zipf_weights(n, exponent):
+    """Returns normalized 1/rank^exponent weights, the skew of listing and city popularity."""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+def generate_reviews(path, rows, seed=0, duplicate_rate=0.05, reviews_per_listing=25, chunk_size=100000):
+    """Writes a synthetic Airbnb review corpus to a JSONL file.
+
+    Review lengths follow a log-normal distribution (median about 40 words, with a long
+    tail), a few listings and cities receive most of the reviews, and `duplicate_rate` of
+    the reviews repeat a common short review or an earlier review's text.
+
+    Args:
+        path (str): The JSONL file to write.
+        rows (int): The number of reviews.
+        seed (int): The random seed; the same seed always gives the same corpus.
+        duplicate_rate (float): The fraction of reviews whose text is a duplicate.
+        reviews_per_listing (int): The mean number of reviews per listing.
+        chunk_size (int): The number of reviews generated at a time.
+
+    Returns:
+        int: The number of distinct review texts.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(VOCABULARY)
+    word_weights = zipf_weights(len(vocabulary), 1.0)
+    n_listings = max(rows // reviews_per_listing, 10)
+    listing_weights = zipf_weights(n_listings, 0.9)
+    listing_cities = rng.choice(len(CITIES), n_listings, p=zipf_weights(len(CITIES), 1.2))
+    languages, language_weights = list(LANGUAGES), np.array(list(LANGUAGES.values()))
+
+    texts = set()
+    recent = []
+    with open(path, "w", encoding="utf-8") as f:
+        for start in range(0, rows, chunk_size):
+            n = min(chunk_size, rows - start)
+            lengths = np.clip(rng.lognormal(np.log(40), 0.9, n), 3, 1000).astype(np.int64)
+            words = vocabulary[rng.choice(len(vocabulary), lengths.sum(), p=word_weights)]
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+            owners = rng.choice(n_listings, n, p=listing_weights)
+            review_langs = rng.choice(len(languages), n, p=language_weights)
+            duplicates = rng.random(n) < duplicate_rate
+            for i in range(n):
+                city, country = CITIES[listing_cities[owners[i]]]
+                if duplicates[i] and (not recent or rng.random() < 0.5):
+                    text = COMMON_REVIEWS[rng.integers(len(COMMON_REVIEWS))]
+                elif duplicates[i]:
+                    # Copies of an earlier review, sometimes with stray whitespace.
+                    text = recent[rng.integers(len(recent))] + (" " if rng.random() < 0.5 else "")
+                else:
+                    body = " ".join(words[offsets[i]:offsets[i + 1]])
+                    text = f"Our stay in {city}: {body}." if rng.random() < 0.3 else body.capitalize() + "."
+                    if len(recent) < 10000:
+                        recent.append(text)
+                    else:
+                        recent[rng.integers(len(recent))] = text
+                texts.add(" ".join(text.split()))
+                f.write(json.dumps({
+                    "review_id": str(start + i + 1), "listing_id": str(owners[i] + 1), "text": text,
+                    "review_lang": languages[review_langs[i]], "city": city, "property_country": country,
+                }) + "\n")
+    return len(texts)
+
+def file_review_batches(path, limit=0, start_after=None, chunk_size=1000):
+    """Streams reviews from a JSONL file, with the interface of `iter_review_batches`.
+
+    Args:
+        path (str): The JSONL file written by `generate_reviews`.
+        limit (int): The maximum number of reviews to load (0 = all).
+        start_after (str, optional): Only reviews with a larger numeric review_id are loaded.
+        chunk_size (int): The number of reviews per batch.
+
+    Yields:
+        list[dict]: Batches of reviews, ordered by review_id.
+    """
+    after = int(start_after) if start_after is not None else 0
+    chunk = []
+    total = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            review = json.loads(line)
+            if int(review["review_id"]) <= after:
+                continue
+            chunk.append(review)
+            total += 1
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+            if limit and total >= limit:
+                break
+    if chunk:
+        yield chunk
+
+def benchmark_queries(n, seed=1):
+    """Returns `n` deterministic questions and the city each one asks about."""
+    rng = np.random.default_rng(seed)
+    templates = [
+        "Is {city} a good place for a {word} weekend?", "Which area of {city} is {word}?",
+        "Are apartments in {city} {word} and clean?", "What do guests say about the {word} in {city}?",
+    ]
+    words = ["quiet", "family", "beach", "metro", "view", "nightlife", "restaurants", "safe", "cozy", "balcony"]
+    cities = [CITIES[i][0] for i in rng.choice(len(CITIES), n, p=zipf_weights(len(CITIES), 1.2))]
+    questions = [
+        templates[rng.integers(len(templates))].format(city=city, word=words[rng.integers(len(words))])
+        for city in cities
+    ]
+    return questions, cities
+
+# ----------------------------------------
+# Stub models
+# ----------------------------------------
+
+class HashingEmbedder:
+    """A deterministic stand-in for SentenceTransformer.
+
+    Every lower-cased word is hashed to a signed dimension, so texts that share words get
+    similar vectors and retrieval returns meaningful neighbours, without any model download.
+    """
+
+    def __init__(self, model_name=None, dim=None, **kwargs):
+        from src.rag_airbnb_config import EMBEDDING_DIM
+        self.dim = dim or EMBEDDING_DIM
+        self._buckets = {}
+
+    def _bucket(self, word):
+        if word not in self._buckets:
+            h = zlib.crc32(word.encode("utf-8"))
+            self._buckets[word] = (h % self.dim, 1.0 if h & 0x80000000 else -1.0)
+        return self._buckets[word]
+
+    def encode(self, texts, normalize_embeddings=False, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        rows, columns, signs = [], [], []
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                column, sign = self._bucket(word.strip(".,!?:"))
+                rows.append(i)
+                columns.append(column)
+                signs.append(sign)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(vectors, (rows, columns), signs)
+        if normalize_embeddings:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[0] if single else vectors
+
+class WhitespaceTokenizer:
+    """A stand-in for the language model's tokenizer that counts words as tokens."""
+
+    def __call__(self, texts, add_special_tokens=False, **kwargs):
+        return {"input_ids": [text.split() for text in ([texts] if isinstance(texts, str) else texts)]}
+
+class StubLLM:
+    """A deterministic stand-in for the HuggingFacePipeline, answering without generating."""
+
+    def __init__(self):
+        self.pipeline = types.SimpleNamespace(tokenizer=WhitespaceTokenizer())
+
+    def invoke(self, prompt):
+        return f"Based on {len(prompt.split())} words of reviews: it depends on the area."
+
+    def batch(self, prompts):
+        return [self.invoke(prompt) for prompt in prompts]
+
+def write_sqlite_source(reviews_path, export_path):
+    """Loads the JSONL corpus into the review and listing tables of a SQLite review source."""
+    conn = sqlite3.connect(export_path)
+    conn.execute("CREATE TABLE fact_reviews (review_id INTEGER PRIMARY KEY, listing_id INTEGER, "
+                 "comments TEXT, review_lang TEXT)")
+    conn.execute("CREATE TABLE dim_listings (listing_id INTEGER PRIMARY KEY, property_city TEXT, property_country TEXT)")
+    with open(reviews_path) as f, conn:
+        for lines in iter(lambda: list(itertools.islice(f, 100000)), []):
+            reviews = [json.loads(line) for line in lines]
+            conn.executemany("INSERT INTO fact_reviews VALUES (?, ?, ?, ?)", (
+                (int(r["review_id"]), int(r["listing_id"]), r["text"], r["review_lang"]) for r in reviews
+            ))
+            conn.executemany("INSERT OR IGNORE INTO dim_listings VALUES (?, ?, ?)", (
+                (int(r["listing_id"]), r["city"], r["property_country"]) for r in reviews
+            ))
+    conn.close()
+
+def change_sqlite_source(export_path, fraction, seed=0):
+    """Deletes, edits and inserts `fraction` of the reviews of a SQLite review source, a third each.
+
+    Returns:
+        int: The number of changed reviews.
+    """
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(export_path)
+    total, max_id = conn.execute("SELECT COUNT(*), MAX(review_id) FROM fact_reviews").fetchone()
+    n = max(int(total * fraction / 3), 1)
+    picked = rng.choice(np.arange(1, max_id + 1), size=2 * n, replace=False).tolist()
+    listing = conn.execute("SELECT listing_id, review_lang FROM fact_reviews LIMIT 1").fetchone()
+    with conn:
+        conn.executemany("DELETE FROM fact_reviews WHERE review_id = ?", ((i,) for i in picked[:n]))
+        conn.executemany("UPDATE fact_reviews SET comments = comments || ' Edited after the stay.' "
+                         "WHERE review_id = ?", ((i,) for i in picked[n:]))
+        conn.executemany("INSERT INTO fact_reviews VALUES (?, ?, ?, ?)", (
+            (max_id + 1 + i, listing[0], f"A new review number {i}, written after the first load.", listing[1])
+            for i in range(n)
+        ))
+    conn.close()
+    return 3 * n
+
+def write_export(reviews_path, file_format):
+    """Converts the JSONL corpus into a Parquet, CSV or SQLite source read through REVIEW_SOURCE.
+
+    Returns:
+        str: The path of the export.
+    """
+    export_path = os.path.splitext(reviews_path)[0] + "." + file_format
+    if file_format == "sqlite":
+        write_sqlite_source(reviews_path, export_path)
+        return export_path
+
+    import pyarrow.csv
+    import pyarrow.json
+    import pyarrow.parquet
+
+    # Use the column names of the database, as a real export would.
+    table = pyarrow.json.read_json(reviews_path).rename_columns(
+        {"text": "comments", "city": "property_city"}
+    )
+    if file_format == "parquet":
+        pyarrow.parquet.write_table(table, export_path)
+    else:
+        pyarrow.csv.write_csv(table, export_path)
+    return export_path
+
+def install_stubs(reviews_path, source="jsonl"):
+    """Replaces the embedding model and the primary database with the local stand-ins.
+
+    Must run before the project modules are imported. Missing optional packages are
+    replaced by empty modules, since the benchmark never loads a model or connects to SQL Server.
+    With a `source` other than "jsonl", reviews are read through REVIEW_SOURCE instead of the
+    JSONL stand-in for the database.
+    """
+    for name in ("sentence_transformers", "pyodbc"):
+        try:
+            __import__(name)
+        except ImportError:
+            sys.modules[name] = types.ModuleType(name)
+    sys.modules["sentence_transformers"].SentenceTransformer = HashingEmbedder
+    if source != "jsonl":
+        return
+
+    import src.rag_airbnb_embedding as embedding
+    from src.rag_airbnb_config import BATCH_SIZE
+    embedding.iter_review_batches = lambda limit=0, start_after=None, chunk_size=BATCH_SIZE: (
+        file_review_batches(reviews_path, limit, start_after, chunk_size)
+    )
+
+# ----------------------------------------
+# Benchmark
+# ----------------------------------------
+
+def peak_rss_mb():
+    """Returns the peak resident memory of this process in MB, or None where unsupported."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+def path_size_mb(path):
+    """Returns the size of a file, or of every file under a directory, in MB."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files) / 2**20
+    return os.path.getsize(path) / 2**20 if os.path.exists(path) else 0.0
+
+def latency_stats(latencies):
+    """Summarizes per-query latencies given in seconds."""
+    latencies = np.array(latencies) * 1000
+    return {
+        "queries": len(latencies), "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+def run_size(rows, args):
+    """Benchmarks every pipeline stage on `rows` synthetic reviews in this process.
+
+    The SQLite cache, index and corpus live in a work directory given through the
+    environment (SQLITE_PATH, FAISS_INDEX_PATH), set by `benchmark` before starting this process.
+    """
+    stages = {}
+    reviews_path = os.path.join(args.workdir, "reviews.jsonl")
+    start = time.perf_counter()
+    unique_texts = generate_reviews(reviews_path, rows, seed=args.seed, duplicate_rate=args.duplicate_rate)
+    stages["generate"] = {"seconds": time.perf_counter() - start}
+    print(f"[+] Generated {rows} reviews ({unique_texts} distinct texts) in {stages['generate']['seconds']:.1f}s.")
+    if args.source != "jsonl":
+        # REVIEW_SOURCE_PATH, set by `benchmark`, names this export.
+        export_path = write_export(reviews_path, args.source)
+
+    install_stubs(reviews_path, args.source)
+    from src.rag_airbnb_config import SQLITE_PATH, FAISS_INDEX_PATH
+    from src.rag_airbnb_embedding import (
+        build_embeddings_with_sqlite, update_embeddings_with_sqlite, init_sqlite, load_all_embeddings_from_sqlite,
+    )
+    from src.rag_airbnb_faiss_index import (
+        build_faiss_index, update_faiss_index, load_faiss_index_and_metadata, retrieve_from_faiss, METADATA_PATH,
+    )
+    from src.rag_airbnb_llm import answer_queries
+
+    def timed(name, func, *func_args, **kwargs):
+        start = time.perf_counter()
+        result = func(*func_args, **kwargs)
+        seconds = time.perf_counter() - start
+        stages[name] = {"seconds": seconds, "rows_per_s": rows / seconds if seconds > 0 else 0.0}
+        print(f"[+] {name}: {seconds:.2f}s")
+        return result
+
+    embeddings, _, reviews = timed("build_embeddings_with_sqlite", build_embeddings_with_sqlite)
+    del embeddings, reviews
+    sqlite_conn = init_sqlite()
+    columns, embeddings = timed("load_all_embeddings_from_sqlite", load_all_embeddings_from_sqlite, sqlite_conn)
+    sqlite_conn.close()
+    from src.rag_airbnb_embedding import columns_to_records
+    index, store = timed("build_faiss_index", build_faiss_index, embeddings, columns_to_records(columns))
+    del columns, embeddings, index
+    store.close()
+    if args.source == "sqlite" and args.refresh_fraction > 0:
+        # A refresh after a small share of the reviews changed only reads and encodes the change.
+        changed = change_sqlite_source(export_path, args.refresh_fraction, seed=args.seed + 2)
+        print(f"[+] Deleted, edited and inserted {changed} reviews in the source.")
+        _, changes = timed("refresh_embeddings", update_embeddings_with_sqlite)
+        index, store = timed("refresh_index", update_faiss_index, *changes)
+        stages["refresh_embeddings"]["changed_rows"] = changed
+        del index
+        store.close()
+    index, store, embedder = timed("load_faiss_index_and_metadata", load_faiss_index_and_metadata)
+
+    questions, cities = benchmark_queries(args.queries, seed=args.seed + 1)
+    query_vectors = embedder.encode(questions, normalize_embeddings=True)
+    for name, filters_of in (("retrieve_from_faiss", lambda city: None),
+                             ("retrieve_from_faiss_filtered", lambda city: {"city": city})):
+        latencies = []
+        for question, vector, city in zip(questions, query_vectors, cities):
+            start = time.perf_counter()
+            # The question is passed so that RETRIEVAL_MODE=hybrid also times the keyword search.
+            retrieve_from_faiss(vector[None, :], index, store, embedder, top_k=args.top_k, filters=filters_of(city),
+                                query_text=question)
+            latencies.append(time.perf_counter() - start)
+        stages[name] = latency_stats(latencies)
+        print(f"[+] {name}: p50 {stages[name]['p50_ms']:.2f} ms, p95 {stages[name]['p95_ms']:.2f} ms")
+
+    start = time.perf_counter()
+    answer_queries(questions, index, store, embedder, StubLLM(), top_k=args.top_k)
+    seconds = time.perf_counter() - start
+    stages["answer_queries"] = {"seconds": seconds, "queries_per_s": len(questions) / seconds}
+    print(f"[+] answer_queries (stub LLM): {seconds:.2f}s for {len(questions)} questions")
+    store.close()
+
+    run = {
+        "rows": rows, "unique_texts": unique_texts, "stages": stages, "peak_rss_mb": peak_rss_mb(),
+        "files_mb": {
+            "sqlite": path_size_mb(SQLITE_PATH), "index": path_size_mb(FAISS_INDEX_PATH),
+            "metadata": path_size_mb(METADATA_PATH),
+        },
+    }
+    from src import rag_airbnb_metrics as metrics
+    if metrics.is_enabled():
+        # The time spent in each instrumented step, inside the stages timed above.
+        print(metrics.format_report())
+        run["metrics"] = metrics.snapshot()
+    return run
+
+def environment():
+    """Describes the software and settings the results were measured with."""
+    import faiss
+    from src.rag_airbnb_config import (
+        FAISS_INDEX_FACTORY, FAISS_QUANTIZATION, EMBEDDING_STORAGE, EMBEDDING_DIM, BATCH_SIZE, MAX_WORKERS,
+        REVIEW_SOURCE, RETRIEVAL_MODE,
+    )
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "git_commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+        "numpy": np.__version__, "faiss": faiss.__version__, "cpus": os.cpu_count(),
+        "index_factory": FAISS_INDEX_FACTORY, "quantization": FAISS_QUANTIZATION,
+        "embedding_storage": EMBEDDING_STORAGE, "embedding_dim": EMBEDDING_DIM,
+        "batch_size": BATCH_SIZE, "max_workers": MAX_WORKERS, "review_source": REVIEW_SOURCE,
+        "retrieval_mode": RETRIEVAL_MODE,
+    }
+
+def stage_metric(stage):
+    """Returns the value compared between runs: the duration, or the median query latency."""
+    return stage.get("seconds", stage.get("p50_ms"))
+
+def compare(results, baseline_path, tolerance):
+    """Prints the change of every stage against a previous results file.
+
+    Returns:
+        int: The number of stages that got slower by more than `tolerance`.
+    """
+    with open(baseline_path) as f:
+        baseline = {run["rows"]: run for run in json.load(f)["runs"]}
+    print(f"\n[+] Compared with {baseline_path}:")
+    print(f"{'rows':>9} {'stage':<32} {'before':>10} {'after':>10} {'change':>8}")
+    regressions = 0
+    for run in results["runs"]:
+        old_run = baseline.get(run["rows"])
+        if old_run is None:
+            continue
+        for name, stage in run["stages"].items():
+            if name not in old_run["stages"] or name == "generate":
+                continue
+            before, after = stage_metric(old_run["stages"][name]), stage_metric(stage)
+            change = after / before - 1 if before else 0.0
+            flag = ""
+            if change > tolerance:
+                regressions += 1
+                flag = " ⚠️"
+            print(f"{run['rows']:>9} {name:<32} {before:>10.3f} {after:>10.3f} {change:>+7.0%}{flag}")
+    return regressions
+
+def benchmark(args):
+    """Runs every size in a fresh process with its own work directory and collects the results."""
+    results = {"environment": None, "runs": []}
+    for rows in args.sizes:
+        workdir = tempfile.mkdtemp(prefix=f"pipeline_{rows}_")
+        part = os.path.join(workdir, "result.json")
+        env = {
+            **os.environ,
+            "SQLITE_PATH": os.path.join(workdir, "embeddings.db"),
+            "FAISS_INDEX_PATH": os.path.join(workdir, "reviews.index"),
+            # Read the whole corpus, encode in this process, and time every query.
+            "LIMIT": "0", "EMBED_PROCESSES": "0", "QUERY_CACHE_SIZE": "0",
+        }
+        # The JSONL stand-in is not ordered by review_id, so the cache is filled by a full read
+        # rather than synced (see rag_airbnb_sync.py).
+        env["REVIEW_SOURCE"] = args.source
+        if args.source != "jsonl":
+            env["REVIEW_SOURCE_PATH"] = os.path.join(workdir, f"reviews.{args.source}")
+        if args.metrics:
+            env.update({"METRICS_ENABLED": "true", "METRICS_LOG_PATH": os.path.join(workdir, "metrics.jsonl")})
+        print(f"\n[+] Benchmarking {rows} reviews in {workdir}...")
+        command = [
+            sys.executable, os.path.abspath(__file__), "--worker", "--sizes", str(rows), "--workdir", workdir,
+            "--output", part, "--queries", str(args.queries), "--top-k", str(args.top_k),
+            "--seed", str(args.seed), "--duplicate-rate", str(args.duplicate_rate), "--source", args.source,
+            "--refresh-fraction", str(args.refresh_fraction),
+        ]
+        try:
+            completed = subprocess.run(command, env=env)
+            if completed.returncode != 0:
+                print(f"❌ The {rows}-review run failed with exit code {completed.returncode}.")
+                continue
+            with open(part) as f:
+                worker = json.load(f)
+            results["environment"] = worker["environment"]
+            results["runs"].append(worker["run"])
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'rows':>9} {'stage':<32} {'seconds':>9} {'rows/s':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for run in results["runs"]:
+        for name, stage in run["stages"].items():
+            seconds = f"{stage['seconds']:.2f}" if "seconds" in stage else ""
+            rate = f"{stage['rows_per_s']:.0f}" if "rows_per_s" in stage else ""
+            p50 = f"{stage['p50_ms']:.2f}" if "p50_ms" in stage else ""
+            p95 = f"{stage['p95_ms']:.2f}" if "p95_ms" in stage else ""
+            print(f"{run['rows']:>9} {name:<32} {seconds:>9} {rate:>10} {p50:>8} {p95:>8}")
+        rss = f"{run['peak_rss_mb']:.0f} MB" if run["peak_rss_mb"] is not None else "n/a"
+        print(f"{run['rows']:>9} {'peak RSS':<32} {rss:>9}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[+] Results saved to {args.output}")
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        print(f"⚠️ Some stages are more than {args.tolerance:.0%} slower than the baseline.")
+        return results, 1
+    return results, 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the embedding, indexing and retrieval pipeline end to end on a synthetic review "
+                    "corpus, with stub models and no database."
+    )
+    parser.add_argument("--sizes", type=lambda s: [int(v) for v in s.split(",")], default=DEFAULT_SIZES,
+                        help="Comma-separated numbers of reviews to benchmark.")
+    parser.add_argument("--queries", type=int, default=200, help="Number of questions timed per size.")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05, help="Fraction of reviews with a duplicate text.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--source", default="jsonl", choices=["jsonl", "parquet", "csv", "sqlite"],
+                        help="Read the corpus from a JSONL stand-in for the database, from a Parquet or CSV "
+                             "export (needs pyarrow) or from a SQLite copy of the tables, through REVIEW_SOURCE.")
+    parser.add_argument("--refresh-fraction", type=float, default=0.01,
+                        help="With --source sqlite, also time a refresh after this fraction of the reviews "
+                             "were deleted, edited or inserted (0 to skip).")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Also record the per-step spans and token counts of the pipeline (see rag_airbnb_metrics).")
+    parser.add_argument("--keep", action="store_true", help="Keep the work directories with the corpus, cache and index.")
+    parser.add_argument("--output", help="Optional path of a JSON file to write the results to.")
+    parser.add_argument("--baseline", help="A previous results file to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative slowdown against --baseline reported as a regression.")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run = run_size(args.sizes[0], args)
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "run": run}, f)
+    else:
+        _, status = benchmark(args)
+        sys.exit(status)
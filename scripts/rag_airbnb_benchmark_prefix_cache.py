@@ -0,0 +1,102 @@
+import argparse
+import sys
+import os
+import time
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+
+# Add project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.rag_airbnb_config import GEN_MODEL
+from src.rag_airbnb_llm import PromptPrefixCache, build_prompt
+
+# Questions and reviews used to build realistic prompts.
+QUESTIONS = [
+    "Is Montmartre a safe area to stay in?",
+    "Are there any reviews that mention a good view of the Eiffel Tower?",
+    "What are the best restaurants near the Louvre?",
+    "Is the neighbourhood noisy at night?",
+]
+REVIEWS = [
+    {"listing_id": "12345", "text": "The apartment was very clean and modern. The host was responsive and the check-in was easy."},
+    {"listing_id": "67890", "text": "Great location, close to the metro. The street can be noisy on weekends but the windows are good."},
+    {"listing_id": "24680", "text": "Beautiful view from the balcony. Lots of bakeries and small restaurants around the corner."},
+]
+
+def generate(model, tokenizer, inputs, max_new_tokens, cache_kwargs=None):
+    """Runs greedy generation and returns the generated token IDs."""
+    with torch.no_grad():
+        output = model.generate(
+            **inputs, **(cache_kwargs or {}), max_new_tokens=max_new_tokens, do_sample=False,
+            pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
+        )
+    return output[0, inputs["input_ids"].shape[1]:].tolist()
+
+def time_prefill(model, tokenizer, inputs, runs, cache=None):
+    """Returns the median time of generating one token, i.e. of the prefill, in milliseconds.
+
+    With `cache`, the time includes copying the prefix cache, as a real request would.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        cache_kwargs = cache.generation_kwargs(inputs["input_ids"]) if cache is not None else None
+        generate(model, tokenizer, inputs, 1, cache_kwargs)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+def benchmark(args):
+    """Checks that prefix caching leaves the output unchanged and measures the prefill time it saves.
+
+    Returns:
+        bool: True if every cached generation matched the uncached one token for token.
+    """
+    torch.set_num_threads(args.threads or torch.get_num_threads())
+    print(f"[+] Loading {args.model} on CPU...")
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32)
+    model.eval()
+
+    start = time.perf_counter()
+    cache = PromptPrefixCache(model, tokenizer)
+    print(f"[+] Prefix of {cache.prefix_ids.shape[1]} tokens cached in {time.perf_counter() - start:.2f}s.")
+
+    all_identical = True
+    print(f"\n{'prompt tokens':>13} {'cached':>7} {'identical':>10} {'prefill ms':>11} {'cached ms':>10} {'speedup':>8}")
+    for question in QUESTIONS:
+        prompt = build_prompt(question, REVIEWS)
+        inputs = tokenizer(prompt, return_tensors="pt")
+
+        # Correctness: greedy decoding must produce exactly the same tokens with and without the cache.
+        expected = generate(model, tokenizer, inputs, args.max_new_tokens)
+        cache_kwargs = cache.generation_kwargs(inputs["input_ids"])
+        actual = generate(model, tokenizer, inputs, args.max_new_tokens, cache_kwargs)
+        identical = actual == expected
+        all_identical &= identical
+
+        # Speed: the prefill (time to the first token) with and without the cache.
+        generate(model, tokenizer, inputs, 1)  # Warm-up.
+        uncached_ms = time_prefill(model, tokenizer, inputs, args.runs)
+        cached_ms = time_prefill(model, tokenizer, inputs, args.runs, cache) if cache_kwargs else uncached_ms
+        print(f"{inputs['input_ids'].shape[1]:>13} {'yes' if cache_kwargs else 'no':>7} "
+              f"{'yes' if identical else 'NO':>10} {uncached_ms:>11.1f} {cached_ms:>10.1f} "
+              f"{uncached_ms / cached_ms:>7.2f}x")
+
+    if all_identical:
+        print("\n✅ Cached and uncached generation produced identical output.")
+    else:
+        print("\n❌ Cached generation differs from uncached generation.")
+    return all_identical
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Verify and benchmark the key/value cache of the fixed prompt prefix on CPU."
+    )
+    parser.add_argument("--model", default=GEN_MODEL, help="The generative model to test.")
+    parser.add_argument("--max-new-tokens", type=int, default=32,
+                        help="The number of tokens compared between cached and uncached generation.")
+    parser.add_argument("--runs", type=int, default=5, help="The number of timed prefills per prompt.")
+    parser.add_argument("--threads", type=int, default=0, help="The number of CPU threads (0 keeps the default).")
+    sys.exit(0 if benchmark(parser.parse_args()) else 1)
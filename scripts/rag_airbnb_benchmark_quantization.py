@@ -0,0 +1,114 @@
+import argparse
+import json
+import sys
+import os
+import time
+
+import faiss
+import numpy as np
+
+# Add project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.rag_airbnb_config import FAISS_INDEX_FACTORY, FAISS_METRIC, EMBEDDING_DIM
+from src.rag_airbnb_embedding import STORAGE_FORMATS, embedding_to_blob, blob_to_embedding
+from src.rag_airbnb_faiss_index import create_faiss_index, quantized_factory
+
+def load_vectors(synthetic, dim):
+    """Loads the cached review embeddings, or generates clustered synthetic ones."""
+    if synthetic:
+        # Gaussian clusters on the unit sphere roughly mimic the topical structure of reviews.
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((max(synthetic // 500, 1), dim)).astype(np.float32)
+        vectors = centers[rng.integers(0, len(centers), synthetic)]
+        vectors += 0.5 * rng.standard_normal(vectors.shape).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    from src.rag_airbnb_embedding import init_sqlite, load_all_embeddings_from_sqlite, model_storage
+    sqlite_conn = init_sqlite()
+    storage = model_storage(sqlite_conn)
+    _, vectors = load_all_embeddings_from_sqlite(sqlite_conn)
+    sqlite_conn.close()
+    if storage != "float32":
+        print(f"⚠️ The cache stores {storage} vectors; recall is measured against those, not full precision.")
+    return vectors
+
+def recall_at_k(I, ground_truth, top_k):
+    """Returns the mean fraction of the exact top-k neighbours found by the approximate search."""
+    hits = sum(len(set(found[:top_k]) & set(exact[:top_k])) for found, exact in zip(I, ground_truth))
+    return hits / (len(ground_truth) * top_k)
+
+def benchmark(args):
+    """Measures the recall@k lost by each cache storage format and index quantization."""
+    vectors = load_vectors(args.synthetic, EMBEDDING_DIM)
+    if len(vectors) <= args.queries:
+        print(f"❌ Need more than {args.queries} vectors, found {len(vectors)}.")
+        return []
+
+    # Hold the last vectors out of the corpus and use them as full-precision queries.
+    corpus, queries = vectors[:-args.queries], np.ascontiguousarray(vectors[-args.queries:])
+    ids = np.arange(len(corpus), dtype=np.int64)
+    print(f"[+] Measuring on {len(corpus)} vectors with {len(queries)} queries, top_k={args.top_k}, "
+          f"index={args.factory}, metric={args.metric}.")
+
+    flat = create_faiss_index(corpus, ids, index_factory="Flat", metric=args.metric)
+    _, ground_truth = flat.search(queries, args.top_k)
+    results = []
+
+    # Cache storage: round-trip every vector through the format and search the result exactly.
+    for storage in args.storage:
+        start = time.perf_counter()
+        blobs = [embedding_to_blob(v, storage) for v in corpus]
+        decoded = np.stack([blob_to_embedding(b, storage) for b in blobs])
+        elapsed = time.perf_counter() - start
+        _, I = create_faiss_index(decoded, ids, index_factory="Flat", metric=args.metric).search(queries, args.top_k)
+        results.append({
+            "kind": "cache", "variant": storage, "recall": recall_at_k(I, ground_truth, args.top_k),
+            "bytes_per_vector": len(blobs[0]), "memory_mb": sum(map(len, blobs)) / 2**20, "build_s": elapsed,
+        })
+
+    # Index quantization: build the configured index type with each encoding.
+    for quantization in args.quantization:
+        factory = quantized_factory(args.factory, quantization)
+        start = time.perf_counter()
+        index = create_faiss_index(corpus, ids, index_factory=factory, metric=args.metric)
+        build_s = time.perf_counter() - start
+        memory = len(faiss.serialize_index(index))
+        _, I = index.search(queries, args.top_k)
+        results.append({
+            "kind": "index", "variant": f"{quantization} ({factory})", "recall": recall_at_k(I, ground_truth, args.top_k),
+            "bytes_per_vector": memory / len(corpus), "memory_mb": memory / 2**20, "build_s": build_s,
+        })
+
+    print(f"\n{'kind':<6} {'variant':<26} {'recall@k':>9} {'loss':>7} {'B/vector':>9} {'MB':>9} {'build s':>8}")
+    for r in results:
+        print(f"{r['kind']:<6} {r['variant']:<26} {r['recall']:>9.3f} {1 - r['recall']:>7.3f} "
+              f"{r['bytes_per_vector']:>9.1f} {r['memory_mb']:>9.1f} {r['build_s']:>8.1f}")
+    print("\nrecall@k is the fraction of the exact float32 top-k that was retrieved; the index "
+          "memory includes the review IDs (8 bytes per vector).")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[+] Results saved to {args.output}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the recall@k lost by quantizing the embeddings cache and the FAISS index."
+    )
+    parser.add_argument("--factory", default=FAISS_INDEX_FACTORY,
+                        help="The FAISS index factory string the quantizations are applied to.")
+    parser.add_argument("--metric", default=FAISS_METRIC, choices=["ip", "l2"])
+    parser.add_argument("--storage", type=lambda s: s.split(","), default=list(STORAGE_FORMATS),
+                        help="Comma-separated cache storage formats to measure.")
+    parser.add_argument("--quantization", type=lambda s: s.split(","),
+                        default=["none", "fp16", "sq8", "sq4", f"pq{EMBEDDING_DIM // 8}"],
+                        help="Comma-separated FAISS_QUANTIZATION values to measure.")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000, help="Number of held-out query vectors.")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Measure on this many synthetic vectors instead of the SQLite cache.")
+    parser.add_argument("--output", help="Optional path of a JSON file to write the results to.")
+    benchmark(parser.parse_args())
@@ -0,0 +1,138 @@
+import argparse
+import json
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+# Add project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.rag_airbnb_config import (
+    FAISS_INDEX_FACTORY, FAISS_METRIC, EMBEDDING_DIM, FAISS_LISTING_CANDIDATES, FAISS_LISTING_VECTORS,
+    FAISS_LISTING_MAX_REVIEWS,
+)
+from src.rag_airbnb_faiss_index import ListingIndex, create_faiss_index, search_faiss_ids, search_two_stage
+from src.rag_airbnb_metadata_store import ReviewMetadataStore, write_metadata_store
+
+def load_reviews(synthetic, listings, dim):
+    """Loads the cached review embeddings and listings, or generates clustered synthetic ones.
+
+    Returns:
+        tuple[np.ndarray, list[str]]: The normalized embeddings and the listing of each review.
+    """
+    if synthetic:
+        # Reviews of the same listing scatter around the listing's own topic vector, and the
+        # number of reviews per listing is skewed, as in the real data.
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((listings, dim)).astype(np.float32)
+        owners = np.minimum(rng.zipf(1.5, synthetic) - 1, listings - 1)
+        owners = rng.permutation(listings)[owners]
+        vectors = centers[owners] + 1.5 * rng.standard_normal((synthetic, dim)).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors, [str(o) for o in owners]
+
+    from src.rag_airbnb_embedding import init_sqlite, load_all_embeddings_from_sqlite
+    sqlite_conn = init_sqlite()
+    columns, vectors = load_all_embeddings_from_sqlite(sqlite_conn)
+    sqlite_conn.close()
+    return vectors, [str(l) for l in columns["listing_id"]]
+
+def measure(search, queries, top_k):
+    """Runs `search` one query at a time and returns the results and latencies in milliseconds."""
+    results, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(search(q[None, :])[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(results), np.array(latencies)
+
+def diversity(I, listing_of):
+    """Returns the mean number of distinct listings among the retrieved reviews of each query."""
+    return float(np.mean([len({listing_of[i] for i in row.tolist() if i >= 0}) for row in I]))
+
+def benchmark(args):
+    """Compares single-stage review retrieval with two-stage listing-then-review retrieval."""
+    vectors, listing_ids = load_reviews(args.synthetic, args.listings, EMBEDDING_DIM)
+    if len(vectors) <= args.queries:
+        print(f"❌ Need more than {args.queries} vectors, found {len(vectors)}.")
+        return []
+
+    # Hold the last reviews out of the corpus and use them as queries.
+    corpus, queries = vectors[:-args.queries], np.ascontiguousarray(vectors[-args.queries:])
+    corpus_listings = listing_ids[:-args.queries]
+    ids = np.arange(len(corpus), dtype=np.int64)
+    print(f"[+] Benchmarking on {len(corpus)} reviews of {len(set(corpus_listings))} listings "
+          f"with {len(queries)} queries, top_k={args.top_k}, index={args.factory}.")
+
+    start = time.perf_counter()
+    index = create_faiss_index(corpus, ids, index_factory=args.factory, metric=args.metric)
+    exact = create_faiss_index(corpus, ids, index_factory="Flat", metric=args.metric)
+    listing_index = ListingIndex.build(corpus, corpus_listings, args.vectors_per_listing, args.metric)
+    print(f"[+] Indexes built in {time.perf_counter() - start:.1f}s "
+          f"({listing_index.index.ntotal} listing vectors).")
+
+    # The listing column is needed to restrict the second stage and to cap reviews per listing.
+    store_dir = tempfile.mkdtemp(prefix="two_stage_")
+    write_metadata_store(
+        os.path.join(store_dir, "meta"),
+        ((i, {"review_id": str(i), "text": "", "listing_id": l}) for i, l in enumerate(corpus_listings)),
+        columns=["review_id", "text", "listing_id"], categorical=["listing_id"],
+    )
+    store = ReviewMetadataStore(os.path.join(store_dir, "meta"))
+
+    ground_truth, _ = measure(lambda q: search_faiss_ids(q, exact, args.top_k), queries, args.top_k)
+    modes = {"single-stage": lambda q: search_faiss_ids(q, index, args.top_k)}
+    for n_listings in args.n_listings:
+        modes[f"two-stage L={n_listings}"] = lambda q, n=n_listings: search_two_stage(
+            q, index, store, listing_index, args.top_k, n_listings=n, max_per_listing=args.max_per_listing,
+        )
+
+    results = []
+    for name, search in modes.items():
+        search(queries[:1])  # Warm-up.
+        I, latencies = measure(search, queries, args.top_k)
+        overlap = sum(len(set(found.tolist()) & set(truth.tolist())) for found, truth in zip(I, ground_truth))
+        results.append({
+            "mode": name, "p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95)),
+            "distinct_listings": diversity(I, corpus_listings), "overlap": overlap / (len(queries) * args.top_k),
+        })
+    store.close()
+    shutil.rmtree(store_dir)
+
+    print(f"\n{'mode':<20} {'p50 ms':>8} {'p95 ms':>8} {'listings@k':>11} {'overlap@k':>10}")
+    for r in results:
+        print(f"{r['mode']:<20} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} "
+              f"{r['distinct_listings']:>11.2f} {r['overlap']:>10.3f}")
+    print("\nlistings@k is the mean number of distinct listings in the top-k; overlap@k is the "
+          "fraction of the exact single-stage top-k that was also retrieved.")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[+] Results saved to {args.output}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the latency and listing diversity of single-stage and two-stage retrieval."
+    )
+    parser.add_argument("--factory", default=FAISS_INDEX_FACTORY, help="The FAISS index factory string of the review index.")
+    parser.add_argument("--metric", default=FAISS_METRIC, choices=["ip", "l2"])
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=500, help="Number of held-out reviews used as queries.")
+    parser.add_argument("--n-listings", type=lambda s: [int(v) for v in s.split(",")],
+                        default=[FAISS_LISTING_CANDIDATES], help="Comma-separated numbers of listings selected by the first stage.")
+    parser.add_argument("--vectors-per-listing", type=int, default=FAISS_LISTING_VECTORS,
+                        help="The number of vectors per listing (1 = centroid, more = medoids).")
+    parser.add_argument("--max-per-listing", type=int, default=FAISS_LISTING_MAX_REVIEWS,
+                        help="The maximum number of reviews per listing in two-stage results (0 = no cap).")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Benchmark on this many synthetic reviews instead of the SQLite cache.")
+    parser.add_argument("--listings", type=int, default=2000, help="The number of listings of the synthetic reviews.")
+    parser.add_argument("--output", help="Optional path of a JSON file to write the results to.")
+    benchmark(parser.parse_args())
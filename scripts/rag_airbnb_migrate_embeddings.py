@@ -0,0 +1,94 @@
+import json
+import sqlite3
+import sys
+import os
+
+# Add project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.rag_airbnb_config import SQLITE_PATH, ID_COLUMN
+from src.rag_airbnb_embedding import embedding_to_blob, EMBEDDING_DTYPE, EMBEDDING_FORMAT
+
+# Number of rows converted per transaction.
+CHUNK_SIZE = 10000
+
+def migrate_embeddings(sqlite_path):
+    """Converts a JSON-encoded embeddings cache to raw float32 BLOBs in place.
+
+    Older versions stored every vector as `json.dumps(embedding.tolist())`. This rewrites
+    those rows chunk by chunk, records the format in the `cache_metadata` table and
+    vacuums the file to give the freed space back. Rows that are already binary are left
+    untouched, so an interrupted migration can simply be run again.
+    """
+    if not os.path.exists(sqlite_path):
+        print(f"❌ SQLite cache not found: {sqlite_path}")
+        return
+
+    conn = sqlite3.connect(sqlite_path)
+    has_legacy_table = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'embeddings'"
+    ).fetchone() is not None
+    if not has_legacy_table:
+        # Caches written since embeddings were deduplicated by text are always binary.
+        print(f"✅ {sqlite_path} is already up to date.")
+        conn.close()
+        return
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+
+    total = conn.execute("SELECT COUNT(*) FROM embeddings WHERE typeof(embedding) = 'text'").fetchone()[0]
+    print(f"[+] Found {total} JSON-encoded embeddings in {sqlite_path}.")
+
+    dim = None
+    converted = 0
+    while True:
+        rows = conn.execute(
+            f"SELECT {ID_COLUMN}, embedding FROM embeddings WHERE typeof(embedding) = 'text' LIMIT ?",
+            (CHUNK_SIZE,),
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for review_id, embedding_json in rows:
+            embedding = json.loads(embedding_json)
+            if dim is None:
+                dim = len(embedding)
+            elif len(embedding) != dim:
+                print(f"❌ Embedding for {review_id} has {len(embedding)} dimensions, expected {dim}. Aborting.")
+                conn.rollback()
+                conn.close()
+                return
+            updates.append((embedding_to_blob(embedding), review_id))
+        conn.executemany(f"UPDATE embeddings SET embedding = ? WHERE {ID_COLUMN} = ?", updates)
+        conn.commit()
+        converted += len(updates)
+        print(f"[+] Converted {converted}/{total} embeddings...")
+
+    if dim is None:
+        # Nothing to convert; take the dimension from an existing binary row, if any.
+        row = conn.execute("SELECT embedding FROM embeddings LIMIT 1").fetchone()
+        dim = len(row[0]) // EMBEDDING_DTYPE.itemsize if row else None
+
+    if dim is not None:
+        conn.executemany(
+            "INSERT OR REPLACE INTO cache_metadata (key, value) VALUES (?, ?)",
+            [
+                ("embedding_format", EMBEDDING_FORMAT),
+                ("embedding_dtype", EMBEDDING_DTYPE.str),
+                ("embedding_dim", str(dim)),
+            ],
+        )
+        conn.commit()
+
+    # Reclaim the space freed by the much smaller binary encoding.
+    print("[+] Vacuuming the database...")
+    conn.execute("VACUUM")
+    conn.close()
+    print(f"✅ Migration complete: {converted} embeddings converted.")
+
+if __name__ == "__main__":
+    migrate_embeddings(sys.argv[1] if len(sys.argv) > 1 else SQLITE_PATH)
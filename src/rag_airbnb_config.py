@@ -21,8 +21,28 @@ MDF_FILE_PATH = os.getenv("MDF_FILE_PATH", r"D:\SQLData\AirbnbDataWarehouse.mdf"
 ODBC_DRIVER = os.getenv("ODBC_DRIVER", "ODBC Driver 17 for SQL Server")
 # The name of the table containing the review data.
 TABLE = os.getenv("TABLE", "fact_reviews")
+# The name of the table with one row per listing, joined to the reviews for their city and country.
+LISTINGS_TABLE = os.getenv("LISTINGS_TABLE", "dim_listings")
 # The maximum number of reviews to load initially from the database. Set to 0 to load all reviews.
 LIMIT = int(os.getenv("LIMIT", 3000))
+# Where reviews are read from: "sqlserver" (the database above), "sqlite" (a local copy of the TABLE
+# and LISTINGS_TABLE tables), "parquet" or "csv" (an export of the joined review columns, see README).
+REVIEW_SOURCE = os.getenv("REVIEW_SOURCE", "sqlserver").lower()
+# The SQLite database file, or the Parquet/CSV file or directory of files, read by the other sources.
+REVIEW_SOURCE_PATH = os.getenv("REVIEW_SOURCE_PATH", "")
+# Only load reviews in these languages or listing cities (comma-separated, empty for all). The
+# filters are applied by the source (SQL WHERE clause or Parquet row-group statistics), so reviews
+# that are left out are never transferred.
+REVIEW_LANGUAGES = [v.strip() for v in os.getenv("REVIEW_LANGUAGES", "").split(",") if v.strip()]
+REVIEW_CITIES = [v.strip() for v in os.getenv("REVIEW_CITIES", "").split(",") if v.strip()]
+# The number of reviews per checksum range of the change capture of the "sqlserver" and "sqlite"
+# sources. A refresh compares each range's row count and checksum with the source and only re-reads
+# the ranges that changed, so edited and deleted reviews are found without reading every review.
+SYNC_RANGE_SIZE = int(os.getenv("SYNC_RANGE_SIZE", 10000))
+# An optional column of TABLE with the time each review was last modified. When set, ranges are
+# compared by their latest modification time, which an index can answer, instead of a checksum of
+# their text. Deleted reviews are still found by the row counts.
+REVIEW_MODIFIED_COLUMN = os.getenv("REVIEW_MODIFIED_COLUMN", "")
 
 # --- Model and Index Configuration ---
 # These settings define the models and file paths for the RAG pipeline components.
@@ -33,6 +53,118 @@ FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "reviews_hf.index")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 # The name of the generative model to use for answering questions.
 GEN_MODEL = os.getenv("GEN_MODEL", "google/gemma-2b-it")
+# The maximum number of tokens generated per answer.
+GEN_MAX_NEW_TOKENS = int(os.getenv("GEN_MAX_NEW_TOKENS", 512))
+# Strings that end an answer as soon as the model produces them, separated by "|"
+# (e.g. "Question:|</s>"). Empty by default.
+GEN_STOP_SEQUENCES = [s for s in os.getenv("GEN_STOP_SEQUENCES", "").split("|") if s]
+# Whether to precompute the key/value cache of the fixed instruction block of the prompt at
+# model load, so that each streamed answer only prefills the retrieved context and the question.
+GEN_PREFIX_CACHE = os.getenv("GEN_PREFIX_CACHE", "true").lower() in ("1", "true", "yes")
+# The number of prompts the generative model processes together (padded to a common length)
+# when answering questions in batch mode.
+GEN_BATCH_SIZE = int(os.getenv("GEN_BATCH_SIZE", 8))
+# The number of questions read, encoded and searched together in batch mode (--batch).
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", 256))
+# The FAISS index type, as a FAISS index factory string. "Flat" is exact search; approximate
+# alternatives include "IVF1024,Flat", "HNSW32" or "IVF1024,PQ32". Use
+# scripts/rag_airbnb_benchmark_index.py to compare recall and speed on your corpus.
+# Changing the index type takes effect on the next index update (menu option 1); changing
+# the metric takes effect on the next full rebuild (menu option 2).
+FAISS_INDEX_FACTORY = os.getenv("FAISS_INDEX_FACTORY", "Flat")
+# Compression of the vectors inside the FAISS index, replacing the "Flat" storage of
+# FAISS_INDEX_FACTORY: "none", "fp16" (half the memory), "sq8" (a quarter), "sq4" (an eighth)
+# or "pq<m>" (m bytes per vector; m must divide EMBEDDING_DIM, e.g. "pq48"). Use
+# scripts/rag_airbnb_benchmark_quantization.py to measure the recall lost on your corpus.
+FAISS_QUANTIZATION = os.getenv("FAISS_QUANTIZATION", "none").lower()
+# The similarity metric of the FAISS index: "ip" (inner product) or "l2". Embeddings are
+# normalized, so inner product equals cosine similarity. Changing it rebuilds the index on the next update.
+FAISS_METRIC = os.getenv("FAISS_METRIC", "ip")
+# The maximum number of embeddings sampled to train index types that need training (e.g., IVF, PQ).
+FAISS_TRAIN_SAMPLE_SIZE = int(os.getenv("FAISS_TRAIN_SAMPLE_SIZE", 100000))
+# The number of IVF lists probed per query (IVF indexes only). Higher is slower but more accurate.
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", 16))
+# The size of the HNSW candidate list per query (HNSW indexes only). Higher is slower but more accurate.
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", 64))
+# Filtered searches (e.g. by city) that match at most this many reviews are scored exactly
+# against just those vectors; larger filters restrict the index search itself with an ID selector.
+FAISS_FILTER_EXACT_MAX = int(os.getenv("FAISS_FILTER_EXACT_MAX", 20000))
+# Two-stage retrieval first selects the listings whose aggregate vectors are closest to the query
+# in a small per-listing index, then searches only the reviews of those listings.
+FAISS_TWO_STAGE = os.getenv("FAISS_TWO_STAGE", "false").lower() in ("1", "true", "yes")
+# The number of listings selected by the first stage of two-stage retrieval.
+FAISS_LISTING_CANDIDATES = int(os.getenv("FAISS_LISTING_CANDIDATES", 20))
+# The number of vectors representing each listing: 1 stores the centroid of its reviews,
+# more stores that many medoids (the reviews closest to k-means centres within the listing).
+FAISS_LISTING_VECTORS = int(os.getenv("FAISS_LISTING_VECTORS", 1))
+# The maximum number of reviews of the same listing returned by two-stage retrieval. 0 means no cap.
+FAISS_LISTING_MAX_REVIEWS = int(os.getenv("FAISS_LISTING_MAX_REVIEWS", 2))
+# How reviews are retrieved: "dense" searches the FAISS index only; "hybrid" merges the FAISS
+# results with keyword (BM25) matches from the SQLite full-text index by reciprocal-rank fusion;
+# "lexical_filter" searches the vectors of the keyword matches only, falling back to the FAISS
+# search when there are too few of them.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense").lower()
+# The number of keyword and vector candidates per query merged by the hybrid retrieval modes.
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 50))
+# The constant k of reciprocal-rank fusion: each candidate scores 1 / (k + rank) per ranking.
+# Larger values flatten the difference between the top ranks.
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+# Keywords found in more than this fraction of the reviews are left out of the keyword search.
+# They add little to the BM25 ranking, but every review they match must be scored.
+HYBRID_MAX_TERM_SHARE = float(os.getenv("HYBRID_MAX_TERM_SHARE", 0.05))
+# Incremental index updates are appended to a delta log next to the index. Once the log holds
+# more changes than this fraction of the indexed vectors, the index is compacted into a new base file.
+FAISS_DELTA_COMPACT_RATIO = float(os.getenv("FAISS_DELTA_COMPACT_RATIO", 0.2))
+
+# --- Query Cache Configuration ---
+# These settings control the in-memory cache of query embeddings and retrieval results.
+
+# The maximum number of distinct queries kept in the cache. Set to 0 to disable the cache.
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+# The number of seconds a cached query stays valid.
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 3600))
+
+# --- Prompt Context Configuration ---
+# These settings control how the retrieved reviews are packed into the prompt.
+
+# The maximum number of tokens (of the generative model) the reviews may take in the prompt.
+# Set to 0 to paste the full text of the top-k reviews without any packing.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1024))
+# Reviews longer than this number of tokens are trimmed to their sentences most relevant to the question.
+CONTEXT_MAX_REVIEW_TOKENS = int(os.getenv("CONTEXT_MAX_REVIEW_TOKENS", 256))
+# The maximum number of reviews of the same listing in the context. 0 means no cap.
+CONTEXT_MAX_PER_LISTING = int(os.getenv("CONTEXT_MAX_PER_LISTING", 2))
+# Reviews whose embeddings are at least this similar (cosine) to an already selected review are dropped.
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.95))
+# The number of candidates retrieved per context slot, so that dropped reviews can be replaced.
+CONTEXT_CANDIDATE_FACTOR = int(os.getenv("CONTEXT_CANDIDATE_FACTOR", 2))
+
+# --- HTTP Server Configuration ---
+# These settings control the local HTTP service started with `rag_airbnb_main.py --serve`.
+
+# The interface and TCP port the server listens on.
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
+# The maximum number of questions answered together in one batched encode/search/generate call.
+SERVER_MAX_BATCH_SIZE = int(os.getenv("SERVER_MAX_BATCH_SIZE", 8))
+# The maximum number of milliseconds the first question of a batch waits for others to join it.
+SERVER_MAX_WAIT_MS = float(os.getenv("SERVER_MAX_WAIT_MS", 20))
+# The number of seconds after which a request is answered with a timeout error.
+SERVER_REQUEST_TIMEOUT = float(os.getenv("SERVER_REQUEST_TIMEOUT", 300))
+# The maximum number of requests queued or in progress; further requests are rejected with 503.
+SERVER_MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", 64))
+# The largest top_k a request may ask for; larger values are rejected with 400.
+SERVER_MAX_TOP_K = int(os.getenv("SERVER_MAX_TOP_K", 100))
+
+# --- Instrumentation Configuration ---
+# Record the time of every pipeline stage, token counts and peak memory (see rag_airbnb_metrics.py).
+# Off by default, in which case the instrumentation costs a flag check per stage. The --metrics
+# and --profile flags of rag_airbnb_main.py turn it on for one run.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+# The file one JSON line per finished stage is appended to while metrics are on ("" for none).
+METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH", "rag_metrics.jsonl")
+# The file the metrics are written to in the Prometheus text format when the application exits.
+METRICS_PROMETHEUS_PATH = os.getenv("METRICS_PROMETHEUS_PATH", "rag_metrics.prom")
 
 # --- SQLite Embedding Cache Configuration ---
 # These settings are for the SQLite database used to cache review embeddings, avoiding re-computation.
@@ -43,10 +175,31 @@ SQLITE_PATH = os.getenv("SQLITE_PATH", "hugging_airbnb_embeddings.db")
 ID_COLUMN = os.getenv("ID_COLUMN", "review_id")
 # The dimension of the embeddings generated by the EMBED_MODEL.
 EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 384))
+# How vectors are stored in the SQLite cache: "float32" (exact), "float16" (half the size) or
+# "int8" (about a quarter, with one scale per vector). The cache is converted when this changes.
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32").lower()
+# Whether the cache keeps an FTS5 full-text index of the review texts, used by the hybrid
+# RETRIEVAL_MODE values. It is built when turned on and dropped when turned off; keeping it
+# up to date adds to the cost of writing reviews.
+FTS_INDEX = os.getenv("FTS_INDEX", "true").lower() in ("1", "true", "yes")
 # The number of reviews to process in each batch during embedding generation.
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", 1000))
-# The maximum number of concurrent workers to use for embedding generation (if applicable).
+# The number of encoder threads in the ingest pipeline. The model already parallelizes each
+# encode call, so values above 1 mainly help keep a GPU busy; lower it if CPU cores are oversubscribed.
 MAX_WORKERS = int(os.getenv("MAX_WORKERS", 5))
+# The number of worker processes to spread embedding across, each with its own copy of the model.
+# Set this on CPU-only machines where a single encode call does not use every core. 0 encodes
+# in threads of the main process instead (see MAX_WORKERS).
+EMBED_PROCESSES = int(os.getenv("EMBED_PROCESSES", 0))
+# The maximum number of batches waiting between two stages of the ingest pipeline.
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 4))
+# The SQLite `synchronous` pragma for the cache. NORMAL is safe with WAL journaling and
+# avoids an fsync on every commit; use FULL for maximum durability.
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+# The SQLite page cache size in KiB.
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 65536))
+# The maximum number of bytes of the cache file SQLite may memory-map (0 disables mmap).
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 268435456))
 
 # --- .env File Example ---
 # For easy setup, create a .env file in the project root and add the following variables,
@@ -55,12 +208,61 @@ MAX_WORKERS = int(os.getenv("MAX_WORKERS", 5))
 # SQL_SERVER="localhost\SQLEXPRESS"
 # DATABASE="AirbnbDataWarehouse"
 # TABLE="fact_reviews"
+# LISTINGS_TABLE="dim_listings"
 # LIMIT=100000
+# REVIEW_SOURCE="sqlserver"
+# REVIEW_SOURCE_PATH=""
+# REVIEW_LANGUAGES="en,fr"
+# REVIEW_CITIES=""
+# SYNC_RANGE_SIZE=10000
+# REVIEW_MODIFIED_COLUMN=""
 # FAISS_INDEX_PATH="reviews_hf.index"
 # EMBED_MODEL="sentence-transformers/all-MiniLM-L6-v2"
 # GEN_MODEL="google/gemma-2b-it"
+# GEN_MAX_NEW_TOKENS=512
+# GEN_STOP_SEQUENCES="Question:"
+# GEN_PREFIX_CACHE=true
+# GEN_BATCH_SIZE=8
+# QUERY_BATCH_SIZE=256
+# FAISS_INDEX_FACTORY="Flat"
+# FAISS_METRIC="ip"
+# FAISS_QUANTIZATION="none"
+# FAISS_NPROBE=16
+# FAISS_EF_SEARCH=64
+# FAISS_FILTER_EXACT_MAX=20000
+# FAISS_TWO_STAGE=false
+# FAISS_LISTING_CANDIDATES=20
+# RETRIEVAL_MODE="dense"
+# HYBRID_CANDIDATES=50
+# HYBRID_RRF_K=60
+# HYBRID_MAX_TERM_SHARE=0.05
+# FAISS_LISTING_VECTORS=1
+# FAISS_LISTING_MAX_REVIEWS=2
+# QUERY_CACHE_SIZE=1024
+# QUERY_CACHE_TTL=3600
+# CONTEXT_TOKEN_BUDGET=1024
+# CONTEXT_MAX_REVIEW_TOKENS=256
+# CONTEXT_MAX_PER_LISTING=2
+# CONTEXT_DEDUP_THRESHOLD=0.95
+# CONTEXT_CANDIDATE_FACTOR=2
+# SERVER_HOST="127.0.0.1"
+# SERVER_PORT=8000
+# SERVER_MAX_BATCH_SIZE=8
+# SERVER_MAX_WAIT_MS=20
+# SERVER_REQUEST_TIMEOUT=300
+# SERVER_MAX_CONCURRENCY=64
+# SERVER_MAX_TOP_K=100
+# METRICS_ENABLED=false
+# METRICS_LOG_PATH="rag_metrics.jsonl"
+# METRICS_PROMETHEUS_PATH="rag_metrics.prom"
 # SQLITE_PATH="hugging_airbnb_embeddings.db"
 # ID_COLUMN="review_id"
 # EMBEDDING_DIM=384
+# EMBEDDING_STORAGE="float32"
 # BATCH_SIZE=1000
-# MAX_WORKERS=4
\ No newline at end of file
+# MAX_WORKERS=4
+# EMBED_PROCESSES=0
+# FTS_INDEX=true
+# SQLITE_SYNCHRONOUS="NORMAL"
+# SQLITE_CACHE_SIZE_KB=65536
+# SQLITE_MMAP_SIZE=268435456
\ No newline at end of file
@@ -0,0 +1,146 @@
+# This script builds the review context of the prompt within a token budget.
+# Prompt length dominates the prefill time of the generative model on CPU, so instead of
+# pasting the full text of every retrieved review, the reviews are packed in rank order
+# until the budget is used: near-duplicate reviews are dropped, the number of reviews per
+# listing is capped, and long reviews are trimmed to their sentences most relevant to the query.
+
+import re
+
+import numpy as np
+
+from src.rag_airbnb_config import (
+    CONTEXT_TOKEN_BUDGET, CONTEXT_MAX_REVIEW_TOKENS, CONTEXT_MAX_PER_LISTING, CONTEXT_DEDUP_THRESHOLD,
+)
+
+# Splits a review into sentences after ., ! or ? (and on line breaks).
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+
+def split_sentences(text):
+    """Splits a review into its non-empty sentences."""
+    return [s.strip() for s in SENTENCE_SPLIT.split(text) if s and s.strip()]
+
+def format_review(doc):
+    """Formats a review the way it appears in the prompt context."""
+    return f"[{doc['listing_id']}] {doc['text']}"
+
+def count_tokens(tokenizer, texts):
+    """Returns the number of tokens of each text, without special tokens."""
+    if not texts:
+        return []
+    return [len(ids) for ids in tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+def _trim(sentences, sentence_tokens, relevance, max_tokens):
+    """Keeps the most relevant sentences that fit in `max_tokens`, in their original order.
+
+    Returns:
+        list[int]: The indices of the kept sentences.
+    """
+    kept, used = [], 0
+    for i in np.argsort(-relevance, kind="stable"):
+        if used + sentence_tokens[i] <= max_tokens:
+            kept.append(int(i))
+            used += sentence_tokens[i]
+    return sorted(kept)
+
+def _encode(embedder, sentences):
+    """Returns the normalized embeddings of `sentences` as a float32 array."""
+    return np.asarray(embedder.encode(sentences, normalize_embeddings=True), dtype=np.float32)
+
+def pack_contexts(query_vectors, candidates, embedder, tokenizer, max_reviews, review_vectors=None,
+                  budget=CONTEXT_TOKEN_BUDGET, max_review_tokens=CONTEXT_MAX_REVIEW_TOKENS,
+                  max_per_listing=CONTEXT_MAX_PER_LISTING, dedup_threshold=CONTEXT_DEDUP_THRESHOLD):
+    """Selects and trims the retrieved reviews of each query to fit a token budget.
+
+    A review whose vector is at least `dedup_threshold` similar to an already selected one
+    is skipped as a near-duplicate. With `review_vectors`, the vectors of the reviews in the
+    index are used, and only the sentences of the reviews that must be trimmed are encoded.
+    Otherwise the sentences of every candidate review of every query are encoded in a single
+    `embedder.encode` call, and a review's vector is the normalized mean of its sentence vectors.
+
+    Args:
+        query_vectors (np.ndarray): The normalized query embeddings, one row per query.
+        candidates (list[list[dict]]): The retrieved reviews of each query, best first.
+        embedder (SentenceTransformer): The model used to embed the review sentences.
+        tokenizer: The tokenizer of the generative model, used to count tokens.
+        max_reviews (int): The maximum number of reviews kept per query.
+        review_vectors (list[np.ndarray], optional): The embeddings of the candidate reviews of
+                                                     each query, one row per review (see
+                                                     `reconstruct_reviews`).
+        budget (int): The maximum number of context tokens per query.
+        max_review_tokens (int): Reviews longer than this are trimmed to their most relevant sentences.
+        max_per_listing (int): The maximum number of reviews of the same listing. 0 means no cap.
+        dedup_threshold (float): The cosine similarity above which two reviews count as duplicates.
+
+    Returns:
+        list[tuple[list[dict], dict]]: For each query, the packed reviews (with their text
+            possibly trimmed) and statistics: "raw_tokens" (the top `max_reviews`
+            candidates pasted in full), "packed_tokens", "reviews", "duplicates",
+            "listing_capped" and "trimmed".
+    """
+    doc_sentences = [[split_sentences(doc.get("text", "")) or [""] for doc in docs] for docs in candidates]
+    flat = [s for docs in doc_sentences for sentences in docs for s in sentences]
+    if not flat:
+        return [([], {"raw_tokens": 0, "packed_tokens": 0, "reviews": 0, "duplicates": 0,
+                      "listing_capped": 0, "trimmed": 0}) for _ in candidates]
+    # Without the review vectors, encode every sentence of every candidate review at once.
+    sentence_vectors = _encode(embedder, flat) if review_vectors is None else None
+    sentence_tokens = count_tokens(tokenizer, flat)
+    separator_tokens = count_tokens(tokenizer, ["\n\n"])[0]
+
+    results = []
+    pos = 0
+    for q, (query_vector, docs, sentences_per_doc) in enumerate(zip(query_vectors, candidates, doc_sentences)):
+        raw_tokens = sum(count_tokens(tokenizer, [format_review(d) for d in docs[:max_reviews]]))
+        raw_tokens += separator_tokens * max(min(len(docs), max_reviews) - 1, 0)
+        stats = {"raw_tokens": raw_tokens, "packed_tokens": 0, "reviews": 0, "duplicates": 0,
+                 "listing_capped": 0, "trimmed": 0}
+        packed, selected_vectors, per_listing = [], [], {}
+        for j, (doc, sentences) in enumerate(zip(docs, sentences_per_doc)):
+            start, pos = pos, pos + len(sentences)
+            tokens = sentence_tokens[start:pos]
+            if len(packed) >= max_reviews:
+                continue
+
+            listing_id = doc.get("listing_id")
+            if max_per_listing and per_listing.get(listing_id, 0) >= max_per_listing:
+                stats["listing_capped"] += 1
+                continue
+            if review_vectors is not None:
+                doc_vector = np.array(review_vectors[q][j], dtype=np.float32)
+            else:
+                doc_vector = sentence_vectors[start:pos].mean(axis=0)
+            doc_vector /= np.linalg.norm(doc_vector) or 1.0
+            if selected_vectors and float(np.max(np.stack(selected_vectors) @ doc_vector)) >= dedup_threshold:
+                stats["duplicates"] += 1
+                continue
+
+            # Tokens left for this review, after the "[listing_id] " prefix and the separator.
+            overhead = count_tokens(tokenizer, [format_review({"listing_id": listing_id, "text": ""})])[0]
+            if packed:
+                overhead += separator_tokens
+            room = min(max_review_tokens, budget - stats["packed_tokens"] - overhead)
+            if room <= 0:
+                continue
+            text = doc.get("text", "")
+            if sum(tokens) > room:
+                if sum(t <= room for t in tokens) > 1:
+                    vectors = sentence_vectors[start:pos] if sentence_vectors is not None else _encode(embedder, sentences)
+                    relevance = vectors @ query_vector
+                else:
+                    # At most one sentence fits on its own, so which one is kept does not depend on relevance.
+                    relevance = np.zeros(len(sentences), dtype=np.float32)
+                kept = _trim(sentences, tokens, relevance, room)
+                if not kept:
+                    continue
+                text = " ".join(sentences[i] for i in kept)
+                stats["trimmed"] += 1
+                used = sum(tokens[i] for i in kept)
+            else:
+                used = sum(tokens)
+            packed.append({**doc, "text": text})
+            selected_vectors.append(doc_vector)
+            per_listing[listing_id] = per_listing.get(listing_id, 0) + 1
+            stats["packed_tokens"] += used + overhead
+        stats["reviews"] = len(packed)
+        results.append((packed, stats))
+    return results
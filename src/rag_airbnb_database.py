@@ -1,15 +1,306 @@
 # This script handles the connection to the primary database (e.g., SQL Server)
 # and provides functions to load the Airbnb review data.
+# REVIEW_SOURCE selects where the reviews come from: the SQL Server warehouse, a local SQLite
+# copy of its tables, or Parquet/CSV exports (see rag_airbnb_sources.py). Every source applies
+# the language, city and non-empty comment filters itself and yields the same review batches.
+# The SQL sources also answer the range queries of the change capture.
 
-import pyodbc
-from src.rag_airbnb_config import SQL_SERVER, DATABASE, TABLE, MDF_FILE_PATH, ODBC_DRIVER
+import sqlite3
+import zlib
+
+from src.rag_airbnb_config import (
+    SQL_SERVER, DATABASE, TABLE, LISTINGS_TABLE, MDF_FILE_PATH, ODBC_DRIVER, BATCH_SIZE,
+    REVIEW_SOURCE, REVIEW_SOURCE_PATH, REVIEW_LANGUAGES, REVIEW_CITIES, REVIEW_MODIFIED_COLUMN,
+)
+
+# The values of REVIEW_SOURCE.
+REVIEW_SOURCES = ("sqlserver", "sqlite", "parquet", "csv")
+# The sources that deliver reviews ordered by review_id. Their changes are captured incrementally
+# (see rag_airbnb_sync.py): a refresh reads the reviews past the last synced review_id and
+# re-reads only the ranges of older reviews whose row count or checksum changed. File exports
+# are read in file order and in full; reviews that are already cached are skipped without being
+# encoded again.
+ORDERED_SOURCES = ("sqlserver", "sqlite")
+
+# The review columns selected from the database, with the listing's city and country joined
+# in (as in `cleaned_reviews_view`). Missing attributes are returned as empty strings.
+REVIEW_SELECT = (
+    "fr.review_id, fr.listing_id, fr.comments, COALESCE(fr.review_lang, ''), "
+    "COALESCE(dl.property_city, ''), COALESCE(dl.property_country, '')"
+)
+REVIEW_FROM = f"{TABLE} AS fr LEFT JOIN {LISTINGS_TABLE} AS dl ON fr.listing_id = dl.listing_id"
+# The columns whose changes the range checksums of the change capture detect.
+CHECKSUM_COLUMNS = "fr.listing_id, fr.comments, fr.review_lang, dl.property_city, dl.property_country"
+
+def review_predicates(languages=None, cities=None):
+    """Builds the WHERE conditions shared by the SQL sources.
+
+    As in `cleaned_reviews_view`, reviews whose comments are NULL or only whitespace are left
+    out. The conditions are valid in both SQL Server and SQLite.
+
+    Args:
+        languages (list[str], optional): Only keep reviews in these languages. Defaults to REVIEW_LANGUAGES.
+        cities (list[str], optional): Only keep reviews of listings in these cities. Defaults to REVIEW_CITIES.
+
+    Returns:
+        tuple[list[str], list]: The conditions, to be joined with AND, and their parameters.
+    """
+    languages = REVIEW_LANGUAGES if languages is None else languages
+    cities = REVIEW_CITIES if cities is None else cities
+    conditions = ["fr.comments IS NOT NULL", "LTRIM(RTRIM(fr.comments)) <> ''"]
+    params = []
+    if languages:
+        conditions.append(f"fr.review_lang IN ({', '.join('?' * len(languages))})")
+        params += languages
+    if cities:
+        conditions.append(f"dl.property_city IN ({', '.join('?' * len(cities))})")
+        params += cities
+    return conditions, params
+
+def _row_to_review(row):
+    """Converts a row selected with REVIEW_SELECT into a review dictionary."""
+    # The review_id and listing_id are converted to strings.
+    return {
+        "review_id": str(row[0]),
+        "listing_id": str(row[1]),
+        "text": row[2],
+        "review_lang": row[3],
+        "city": row[4],
+        "property_country": row[5],
+    }
+
+def _connection_string():
+    """Builds the connection string for the SQL Server database.
+
+    This uses trusted (Windows Authentication) connection and attaches the database file directly.
+    """
+    return (
+        f"Driver={ODBC_DRIVER};"
+        f"Server={SQL_SERVER};"
+        f"Trusted_Connection=yes;"
+        f"AttachDbFilename={MDF_FILE_PATH};"
+        f"DATABASE={DATABASE};"
+    )
+
+def iter_review_batches(limit: int = 0, start_after=None, chunk_size: int = BATCH_SIZE, source: str = None):
+    """Streams reviews from the configured source in chunks.
+
+    Args:
+        limit (int): The maximum number of reviews to load. If set to 0, all reviews
+                     will be loaded.
+        start_after (str, optional): Only reviews with a review_id greater than this
+                                     watermark are loaded. Ignored by the sources that are not
+                                     in ORDERED_SOURCES.
+        chunk_size (int): The number of reviews per chunk.
+        source (str, optional): One of REVIEW_SOURCES. Defaults to REVIEW_SOURCE.
+
+    Yields:
+        list[dict]: Chunks of reviews with keys 'review_id', 'listing_id', 'text',
+                    'review_lang', 'city' and 'property_country'.
+
+    Raises:
+        ValueError: If the source is unknown.
+    """
+    source = source or REVIEW_SOURCE
+    if source == "sqlserver":
+        yield from iter_sqlserver_batches(limit, start_after, chunk_size)
+    elif source == "sqlite":
+        yield from iter_sqlite_batches(REVIEW_SOURCE_PATH, limit, start_after, chunk_size)
+    elif source in ("parquet", "csv"):
+        from src.rag_airbnb_sources import iter_file_batches
+        yield from iter_file_batches(REVIEW_SOURCE_PATH, source, limit, chunk_size)
+    else:
+        raise ValueError(f"Unknown REVIEW_SOURCE '{source}'; use one of {REVIEW_SOURCES}.")
+
+def iter_sqlserver_batches(limit: int = 0, start_after=None, chunk_size: int = BATCH_SIZE):
+    """Streams reviews from the SQL Server database in chunks.
+
+    Rows are read with keyset pagination on review_id: every chunk is a separate
+    `SELECT TOP chunk_size ... WHERE review_id > last_seen ORDER BY review_id` query read
+    with `fetchmany`, so only one chunk is held in memory at a time and a stream that was
+    interrupted can be resumed from the last review_id it delivered.
+
+    Args:
+        limit (int): The maximum number of reviews to load. If set to 0, all reviews
+                     will be loaded.
+        start_after (str, optional): Only reviews with a review_id greater than this
+                                     watermark are loaded.
+        chunk_size (int): The number of rows fetched per query.
+
+    Yields:
+        list[dict]: Chunks of reviews, ordered by review_id, with keys 'review_id',
+                    'listing_id', 'text', 'review_lang', 'city' and 'property_country'.
+
+    Raises:
+        pyodbc.Error: If the database cannot be reached or a query fails. Unlike
+                      `load_reviews`, errors are not swallowed, so that a consumer can
+                      tell an interrupted stream from a complete one.
+    """
+    # pyodbc is only needed for this source, so it is imported here.
+    import pyodbc
+
+    # Establish the database connection.
+    conn = pyodbc.connect(_connection_string())
+    conditions, filter_params = review_predicates()
+    last_id = start_after
+    remaining = limit if limit > 0 else None
+    total = 0
+    try:
+        cursor = conn.cursor()
+        while remaining is None or remaining > 0:
+            top = chunk_size if remaining is None else min(chunk_size, remaining)
+            where_clause = " AND ".join(conditions + ([] if last_id is None else ["fr.review_id > ?"]))
+            query = (
+                f"SELECT TOP {top} {REVIEW_SELECT} FROM {REVIEW_FROM} "
+                f"WHERE {where_clause} ORDER BY fr.review_id;"
+            )
+            cursor.execute(query, *filter_params, *([] if last_id is None else [last_id]))
+            rows = cursor.fetchmany(top)
+            if not rows:
+                break
+            # Advance the keyset watermark past this chunk before filtering empty comments.
+            last_id = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+
+            # Only reviews with non-empty comments are included.
+            chunk = [_row_to_review(r) for r in rows if r[2]]
+            total += len(chunk)
+            if chunk:
+                yield chunk
+            if len(rows) < top:
+                break
+    finally:
+        conn.close()
+    print(f"[+] Streamed {total} reviews.")
+
+def iter_sqlite_batches(path, limit: int = 0, start_after=None, chunk_size: int = BATCH_SIZE):
+    """Streams reviews from a local SQLite copy of the review and listing tables.
+
+    The database must contain the TABLE and LISTINGS_TABLE tables with the columns of the
+    warehouse. One query ordered by review_id is read with `fetchmany`, so only one chunk is
+    held in memory at a time.
+
+    Args:
+        path (str): The SQLite database file.
+        limit (int): The maximum number of reviews to load (0 = all).
+        start_after (str, optional): Only reviews with a review_id greater than this watermark are loaded.
+        chunk_size (int): The number of rows fetched at a time.
+
+    Yields:
+        list[dict]: Chunks of reviews, ordered by review_id, as in `iter_review_batches`.
+    """
+    conn = _connect_sqlite_source(path)
+    conditions, params = review_predicates()
+    if start_after is not None:
+        conditions.append("fr.review_id > ?")
+        params.append(start_after)
+    query = f"SELECT {REVIEW_SELECT} FROM {REVIEW_FROM} WHERE {' AND '.join(conditions)} ORDER BY fr.review_id"
+    if limit > 0:
+        query += f" LIMIT {int(limit)}"
+    total = 0
+    try:
+        cursor = conn.execute(query, params)
+        while rows := cursor.fetchmany(chunk_size):
+            chunk = [_row_to_review(r) for r in rows]
+            total += len(chunk)
+            yield chunk
+    finally:
+        conn.close()
+    print(f"[+] Streamed {total} reviews from {path}.")
+
+def _row_checksum(*values):
+    """Returns the CRC-32 of a row's values, the SQLite stand-in for SQL Server's BINARY_CHECKSUM."""
+    return zlib.crc32("\x1f".join("" if v is None else str(v) for v in values).encode("utf-8"))
+
+def _connect_sqlite_source(path):
+    """Opens a SQLite review source read-only, so that a wrong path fails instead of creating an empty database."""
+    if not path:
+        raise ValueError("REVIEW_SOURCE_PATH must name the SQLite database to read reviews from.")
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.create_function("review_checksum", -1, _row_checksum, deterministic=True)
+    return conn
+
+def connect_review_source():
+    """Opens a connection to the REVIEW_SOURCE database for the change capture queries below.
+
+    Returns:
+        A DB-API connection (pyodbc or sqlite3).
+
+    Raises:
+        ValueError: If REVIEW_SOURCE is not one of ORDERED_SOURCES.
+    """
+    if REVIEW_SOURCE == "sqlserver":
+        import pyodbc
+        return pyodbc.connect(_connection_string())
+    if REVIEW_SOURCE == "sqlite":
+        return _connect_sqlite_source(REVIEW_SOURCE_PATH)
+    raise ValueError(f"Change capture needs one of the {ORDERED_SOURCES} sources, not '{REVIEW_SOURCE}'.")
+
+def _range_where(lo, hi):
+    """Returns the WHERE clause and parameters selecting the reviews with lo < review_id <= hi."""
+    conditions, params = review_predicates()
+    if lo is not None:
+        conditions.append("fr.review_id > ?")
+        params.append(lo)
+    conditions.append("fr.review_id <= ?")
+    params.append(hi)
+    return " AND ".join(conditions), params
+
+def source_range_summary(conn, lo, hi):
+    """Returns the row count and checksum of a range of reviews, computed by the source database.
+
+    The checksum covers the columns of CHECKSUM_COLUMNS, or is the latest modification time
+    when REVIEW_MODIFIED_COLUMN is set. Values are only compared with earlier values from the
+    same source, so the two databases need not compute the same checksum.
+
+    Args:
+        conn: A connection from `connect_review_source`.
+        lo (str | None): The review_id the range starts after, or None for the first range.
+        hi (str): The last review_id of the range.
+
+    Returns:
+        tuple[int, str | None]: The number of reviews and the checksum as a string.
+    """
+    where, params = _range_where(lo, hi)
+    if REVIEW_MODIFIED_COLUMN:
+        checksum = f"MAX(fr.{REVIEW_MODIFIED_COLUMN})"
+    elif REVIEW_SOURCE == "sqlserver":
+        checksum = f"CHECKSUM_AGG(BINARY_CHECKSUM({CHECKSUM_COLUMNS}))"
+    else:
+        checksum = f"SUM(review_checksum({CHECKSUM_COLUMNS}))"
+    row = conn.cursor().execute(f"SELECT COUNT(*), {checksum} FROM {REVIEW_FROM} WHERE {where}", params).fetchone()
+    return row[0], None if row[1] is None else str(row[1])
+
+def source_range_reviews(conn, lo, hi):
+    """Returns the reviews with lo < review_id <= hi, as in `iter_review_batches`."""
+    where, params = _range_where(lo, hi)
+    rows = conn.cursor().execute(f"SELECT {REVIEW_SELECT} FROM {REVIEW_FROM} WHERE {where}", params).fetchall()
+    return [_row_to_review(r) for r in rows]
+
+def source_existing_ids(conn, review_ids, chunk_size=500):
+    """Returns which of the given review IDs exist in the source and match its filters."""
+    review_ids = list(review_ids)
+    conditions, filter_params = review_predicates()
+    found = set()
+    for start in range(0, len(review_ids), chunk_size):
+        chunk = review_ids[start:start + chunk_size]
+        where = " AND ".join(conditions + [f"fr.review_id IN ({', '.join('?' * len(chunk))})"])
+        rows = conn.cursor().execute(f"SELECT fr.review_id FROM {REVIEW_FROM} WHERE {where}",
+                                     filter_params + chunk).fetchall()
+        found.update(str(row[0]) for row in rows)
+    return found
 
 def load_reviews(limit: int = 0):
     """Loads reviews from the specified SQL Server database.
 
     This function establishes a connection to the database using the configuration
     provided in `rag_airbnb_config.py`. It fetches the review data, including
-    review_id, listing_id, and the review text (comments).
+    review_id, listing_id, the review text (comments), the review language and the
+    listing's city and country.
+
+    The whole result is held in memory; use `iter_review_batches` to stream large tables.
+    With another REVIEW_SOURCE than "sqlserver", the reviews are read from that source.
 
     Args:
         limit (int): The maximum number of reviews to load. If set to 0, all reviews
@@ -17,36 +308,33 @@ def load_reviews(limit: int = 0):
 
     Returns:
         list[dict]: A list of dictionaries, where each dictionary represents a review
-                    with keys 'review_id', 'listing_id', and 'text'. Returns an
+                    with the same keys as the chunks of `iter_review_batches`. Returns an
                     empty list if an error occurs.
     """
-    # Construct the connection string for the SQL Server database.
-    # This uses trusted (Windows Authentication) connection and attaches the database file directly.
-    conn_str = (
-        f"Driver={ODBC_DRIVER};"
-        f"Server={SQL_SERVER};"
-        f"Trusted_Connection=yes;"
-        f"AttachDbFilename={MDF_FILE_PATH};"
-        f"DATABASE={DATABASE};"
-    )
     try:
+        if REVIEW_SOURCE != "sqlserver":
+            reviews = [review for chunk in iter_review_batches(limit) for review in chunk]
+            print(f"[+] Loaded {len(reviews)} reviews.")
+            return reviews
+
+        import pyodbc
         # Establish the database connection.
-        conn = pyodbc.connect(conn_str)
+        conn = pyodbc.connect(_connection_string())
         cursor = conn.cursor()
 
         # Construct the SQL query to select the reviews.
         # If a limit is specified, a TOP clause is added to the query.
         query_top_clause = f"TOP {limit}" if limit > 0 else ""
-        query = f"SELECT {query_top_clause} review_id, listing_id, comments FROM {TABLE} WHERE comments IS NOT NULL;"
+        conditions, params = review_predicates()
+        query = f"SELECT {query_top_clause} {REVIEW_SELECT} FROM {REVIEW_FROM} WHERE {' AND '.join(conditions)};"
 
         # Execute the query and fetch all results.
-        rows = cursor.execute(query).fetchall()
+        rows = cursor.execute(query, *params).fetchall()
         conn.close()
 
         # Process the fetched rows into a list of dictionaries.
-        # The review_id and listing_id are converted to strings, and only reviews with non-empty
-        # comments are included.
-        reviews = [{"review_id": str(r[0]), "listing_id": str(r[1]), "text": r[2]} for r in rows if r[2]]
+        # Only reviews with non-empty comments are included.
+        reviews = [_row_to_review(r) for r in rows if r[2]]
         print(f"[+] Loaded {len(reviews)} reviews.")
         return reviews
     except Exception as e:
@@ -1,96 +1,1141 @@
 # This script manages the creation and caching of review embeddings.
 # It uses a sentence-transformer model to generate embeddings and an SQLite database
 # to cache them, allowing for efficient resume-from-where-you-left-off functionality.
+# Vectors are cached per (model, normalized text hash): reviews with identical text share
+# one vector, each unique text is encoded once per model, and the vectors of several
+# models can live in the same cache.
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 import numpy as np
+import hashlib
+import multiprocessing
 import sqlite3
-import json
+import itertools
+import queue
+import threading
+import time
 import os
+import unicodedata
 
-from src.rag_airbnb_config import EMBED_MODEL, SQLITE_PATH, ID_COLUMN, EMBEDDING_DIM, BATCH_SIZE
-from src.rag_airbnb_database import load_reviews
+from src.rag_airbnb_config import (
+    EMBED_MODEL, SQLITE_PATH, ID_COLUMN, EMBEDDING_DIM, BATCH_SIZE, LIMIT, MAX_WORKERS, PIPELINE_QUEUE_SIZE,
+    EMBED_PROCESSES, EMBEDDING_STORAGE, REVIEW_SOURCE, FTS_INDEX,
+    SQLITE_SYNCHRONOUS, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE,
+)
+from src.rag_airbnb_database import iter_review_batches, ORDERED_SOURCES
+from src.rag_airbnb_metrics import span, count
+
+# Embeddings are stored on disk as raw little-endian float32 bytes, unless EMBEDDING_STORAGE
+# selects a smaller format, and are always decoded to float32.
+EMBEDDING_DTYPE = np.dtype("<f4")
+# The storage formats of EMBEDDING_STORAGE. "int8" vectors are prefixed with their float32 scale.
+STORAGE_FORMATS = ("float32", "float16", "int8")
+# Identifier of the on-disk embedding format, recorded in the cache_metadata table.
+EMBEDDING_FORMAT = "raw"
+# Version of the table layout, recorded in the cache_metadata table. Version 1 kept one
+# embedding per review in a single `embeddings` table; version 2 splits it into `reviews`
+# and the deduplicated, per-model `vectors`.
+SCHEMA_VERSION = 2
+# The number of rows converted per step when upgrading a version 1 cache.
+MIGRATION_CHUNK_SIZE = 10000
+# Review attributes cached next to each embedding, so the FAISS metadata can be assembled
+# from the cache alone. Columns missing from an older cache are added by `init_sqlite`.
+# They also serve as the metadata filters of the retrieval (see `retrieve_from_faiss`).
+REVIEW_ATTRIBUTE_COLUMNS = ["listing_id", "city", "property_country", "review_lang"]
 
 # ----------------------------------------
 # Helper Functions for SQLite Caching
 # ----------------------------------------
 
-def init_sqlite():
-    """Initializes the SQLite database and creates the embeddings table if it doesn't exist.
+def embedding_to_blob(embedding, storage="float32"):
+    """Serializes an embedding vector to raw little-endian bytes.
 
-    The table schema is designed to store the review ID, the review text, and the
-    corresponding embedding.
+    "float16" halves the size. "int8" scales the vector so that its largest component maps
+    to 127 and stores the float32 scale before the 8-bit components, so each vector keeps
+    its own range.
+
+    Args:
+        embedding (np.ndarray): The embedding vector.
+        storage (str): One of `STORAGE_FORMATS`.
 
     Returns:
-        sqlite3.Connection: A connection object to the SQLite database.
+        bytes: The binary representation stored in the `embedding` column.
     """
-    conn = sqlite3.connect(SQLITE_PATH)
+    vector = np.ascontiguousarray(embedding, dtype=EMBEDDING_DTYPE)
+    if storage == "float16":
+        return vector.astype("<f2").tobytes()
+    if storage == "int8":
+        scale = np.float32(np.abs(vector).max() / 127) or np.float32(1)
+        return scale.astype(EMBEDDING_DTYPE).tobytes() + np.round(vector / scale).astype(np.int8).tobytes()
+    return vector.tobytes()
+
+def blob_to_embedding(blob, storage="float32"):
+    """Deserializes an embedding stored by `embedding_to_blob`.
+
+    Args:
+        blob (bytes): The raw bytes read from the `embedding` column.
+        storage (str): The format the embedding was stored in.
+
+    Returns:
+        np.ndarray: The float32 vector; a read-only view over the bytes for "float32".
+    """
+    if storage == "float16":
+        return np.frombuffer(blob, dtype="<f2").astype(EMBEDDING_DTYPE)
+    if storage == "int8":
+        scale = np.frombuffer(blob, dtype=EMBEDDING_DTYPE, count=1)[0]
+        return np.frombuffer(blob, dtype=np.int8, offset=EMBEDDING_DTYPE.itemsize).astype(EMBEDDING_DTYPE) * scale
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+def normalize_text(text):
+    """Normalizes a review text so that trivially different copies share a vector.
+
+    The text is put in Unicode NFC form, runs of whitespace are collapsed and the ends are
+    stripped. Case is kept, since cased embedding models distinguish it.
+
+    Args:
+        text (str): The review text.
+
+    Returns:
+        str: The normalized text, which is also the text that gets encoded.
+    """
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+def text_hash(text):
+    """Returns the key of a review text in the `vectors` table.
+
+    Args:
+        text (str): The review text.
+
+    Returns:
+        bytes: The 16-byte BLAKE2b digest of the normalized text.
+    """
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).digest()
+
+def get_cache_metadata(sqlite_conn):
+    """Reads the key/value pairs describing the on-disk embedding format.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+
+    Returns:
+        dict: The metadata stored in the cache_metadata table.
+    """
+    cur = sqlite_conn.execute("SELECT key, value FROM cache_metadata")
+    return dict(cur.fetchall())
+
+def set_cache_metadata(sqlite_conn, key, value):
+    """Stores a key/value pair in the cache_metadata table, or deletes it if value is None.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        key (str): The metadata key.
+        value (str): The value to store, or None to delete the key.
+    """
+    with sqlite_conn:
+        if value is None:
+            sqlite_conn.execute("DELETE FROM cache_metadata WHERE key = ?", (key,))
+        else:
+            sqlite_conn.execute("INSERT OR REPLACE INTO cache_metadata (key, value) VALUES (?, ?)", (key, str(value)))
+
+def _create_tables(conn):
+    """Creates the version 2 tables and indexes if they do not exist."""
+    attribute_columns = "".join(f"            {c} TEXT,\n" for c in REVIEW_ATTRIBUTE_COLUMNS)
+    # One row per review, pointing at the vector of its normalized text.
     conn.execute(f"""
-        CREATE TABLE IF NOT EXISTS embeddings (
+        CREATE TABLE IF NOT EXISTS reviews (
             {ID_COLUMN} TEXT PRIMARY KEY,
             review_text TEXT,
-            embedding BLOB
+{attribute_columns}            text_hash BLOB
         )
     """)
+    conn.execute("CREATE INDEX IF NOT EXISTS reviews_text_hash ON reviews (text_hash)")
+    if "sync_range" not in {row[1] for row in conn.execute("PRAGMA table_info(reviews)")}:
+        # The change capture range of each review (see rag_airbnb_sync.py); NULL until synced.
+        conn.execute("ALTER TABLE reviews ADD COLUMN sync_range INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS reviews_sync_range ON reviews (sync_range)")
+    # The review_id ranges of an ordered source (lo < review_id <= hi, lo NULL for the first
+    # range) with the row count and checksum the source reported when they were last synced.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sync_ranges (
+            range_id INTEGER PRIMARY KEY,
+            lo TEXT,
+            hi TEXT,
+            row_count INTEGER,
+            checksum TEXT
+        )
+    """)
+    # One row per unique text and model.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS vectors (
+            model TEXT,
+            text_hash BLOB,
+            embedding BLOB,
+            PRIMARY KEY (model, text_hash)
+        ) WITHOUT ROWID
+    """)
+    # The dimension and storage format of each model's vectors.
+    conn.execute("CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY, dim INTEGER, storage TEXT)")
+    if "storage" not in {row[1] for row in conn.execute("PRAGMA table_info(models)")}:
+        # Vectors cached before the storage format was recorded are float32.
+        conn.execute("ALTER TABLE models ADD COLUMN storage TEXT DEFAULT 'float32'")
+
+def _update_fts_index(conn):
+    """Creates or drops the `reviews_fts` full-text index of the review texts, following FTS_INDEX.
+
+    The index is an FTS5 table over the `review_text` column of `reviews` (external content, so
+    the texts are not stored twice), kept up to date by triggers. Replacing a review deletes
+    the old row first, which only fires the delete trigger with recursive triggers enabled.
+    The `reviews_fts_vocab` table exposes the number of reviews containing each term.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'reviews_fts'").fetchone() is not None
+    if not FTS_INDEX:
+        if exists:
+            for trigger in ("insert", "delete", "update"):
+                conn.execute(f"DROP TRIGGER IF EXISTS reviews_fts_{trigger}")
+            conn.execute("DROP TABLE IF EXISTS reviews_fts_vocab")
+            conn.execute("DROP TABLE reviews_fts")
+        return
+    if exists:
+        return
+    try:
+        # Diacritics are folded, so "Familia" also matches "Família".
+        conn.execute("""
+            CREATE VIRTUAL TABLE reviews_fts USING fts5(
+                review_text, content='reviews', tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"⚠️ Could not create the full-text index ({e}); hybrid retrieval will only use FAISS.")
+        return
+    conn.execute("CREATE VIRTUAL TABLE reviews_fts_vocab USING fts5vocab(reviews_fts, 'row')")
+    conn.execute("""
+        CREATE TRIGGER reviews_fts_insert AFTER INSERT ON reviews BEGIN
+            INSERT INTO reviews_fts (rowid, review_text) VALUES (new.rowid, new.review_text);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER reviews_fts_delete AFTER DELETE ON reviews BEGIN
+            INSERT INTO reviews_fts (reviews_fts, rowid, review_text) VALUES ('delete', old.rowid, old.review_text);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER reviews_fts_update AFTER UPDATE OF review_text ON reviews BEGIN
+            INSERT INTO reviews_fts (reviews_fts, rowid, review_text) VALUES ('delete', old.rowid, old.review_text);
+            INSERT INTO reviews_fts (rowid, review_text) VALUES (new.rowid, new.review_text);
+        END
+    """)
+    total = conn.execute("SELECT COUNT(*) FROM reviews").fetchone()[0]
+    if total:
+        print(f"[+] Building the full-text index of {total} cached reviews...")
+        conn.execute("INSERT INTO reviews_fts (reviews_fts) VALUES ('rebuild')")
+
+def model_storage(sqlite_conn, model=EMBED_MODEL):
+    """Returns the storage format of a model's cached vectors.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        model (str): The embedding model.
+
+    Returns:
+        str: One of `STORAGE_FORMATS`; EMBEDDING_STORAGE for a model with no vectors yet.
+    """
+    row = sqlite_conn.execute("SELECT storage FROM models WHERE model = ?", (model,)).fetchone()
+    return row[0] if row and row[0] else EMBEDDING_STORAGE
+
+def _convert_storage(conn, model, old, new):
+    """Re-encodes every cached vector of `model` from the `old` to the `new` storage format.
+
+    The conversion runs in one transaction, so an interrupted run leaves the old vectors.
+    """
+    total = conn.execute("SELECT COUNT(*) FROM vectors WHERE model = ?", (model,)).fetchone()[0]
+    print(f"[+] Converting {total} cached vectors of {model} from {old} to {new}...")
+    if STORAGE_FORMATS.index(new) < STORAGE_FORMATS.index(old):
+        print(f"⚠️ The precision lost by the {old} format is not recovered; re-embed from scratch for exact vectors.")
+    read = conn.cursor()
+    read.execute("SELECT text_hash, embedding FROM vectors WHERE model = ?", (model,))
+    with conn:
+        while rows := read.fetchmany(MIGRATION_CHUNK_SIZE):
+            conn.executemany(
+                "UPDATE vectors SET embedding = ? WHERE model = ? AND text_hash = ?",
+                ((embedding_to_blob(blob_to_embedding(blob, old), new), model, h) for h, blob in rows),
+            )
+        conn.execute("UPDATE models SET storage = ? WHERE model = ?", (new, model))
+
+def _migrate_legacy_table(conn, metadata):
+    """Converts a version 1 `embeddings` table into the `reviews` and `vectors` tables.
+
+    Version 1 caches did not record their model; their vectors are assumed to come from
+    the current EMBED_MODEL. Identical texts keep a single vector. The conversion runs in
+    one transaction, so an interrupted upgrade leaves the old table untouched.
+    """
+    legacy_dim = int(metadata.get("embedding_dim", EMBEDDING_DIM))
+    total = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    print(f"[+] Upgrading {SQLITE_PATH}: deduplicating {total} cached embeddings by text "
+          f"(assuming they were computed with {EMBED_MODEL})...")
+    review_columns = [ID_COLUMN, "review_text", *REVIEW_ATTRIBUTE_COLUMNS]
+    cursor = conn.execute(f"SELECT {', '.join(review_columns)}, embedding FROM embeddings")
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO models (model, dim, storage) VALUES (?, ?, 'float32')",
+                     (EMBED_MODEL, legacy_dim))
+        while rows := cursor.fetchmany(MIGRATION_CHUNK_SIZE):
+            hashes = [text_hash(row[1]) for row in rows]
+            conn.executemany(
+                "INSERT OR IGNORE INTO vectors (model, text_hash, embedding) VALUES (?, ?, ?)",
+                ((EMBED_MODEL, h, row[-1]) for h, row in zip(hashes, rows)),
+            )
+            conn.executemany(
+                f"INSERT OR REPLACE INTO reviews ({', '.join(review_columns)}, text_hash) "
+                f"VALUES ({', '.join('?' * (len(review_columns) + 1))})",
+                ((*row[:-1], h) for h, row in zip(hashes, rows)),
+            )
+        conn.execute("DROP TABLE embeddings")
+        conn.execute("INSERT OR REPLACE INTO cache_metadata (key, value) VALUES ('schema_version', ?)",
+                     (str(SCHEMA_VERSION),))
+    unique = conn.execute("SELECT COUNT(*) FROM vectors WHERE model = ?", (EMBED_MODEL,)).fetchone()[0]
+    print(f"[+] Upgrade complete: {total} reviews share {unique} unique vectors.")
+
+def init_sqlite():
+    """Initializes the SQLite database and creates the cache tables if they don't exist.
+
+    The `reviews` table stores the review ID, the review text, the review attributes listed
+    in `REVIEW_ATTRIBUTE_COLUMNS` and the hash of the normalized text (see `text_hash`).
+    The `vectors` table stores one embedding, as raw float32 bytes, per (model, text hash),
+    so identical texts are embedded once and switching EMBED_MODEL keeps the vectors of
+    the previous model. The `models` table records the dimension and storage format (see
+    `EMBEDDING_STORAGE`) of each model's vectors; when EMBEDDING_STORAGE changes, the
+    vectors of the current model are converted. A `cache_metadata` table records the
+    format and schema version so that readers can decode the BLOBs without guessing.
+    The `sync_ranges` table and the `sync_range` column of `reviews` hold the change
+    capture state of ordered review sources (see rag_airbnb_sync.py). Unless FTS_INDEX is
+    off, the `reviews_fts` table indexes the review texts for keyword search (see
+    rag_airbnb_lexical.py).
+
+    A cache written by an older version with a single `embeddings` table is converted on
+    first use (see `_migrate_legacy_table`).
+
+    The connection uses WAL journaling with tuned pragmas so that bulk inserts are not
+    bound by one fsync per row.
+
+    Returns:
+        sqlite3.Connection: A connection object to the SQLite database.
+    """
+    conn = sqlite3.connect(SQLITE_PATH)
+    # WAL lets readers proceed while a batch is being written and, combined with
+    # synchronous=NORMAL, only syncs at checkpoints instead of on every commit.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    # A negative cache_size is interpreted by SQLite as KiB rather than pages.
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    # Lets INSERT OR REPLACE fire the delete trigger of the full-text index.
+    conn.execute("PRAGMA recursive_triggers=ON")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+    _create_tables(conn)
+    _update_fts_index(conn)
+    conn.commit()
+
+    metadata = get_cache_metadata(conn)
+    has_legacy_table = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'embeddings'"
+    ).fetchone() is not None
+    if has_legacy_table:
+        # Add any attribute columns that an older cache was created without.
+        existing_columns = {row[1] for row in conn.execute("PRAGMA table_info(embeddings)")}
+        for column in REVIEW_ATTRIBUTE_COLUMNS:
+            if column not in existing_columns:
+                conn.execute(f"ALTER TABLE embeddings ADD COLUMN {column} TEXT")
+        # A cache that already holds rows but has no metadata was written by an older
+        # version in JSON format and must be converted with the migration script first.
+        has_rows = conn.execute("SELECT 1 FROM embeddings LIMIT 1").fetchone() is not None
+        if has_rows and not metadata:
+            conn.close()
+            raise RuntimeError(
+                f"{SQLITE_PATH} contains JSON-encoded embeddings. "
+                "Run scripts/rag_airbnb_migrate_embeddings.py to convert it."
+            )
+        _migrate_legacy_table(conn, metadata)
+        metadata = get_cache_metadata(conn)
+
+    if not metadata:
+        conn.executemany(
+            "INSERT INTO cache_metadata (key, value) VALUES (?, ?)",
+            [
+                ("embedding_format", EMBEDDING_FORMAT),
+                ("embedding_dtype", EMBEDDING_DTYPE.str),
+                ("schema_version", str(SCHEMA_VERSION)),
+            ],
+        )
+    if EMBEDDING_STORAGE not in STORAGE_FORMATS:
+        conn.close()
+        raise ValueError(f"EMBEDDING_STORAGE must be one of {STORAGE_FORMATS}, got {EMBEDDING_STORAGE!r}.")
+    # Register the current model, or check that its cached vectors have the expected size.
+    row = conn.execute("SELECT dim, storage FROM models WHERE model = ?", (EMBED_MODEL,)).fetchone()
+    if row is None:
+        conn.execute("INSERT INTO models (model, dim, storage) VALUES (?, ?, ?)",
+                     (EMBED_MODEL, EMBEDDING_DIM, EMBEDDING_STORAGE))
+    elif row[0] != EMBEDDING_DIM:
+        conn.close()
+        raise RuntimeError(
+            f"{SQLITE_PATH} stores {row[0]}-dimensional embeddings for {EMBED_MODEL}, "
+            f"but EMBEDDING_DIM is {EMBEDDING_DIM}."
+        )
+    elif (row[1] or "float32") != EMBEDDING_STORAGE:
+        conn.commit()
+        _convert_storage(conn, EMBED_MODEL, row[1] or "float32", EMBEDDING_STORAGE)
     conn.commit()
     return conn
 
-def get_existing_ids(sqlite_conn):
+def get_existing_ids(sqlite_conn, model=EMBED_MODEL):
     """Retrieves the IDs of all reviews that have already been embedded and cached.
 
     Args:
         sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        model (str): The embedding model whose vectors count as cached.
 
     Returns:
         set: A set of review IDs that exist in the cache.
     """
     cur = sqlite_conn.cursor()
-    cur.execute(f"SELECT {ID_COLUMN} FROM embeddings")
+    cur.execute(f"""
+        SELECT r.{ID_COLUMN} FROM reviews r
+        JOIN vectors v ON v.model = ? AND v.text_hash = r.text_hash
+    """, (model,))
     ids = {r[0] for r in cur.fetchall()}
     return ids
 
-def save_embedding_to_sqlite(sqlite_conn, review_id, review_text, embedding):
+def _stage_ids(cursor, review_ids):
+    """Loads review IDs into the `wanted_ids` temporary table, replacing its contents.
+
+    Joining against this table lets queries look up an arbitrary set of IDs without
+    scanning the cache or hitting SQLite's bound-parameter limit.
+    """
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS wanted_ids (review_id TEXT PRIMARY KEY)")
+    cursor.execute("DELETE FROM wanted_ids")
+    cursor.executemany("INSERT OR IGNORE INTO wanted_ids (review_id) VALUES (?)", ((i,) for i in review_ids))
+
+def get_cached_ids(sqlite_conn, review_ids, model=EMBED_MODEL):
+    """Returns which of the given review IDs already have a cached embedding.
+
+    Unlike `get_existing_ids`, this only touches the requested IDs, so its cost and memory
+    depend on the size of the batch rather than on the size of the cache.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        review_ids (Iterable[str]): The IDs to look up.
+        model (str): The embedding model whose vectors count as cached.
+
+    Returns:
+        set: The subset of `review_ids` that exist in the cache.
+    """
+    cur = sqlite_conn.cursor()
+    _stage_ids(cur, review_ids)
+    cur.execute(f"""
+        SELECT r.{ID_COLUMN} FROM reviews r
+        JOIN wanted_ids w ON r.{ID_COLUMN} = w.review_id
+        JOIN vectors v ON v.model = ? AND v.text_hash = r.text_hash
+    """, (model,))
+    return {r[0] for r in cur.fetchall()}
+
+def get_cached_hashes(sqlite_conn, hashes, model=EMBED_MODEL):
+    """Returns which of the given text hashes already have a vector for `model`.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        hashes (Iterable[bytes]): The text hashes to look up (see `text_hash`).
+        model (str): The embedding model.
+
+    Returns:
+        set[bytes]: The subset of `hashes` whose vector is cached.
+    """
+    cur = sqlite_conn.cursor()
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS wanted_hashes (text_hash BLOB PRIMARY KEY)")
+    cur.execute("DELETE FROM wanted_hashes")
+    cur.executemany("INSERT OR IGNORE INTO wanted_hashes (text_hash) VALUES (?)", ((h,) for h in hashes))
+    cur.execute("""
+        SELECT v.text_hash FROM vectors v JOIN wanted_hashes w ON v.text_hash = w.text_hash
+        WHERE v.model = ?
+    """, (model,))
+    return {r[0] for r in cur.fetchall()}
+
+def save_embedding_to_sqlite(sqlite_conn, review_id, review_text, embedding, listing_id=None, **attributes):
     """Saves a single review's embedding and its metadata to the SQLite database.
 
+    Prefer `save_embeddings_batch_to_sqlite` for bulk ingest, as this commits per call.
+
     Args:
         sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
         review_id (str): The unique ID of the review.
         review_text (str): The text of the review.
         embedding (np.ndarray): The embedding vector for the review.
+        listing_id (str, optional): The ID of the listing the review belongs to.
+        **attributes: The other attributes of `REVIEW_ATTRIBUTE_COLUMNS` (e.g. city).
     """
-    # The embedding is converted to a JSON string for storage as a BLOB.
-    sqlite_conn.execute(f"""
-        INSERT OR REPLACE INTO embeddings ({ID_COLUMN}, review_text, embedding)
-        VALUES (?, ?, ?)
-    """, (review_id, review_text, json.dumps(embedding.tolist())))
-    sqlite_conn.commit()
+    review = {ID_COLUMN: review_id, "text": review_text, "listing_id": listing_id, **attributes}
+    save_embeddings_batch_to_sqlite(sqlite_conn, [review], [embedding])
+
+def _write_batch(sqlite_conn, reviews, review_hashes, vector_hashes, vectors, model):
+    """Writes reviews and newly encoded vectors in a single transaction.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        reviews (list[dict]): The reviews to store.
+        review_hashes (list[bytes]): The text hash of each review.
+        vector_hashes (list[bytes]): The text hashes of the new vectors.
+        vectors (np.ndarray | None): The new vectors, one row per entry of `vector_hashes`.
+        model (str): The embedding model the vectors were computed with.
+    """
+    columns = [ID_COLUMN, "review_text", *REVIEW_ATTRIBUTE_COLUMNS, "text_hash"]
+    rows = (
+        (r[ID_COLUMN], r["text"], *(r.get(c) for c in REVIEW_ATTRIBUTE_COLUMNS), h)
+        for r, h in zip(reviews, review_hashes)
+    )
+    if len(vector_hashes):
+        # Register a model written for the first time, so that its vectors can be decoded later.
+        sqlite_conn.execute("INSERT OR IGNORE INTO models (model, dim, storage) VALUES (?, ?, ?)",
+                            (model, len(vectors[0]), EMBEDDING_STORAGE))
+    storage = model_storage(sqlite_conn, model)
+    # Using the connection as a context manager commits on success and rolls back on error.
+    with sqlite_conn:
+        if len(vector_hashes):
+            # A vector for the same text may already exist; the first one written is kept.
+            sqlite_conn.executemany(
+                "INSERT OR IGNORE INTO vectors (model, text_hash, embedding) VALUES (?, ?, ?)",
+                ((model, h, embedding_to_blob(v, storage)) for h, v in zip(vector_hashes, vectors)),
+            )
+        sqlite_conn.executemany(f"""
+            INSERT OR REPLACE INTO reviews ({", ".join(columns)})
+            VALUES ({", ".join("?" * len(columns))})
+        """, rows)
+
+def save_embeddings_batch_to_sqlite(sqlite_conn, reviews, embeddings, model=EMBED_MODEL):
+    """Saves a batch of embeddings and their metadata in a single transaction.
+
+    The whole batch is written in one transaction, so either every row of the batch is
+    persisted or none is. After a crash, resuming therefore redoes at most the batch that
+    was in flight. Reviews with the same normalized text share one stored vector.
 
-def load_all_embeddings_from_sqlite(sqlite_conn):
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        reviews (list[dict]): The reviews, as returned by `load_reviews`. The attributes in
+                              `REVIEW_ATTRIBUTE_COLUMNS` are stored alongside the text.
+        embeddings (np.ndarray): The embedding vectors, one row per review.
+        model (str): The embedding model the vectors were computed with.
+    """
+    hashes = [text_hash(r["text"]) for r in reviews]
+    _write_batch(sqlite_conn, reviews, hashes, hashes, embeddings, model)
+
+def backfill_review_attributes(sqlite_conn, reviews):
+    """Fills in attribute columns for cached rows written before those columns existed.
+
+    Caches created by older versions only stored the ID, text and embedding. The cached
+    rows of `reviews` that still lack attributes are looked up through the `wanted_ids`
+    staging table, so the cost depends on the number of reviews passed in. Rows whose
+    review is not in `reviews` keep NULL attributes until a later load includes them.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        reviews (list[dict]): A batch of reviews loaded from the primary database.
+
+    Returns:
+        int: The number of rows that were updated.
+    """
+    cur = sqlite_conn.cursor()
+    _stage_ids(cur, (r[ID_COLUMN] for r in reviews))
+    missing_clause = " OR ".join(f"e.{c} IS NULL" for c in REVIEW_ATTRIBUTE_COLUMNS)
+    missing_ids = {
+        row[0] for row in cur.execute(f"""
+            SELECT e.{ID_COLUMN} FROM reviews e JOIN wanted_ids w ON e.{ID_COLUMN} = w.review_id
+            WHERE {missing_clause}
+        """)
+    }
+    if not missing_ids:
+        return 0
+
+    reviews_by_id = {r[ID_COLUMN]: r for r in reviews if r[ID_COLUMN] in missing_ids}
+    set_clause = ", ".join(f"{c} = ?" for c in REVIEW_ATTRIBUTE_COLUMNS)
+    with sqlite_conn:
+        sqlite_conn.executemany(
+            f"UPDATE reviews SET {set_clause} WHERE {ID_COLUMN} = ?",
+            ((*(r.get(c) for c in REVIEW_ATTRIBUTE_COLUMNS), review_id) for review_id, r in reviews_by_id.items()),
+        )
+    return len(reviews_by_id)
+
+def delete_embeddings_from_sqlite(sqlite_conn, review_ids):
+    """Deletes the given reviews from the cache in a single transaction.
+
+    Vectors whose text is no longer used by any review are deleted as well, for every model.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        review_ids (Iterable[str]): The IDs of the reviews to delete.
+    """
+    cur = sqlite_conn.cursor()
+    _stage_ids(cur, review_ids)
+    with sqlite_conn:
+        # Remember the texts of the deleted reviews, so that only their vectors are checked.
+        hashes = [row[0] for row in cur.execute(f"""
+            SELECT r.text_hash FROM reviews r JOIN wanted_ids w ON r.{ID_COLUMN} = w.review_id
+        """)]
+        cur.execute(f"DELETE FROM reviews WHERE {ID_COLUMN} IN (SELECT review_id FROM wanted_ids)")
+        _prune_orphan_vectors(cur, hashes)
+
+def _prune_orphan_vectors(cursor, hashes):
+    """Deletes the vectors of the given text hashes that no review uses anymore, for every model."""
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS orphan_hashes (text_hash BLOB PRIMARY KEY)")
+    cursor.execute("DELETE FROM orphan_hashes")
+    cursor.executemany("INSERT OR IGNORE INTO orphan_hashes (text_hash) VALUES (?)", ((h,) for h in hashes))
+    cursor.execute("""
+        DELETE FROM vectors WHERE text_hash IN (
+            SELECT o.text_hash FROM orphan_hashes o
+            WHERE NOT EXISTS (SELECT 1 FROM reviews r WHERE r.text_hash = o.text_hash)
+        )
+    """)
+
+def upsert_reviews(sqlite_conn, embedder, reviews, model=EMBED_MODEL):
+    """Stores new and edited reviews, encoding only the texts that have no vector yet.
+
+    Unlike `embed_new_reviews`, reviews that are already cached are overwritten, so an edited
+    text or attribute replaces the cached one. Vectors of the old texts that no review uses
+    anymore are deleted.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        embedder (SentenceTransformer): The model used to encode the new texts.
+        reviews (list[dict]): The reviews, as returned by `iter_review_batches`.
+        model (str): The embedding model.
+
+    Returns:
+        int: The number of texts that were encoded.
+    """
+    cur = sqlite_conn.cursor()
+    _stage_ids(cur, (r[ID_COLUMN] for r in reviews))
+    old_hashes = [row[0] for row in cur.execute(f"""
+        SELECT r.text_hash FROM reviews r JOIN wanted_ids w ON r.{ID_COLUMN} = w.review_id
+    """)]
+    encoded = 0
+    for batch in _batched(reviews):
+        review_hashes = [text_hash(r["text"]) for r in batch]
+        known_hashes = get_cached_hashes(sqlite_conn, review_hashes, model)
+        new_texts = {}
+        for r, h in zip(batch, review_hashes):
+            if h not in known_hashes and h not in new_texts:
+                new_texts[h] = normalize_text(r["text"])
+        vectors = None
+        if new_texts:
+            with span("ingest.encode", rows=len(new_texts)):
+                vectors = embedder.encode(list(new_texts.values()), normalize_embeddings=True)
+        with span("ingest.write", rows=len(batch)):
+            _write_batch(sqlite_conn, batch, review_hashes, list(new_texts), vectors, model)
+        encoded += len(new_texts)
+        count("reviews_embedded", len(batch))
+        count("texts_encoded", len(new_texts))
+    with sqlite_conn:
+        _prune_orphan_vectors(cur, old_hashes)
+    return encoded
+
+def count_cached_reviews(sqlite_conn, model=EMBED_MODEL):
+    """Returns the number of cached reviews that have a vector for `model`."""
+    return sqlite_conn.execute(
+        "SELECT COUNT(*) FROM reviews r JOIN vectors v ON v.model = ? AND v.text_hash = r.text_hash", (model,)
+    ).fetchone()[0]
+
+def _read_embedding_rows(cursor, n, storage="float32"):
+    """Reads `n` rows of (id, text, *attributes, embedding) from an executed cursor.
+
+    The embeddings are decoded from their BLOBs, stored in the `storage` format, straight
+    into a single preallocated float32 array, so no per-row Python objects are built for
+    the vectors.
+    """
+    embeddings = np.empty((n, EMBEDDING_DIM), dtype=np.float32)
+    columns = {"review_id": [], "text": [], **{c: [] for c in REVIEW_ATTRIBUTE_COLUMNS}}
+    attribute_lists = [columns[c] for c in REVIEW_ATTRIBUTE_COLUMNS]
+
+    for i, (review_id, review_text, *attributes, embedding_blob) in enumerate(cursor):
+        # Decode the raw bytes directly into the preallocated row.
+        embeddings[i] = blob_to_embedding(embedding_blob, storage)
+        columns["review_id"].append(review_id)
+        columns["text"].append(review_text)
+        for values, value in zip(attribute_lists, attributes):
+            values.append(value if value is not None else "")
+    return columns, embeddings
+
+def columns_to_records(columns):
+    """Converts review columns into a list of per-review metadata dictionaries.
+
+    Args:
+        columns (dict[str, list]): Review columns as returned by `load_all_embeddings_from_sqlite`.
+
+    Returns:
+        list[dict]: One dictionary per review, in the same order as the columns.
+    """
+    column_names = list(columns)
+    return [dict(zip(column_names, values)) for values in zip(*columns.values())]
+
+def load_all_embeddings_from_sqlite(sqlite_conn, model=EMBED_MODEL):
     """Loads all embeddings and their associated metadata from the SQLite cache.
 
+    Reviews without a vector for `model` are left out.
+
     Args:
         sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        model (str): The embedding model whose vectors are loaded.
 
     Returns:
-        list[dict]: A list of dictionaries, where each dictionary contains the
-                    review_id, text, and the embedding as a numpy array.
+        tuple: A tuple containing:
+            - dict[str, list]: The review columns ("review_id", "text" and every attribute
+                               in `REVIEW_ATTRIBUTE_COLUMNS`), ordered by review ID.
+            - np.ndarray: A 2D float32 array of shape (n, EMBEDDING_DIM) with the embeddings.
+    """
+    with span("cache.load_all") as s:
+        cur = sqlite_conn.cursor()
+        join = "FROM reviews r JOIN vectors v ON v.model = ? AND v.text_hash = r.text_hash"
+        n = cur.execute(f"SELECT COUNT(*) {join}", (model,)).fetchone()[0]
+        s.set(rows=n)
+        attribute_select = ", ".join(f"r.{c}" for c in REVIEW_ATTRIBUTE_COLUMNS)
+        cur.execute(f"""
+            SELECT r.{ID_COLUMN}, r.review_text, {attribute_select}, v.embedding
+            {join} ORDER BY r.{ID_COLUMN}
+        """, (model,))
+        return _read_embedding_rows(cur, n, model_storage(sqlite_conn, model))
+
+def load_embeddings_by_ids(sqlite_conn, review_ids, model=EMBED_MODEL):
+    """Loads the embeddings and metadata of the given reviews from the SQLite cache.
+
+    The IDs are staged in a temporary table and joined, so the cost depends on the number
+    of requested reviews rather than on the size of the cache.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        review_ids (Iterable[str]): The IDs of the reviews to load.
+        model (str): The embedding model whose vectors are loaded.
+
+    Returns:
+        tuple: The same (columns, embeddings) pair as `load_all_embeddings_from_sqlite`,
+               restricted to the requested reviews that exist in the cache.
+    """
+    with span("cache.load_by_ids") as s:
+        cur = sqlite_conn.cursor()
+        _stage_ids(cur, review_ids)
+
+        join = f"""
+            FROM reviews r JOIN wanted_ids w ON r.{ID_COLUMN} = w.review_id
+            JOIN vectors v ON v.model = ? AND v.text_hash = r.text_hash
+        """
+        n = cur.execute(f"SELECT COUNT(*) {join}", (model,)).fetchone()[0]
+        s.set(rows=n)
+        attribute_select = ", ".join(f"r.{c}" for c in REVIEW_ATTRIBUTE_COLUMNS)
+        cur.execute(f"""
+            SELECT r.{ID_COLUMN}, r.review_text, {attribute_select}, v.embedding
+            {join} ORDER BY r.{ID_COLUMN}
+        """, (model,))
+        return _read_embedding_rows(cur, n, model_storage(sqlite_conn, model))
+
+def embed_cached_texts(sqlite_conn, embedder, model=EMBED_MODEL, batch_size=BATCH_SIZE):
+    """Encodes the cached review texts that have no vector for `model` yet.
+
+    After switching EMBED_MODEL, the texts already in the cache are embedded with the new
+    model without reading the primary database; each unique text is encoded once.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        embedder (SentenceTransformer): The model used to encode the texts.
+        model (str): The name under which the vectors are stored.
+        batch_size (int): The number of texts encoded and written per transaction.
+
+    Returns:
+        int: The number of vectors that were added.
     """
     cur = sqlite_conn.cursor()
-    cur.execute(f"SELECT {ID_COLUMN}, review_text, embedding FROM embeddings ORDER BY {ID_COLUMN}")
-    all_data = []
-    for row in cur.fetchall():
-        review_id, review_text, embedding_blob = row
-        # The embedding is loaded from the JSON string and converted back to a numpy array.
-        embedding = np.array(json.loads(embedding_blob), dtype=np.float32)
-        all_data.append({"review_id": review_id, "text": review_text, "embedding": embedding})
-    return all_data
+    missing = """
+        FROM reviews r WHERE r.text_hash IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM vectors v WHERE v.model = ? AND v.text_hash = r.text_hash
+        )
+    """
+    total = cur.execute(f"SELECT COUNT(DISTINCT r.text_hash) {missing}", (model,)).fetchone()[0]
+    if not total:
+        return 0
+    print(f"[+] Embedding {total} cached texts with {model}...")
+    # Read every missing text before writing, so the read cursor is not invalidated.
+    texts = dict(cur.execute(f"SELECT r.text_hash, MIN(r.review_text) {missing} GROUP BY r.text_hash", (model,)))
+    hashes = list(texts)
+    for start in tqdm(range(0, len(hashes), batch_size), desc="Embedding cached texts"):
+        chunk = hashes[start:start + batch_size]
+        with span("ingest.encode", rows=len(chunk)):
+            vectors = embedder.encode([normalize_text(texts[h]) for h in chunk], normalize_embeddings=True)
+        with span("ingest.write", rows=len(chunk)):
+            _write_batch(sqlite_conn, [], [], chunk, vectors, model)
+        count("texts_encoded", len(chunk))
+    return total
 
 # ----------------------------------------
 # Main Embedding Pipeline
 # ----------------------------------------
 
-def build_embeddings_with_sqlite(all_reviews):
+def _batched(reviews, batch_size=BATCH_SIZE):
+    """Splits an in-memory list of reviews into batches of `batch_size`."""
+    iterator = iter(reviews)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+# Marker passed down the pipeline queues when a stage has no more work.
+_DONE = object()
+
+# The sentence-transformer model of an embedding worker process, loaded once per process.
+_worker_embedder = None
+
+def _init_embedding_worker(model_name, torch_threads):
+    """Initializes an embedding worker process: loads the model once and pins its threads.
+
+    Each worker gets an equal share of the cores, so that the processes together use the
+    whole machine without oversubscribing it.
+    """
+    global _worker_embedder
+    import torch
+    torch.set_num_threads(torch_threads)
+    _worker_embedder = SentenceTransformer(model_name)
+
+def _encode_in_worker(texts):
+    """Encodes a shard of review texts in an embedding worker process."""
+    return _worker_embedder.encode(texts, normalize_embeddings=True)
+
+def _start_embedding_pool(processes):
+    """Starts a pool of embedding worker processes.
+
+    The "spawn" start method is used because forking a process that has already loaded
+    torch, or started threads, can deadlock.
+    """
+    torch_threads = max(1, (os.cpu_count() or 1) // processes)
+    print(f"[+] Starting {processes} embedding worker processes with {torch_threads} torch thread(s) each...")
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_embedding_worker,
+        initargs=(EMBED_MODEL, torch_threads),
+    )
+
+def _put(q, item, stop):
+    """Puts an item on a bounded queue, blocking for space unless the pipeline is stopping."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(q, stop):
+    """Gets an item from a queue, or returns _DONE once the pipeline is stopping."""
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return _DONE
+
+def _print_stage_report(stats, elapsed):
+    """Prints the rows, busy time and throughput of each pipeline stage."""
+    print(f"[+] Ingest pipeline finished in {elapsed:.1f}s:")
+    for name, stage in stats.items():
+        rate = stage["rows"] / stage["busy"] if stage["busy"] > 0 else 0.0
+        print(f"    {name:<7} {stage['rows']:>9} rows | busy {stage['busy']:7.1f}s | "
+              f"{rate:9.0f} rows/s | waiting {stage['wait']:7.1f}s")
+    # A stage with several workers is only saturated once every worker is busy.
+    bottleneck = max(stats, key=lambda name: stats[name]["busy"] / stats[name]["workers"])
+    print(f"    Bottleneck: {bottleneck} stage.")
+
+def embed_new_reviews(sqlite_conn, review_batches, embedder, on_written=None):
+    """Embeds the reviews that are not cached yet and saves them to the SQLite cache.
+
+    Ingest runs as a three-stage pipeline connected by bounded queues, so that fetching,
+    encoding and writing overlap instead of waiting on each other:
+
+    1. A reader thread pulls batches from `review_batches` and drops the reviews that are
+       already cached, using its own read connection (WAL allows it to read while the
+       writer commits). It also hashes the normalized text of the remaining reviews and
+       looks up which of those texts already have a vector for `EMBED_MODEL`.
+    2. `MAX_WORKERS` encoder threads run `embedder.encode` on the unique texts of the
+       remaining reviews that have no vector yet; duplicate texts reuse one vector. If
+       `EMBED_PROCESSES` is set, encoding is instead spread over that many worker
+       processes, each of which loads `EMBED_MODEL` once; every batch is a shard sent to
+       the next free worker.
+    3. The calling thread writes each encoded batch to the cache in one transaction. It is
+       the only writer, whichever encoding mode is used.
+
+    The queues hold at most `PIPELINE_QUEUE_SIZE` batches each, so a slow stage holds back
+    the ones before it and peak memory stays proportional to the batch size. If any stage
+    fails, the others are stopped, batches already written are kept, and the error is
+    re-raised. A failure of the review source itself is reported, and the reviews read
+    before it are still written.
+
+    Each batch is committed together with its progress, so the cache doubles as the shard
+    checkpoint: after a killed run, shards that were written are skipped by the reader's
+    cache check and only the unfinished ones are encoded again.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        review_batches (Iterable[list[dict]]): Batches of reviews from the primary database.
+        embedder (SentenceTransformer): The sentence-transformer model instance.
+        on_written (callable, optional): Called with each batch and the reviews of it that were
+                                         written, once it and every batch read before it are
+                                         in the cache, e.g. to record how far an ordered source
+                                         has been synced (see rag_airbnb_sync.py).
+
+    Returns:
+        int: The number of reviews that were newly embedded (including those whose text
+             reused an existing vector).
+    """
+    pool = None
+    if EMBED_PROCESSES > 0:
+        # One encoder thread per worker process keeps every process fed with a shard.
+        n_encoders = EMBED_PROCESSES
+        pool = _start_embedding_pool(EMBED_PROCESSES)
+
+        def encode(texts):
+            return pool.submit(_encode_in_worker, texts).result()
+    else:
+        n_encoders = max(MAX_WORKERS, 1)
+
+        def encode(texts):
+            return embedder.encode(texts, normalize_embeddings=True)
+
+    encoded_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    read_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    errors = []
+    source_errors = []
+    stats = {
+        name: {"rows": 0, "busy": 0.0, "wait": 0.0, "workers": workers}
+        for name, workers in (("read", 1), ("encode", n_encoders), ("write", 1))
+    }
+    stats_lock = threading.Lock()
+    db_path = sqlite_conn.execute("PRAGMA database_list").fetchone()[2]
+
+    # The hashes sent for encoding by the batches that may not be written yet. Every batch
+    # in a queue, an encoder or the writer can be in flight; older ones are in the cache.
+    in_flight = deque(maxlen=2 * PIPELINE_QUEUE_SIZE + n_encoders + 1)
+
+    def reader():
+        read_conn = sqlite3.connect(db_path)
+        batches = iter(review_batches)
+        try:
+            seq = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    with span("ingest.fetch"):
+                        batch = next(batches)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    # Keep what was read so far; the sync watermark lets the next run resume.
+                    source_errors.append(e)
+                    break
+                with span("ingest.cache_lookup", rows=len(batch)):
+                    # Filter out reviews that have already been embedded.
+                    cached_ids = get_cached_ids(read_conn, [r[ID_COLUMN] for r in batch])
+                    reviews_to_embed = [r for r in batch if r[ID_COLUMN] not in cached_ids]
+                    # Texts already embedded for another review only need their review row.
+                    review_hashes = [text_hash(r["text"]) for r in reviews_to_embed]
+                    known_hashes = get_cached_hashes(read_conn, review_hashes) if review_hashes else set()
+                # A text first seen in a batch still in flight gets its vector from that batch.
+                # If that batch is never written, the review has no vector and is embedded
+                # again on the next run.
+                known_hashes.update(h for h in review_hashes if any(h in sent for sent in in_flight))
+                in_flight.append(set(review_hashes) - known_hashes)
+                stats["read"]["busy"] += time.perf_counter() - start
+                stats["read"]["rows"] += len(batch)
+
+                start = time.perf_counter()
+                item = (seq, batch, cached_ids, reviews_to_embed, review_hashes, known_hashes)
+                if not _put(read_queue, item, stop):
+                    break
+                stats["read"]["wait"] += time.perf_counter() - start
+                seq += 1
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            read_conn.close()
+            if hasattr(batches, "close"):
+                batches.close()
+            for _ in range(n_encoders):
+                _put(read_queue, _DONE, stop)
+
+    def encoder():
+        try:
+            while True:
+                start = time.perf_counter()
+                item = _get(read_queue, stop)
+                waited = time.perf_counter() - start
+                if item is _DONE:
+                    break
+                seq, batch, cached_ids, reviews_to_embed, review_hashes, known_hashes = item
+
+                start = time.perf_counter()
+                # Keep one normalized text per hash that has no vector yet.
+                new_texts = {}
+                for r, h in zip(reviews_to_embed, review_hashes):
+                    if h not in known_hashes and h not in new_texts:
+                        new_texts[h] = normalize_text(r["text"])
+                vector_hashes = list(new_texts)
+                batch_embeddings = None
+                if vector_hashes:
+                    # Generate embeddings for the unique new texts of the batch.
+                    with span("ingest.encode", rows=len(vector_hashes)):
+                        batch_embeddings = encode(list(new_texts.values()))
+                busy = time.perf_counter() - start
+                with stats_lock:
+                    stats["encode"]["busy"] += busy
+                    stats["encode"]["wait"] += waited
+                    stats["encode"]["rows"] += len(vector_hashes)
+
+                item = (seq, batch, cached_ids, reviews_to_embed, review_hashes, vector_hashes, batch_embeddings)
+                if not _put(encoded_queue, item, stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(encoded_queue, _DONE, stop)
+
+    threads = [threading.Thread(target=reader, name="ingest-reader", daemon=True)]
+    threads += [threading.Thread(target=encoder, name=f"ingest-encoder-{i}", daemon=True) for i in range(n_encoders)]
+    pipeline_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    total_embedded = 0
+    total_encoded = 0
+    total_backfilled = 0
+    finished_batches = {}
+    next_seq = 0
+    progress = tqdm(desc="Embedding reviews", unit="review")
+    try:
+        done_encoders = 0
+        while done_encoders < n_encoders:
+            start = time.perf_counter()
+            item = _get(encoded_queue, stop)
+            stats["write"]["wait"] += time.perf_counter() - start
+            if item is _DONE:
+                if stop.is_set():
+                    break
+                done_encoders += 1
+                continue
+
+            start = time.perf_counter()
+            seq, batch, cached_ids, reviews_to_embed, review_hashes, vector_hashes, batch_embeddings = item
+            if reviews_to_embed:
+                # Save the whole batch to the SQLite cache in one transaction.
+                with span("ingest.write", rows=len(reviews_to_embed)):
+                    _write_batch(sqlite_conn, reviews_to_embed, review_hashes, vector_hashes, batch_embeddings, EMBED_MODEL)
+                total_embedded += len(reviews_to_embed)
+                total_encoded += len(vector_hashes)
+                count("reviews_embedded", len(reviews_to_embed))
+                count("texts_encoded", len(vector_hashes))
+            # Fill in the attributes of rows cached by older versions that did not store them.
+            if cached_ids:
+                with span("ingest.backfill", rows=len(cached_ids)):
+                    total_backfilled += backfill_review_attributes(
+                        sqlite_conn, [r for r in batch if r[ID_COLUMN] in cached_ids]
+                    )
+
+            if on_written is not None:
+                # Batches may finish out of order; report the longest run of consecutive written batches.
+                finished_batches[seq] = (batch, reviews_to_embed)
+                while next_seq in finished_batches:
+                    on_written(*finished_batches.pop(next_seq))
+                    next_seq += 1
+            stats["write"]["busy"] += time.perf_counter() - start
+            stats["write"]["rows"] += len(reviews_to_embed)
+            progress.update(len(batch))
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        progress.close()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if errors:
+        print("❌ The ingest pipeline stopped early. Embeddings saved so far are kept.")
+        raise errors[0]
+    _print_stage_report(stats, time.perf_counter() - pipeline_start)
+
+    if source_errors:
+        print(f"❌ Error loading reviews: {source_errors[0]}")
+        print("[+] Embeddings saved so far are kept; run again to resume the load.")
+
+    if total_embedded > 0:
+        print(f"[+] Finished embedding {total_embedded} new/updated reviews: {total_encoded} unique texts "
+              f"encoded, {total_embedded - total_encoded} reused an existing vector.")
+    else:
+        print("[+] No new reviews to embed.")
+    if total_backfilled:
+        print(f"[+] Backfilled review attributes for {total_backfilled} cached embeddings.")
+    return total_embedded
+
+def _embed_reviews(sqlite_conn, embedder, all_reviews):
+    """Embeds `all_reviews`, or the changes of the review source if omitted.
+
+    The sources in ORDERED_SOURCES are synced incrementally (see `sync_reviews`); file exports
+    are streamed in full and only their uncached reviews are encoded.
+
+    Returns:
+        tuple: The IDs of the reviews that were added or changed, and of those that were
+               removed, or None if the removed reviews are unknown.
+    """
+    if all_reviews is not None:
+        embed_new_reviews(sqlite_conn, _batched(all_reviews), embedder)
+        return (), None
+    if REVIEW_SOURCE in ORDERED_SOURCES:
+        # Imported here, as the sync module builds on the functions of this one.
+        from src.rag_airbnb_sync import sync_reviews
+        return sync_reviews(sqlite_conn, embedder)
+    embed_new_reviews(sqlite_conn, iter_review_batches(limit=LIMIT), embedder)
+    return (), None
+
+def update_embeddings_with_sqlite(all_reviews=None):
+    """Embeds new reviews into the SQLite cache without loading the cached embeddings.
+
+    This is the incremental counterpart of `build_embeddings_with_sqlite`: the FAISS index
+    is then brought up to date with `update_faiss_index`, which reads only the changed rows.
+
+    When reviews are read from an ordered source, only its changes since the last run are
+    applied, and the IDs of the added, edited and deleted reviews are returned so that
+    `update_faiss_index` can skip diffing the whole cache against the index.
+
+    Args:
+        all_reviews (list[dict], optional): Reviews to embed. If omitted, reviews are
+                                            streamed from the primary database.
+
+    Returns:
+        tuple: A tuple containing:
+            - SentenceTransformer: The sentence-transformer model instance.
+            - tuple: The arguments of `update_faiss_index`: the IDs of the added or changed
+                     reviews, and of the removed reviews (None if unknown).
+    """
+    print("Starting embedding pipeline with SQLite cache...")
+    sqlite_conn = init_sqlite()
+    # Initialize the sentence-transformer model.
+    embedder = SentenceTransformer(EMBED_MODEL)
+    # Texts cached under another model only need encoding, not a new database read.
+    embed_cached_texts(sqlite_conn, embedder)
+    changes = _embed_reviews(sqlite_conn, embedder, all_reviews)
+    sqlite_conn.close()
+    return embedder, changes
+
+def build_embeddings_with_sqlite(all_reviews=None):
     """Builds embeddings for all reviews, using the SQLite cache to avoid re-computation.
 
     This function identifies which reviews are new or updated since the last run,
@@ -99,55 +1144,34 @@ def build_embeddings_with_sqlite(all_reviews):
     them for building the FAISS index.
 
     Args:
-        all_reviews (list[dict]): A list of all reviews loaded from the primary database.
+        all_reviews (list[dict], optional): A list of all reviews loaded from the primary
+                                            database. If omitted, reviews are streamed
+                                            from the primary database batch by batch.
 
     Returns:
         tuple: A tuple containing:
             - np.ndarray: A 2D numpy array of all review embeddings.
             - SentenceTransformer: The sentence-transformer model instance.
             - list[dict]: A list of dictionaries containing the metadata for each review
-                          (review_id, listing_id, text), ordered to match the embeddings array.
+                          (review_id, text and the `REVIEW_ATTRIBUTE_COLUMNS`), ordered to
+                          match the embeddings array.
     """
     print("Starting embedding pipeline with SQLite cache...")
     sqlite_conn = init_sqlite()
-    existing_ids = get_existing_ids(sqlite_conn)
-    print(f"Found {len(existing_ids)} existing embeddings in SQLite. Resuming from where left off.")
 
     # Initialize the sentence-transformer model.
     embedder = SentenceTransformer(EMBED_MODEL)
-
-    # Filter out reviews that have already been embedded.
-    reviews_to_embed = [r for r in all_reviews if r[ID_COLUMN] not in existing_ids]
-    total_to_embed = len(reviews_to_embed)
-
-    if total_to_embed > 0:
-        print(f"[+] Creating embeddings for {total_to_embed} new/updated reviews...")
-        # Process the new reviews in batches to manage memory usage.
-        for i in tqdm(range(0, total_to_embed, BATCH_SIZE), desc="Embedding batches"):
-            batch = reviews_to_embed[i:i + BATCH_SIZE]
-            batch_texts = [r["text"] for r in batch]
-            # Generate embeddings for the batch of review texts.
-            batch_embeddings = embedder.encode(batch_texts, normalize_embeddings=True)
-
-            # Save each new embedding to the SQLite cache.
-            for j, r in enumerate(batch):
-                save_embedding_to_sqlite(sqlite_conn, r[ID_COLUMN], r["text"], batch_embeddings[j])
-        print(f"[+] Finished embedding {total_to_embed} reviews.")
-    else:
-        print("[+] No new reviews to embed.")
+    # Texts cached under another model only need encoding, not a new database read.
+    embed_cached_texts(sqlite_conn, embedder)
+    _embed_reviews(sqlite_conn, embedder, all_reviews)
 
     # Load all embeddings (newly generated + existing) from the SQLite cache.
-    all_embedded_data = load_all_embeddings_from_sqlite(sqlite_conn)
+    columns, embeddings_array = load_all_embeddings_from_sqlite(sqlite_conn)
     sqlite_conn.close()
 
-    # Prepare the data for building the FAISS index.
-    # This involves creating a numpy array of all embeddings and a corresponding list of review metadata.
-    embeddings_array = np.array([d["embedding"] for d in all_embedded_data], dtype=np.float32)
-    reviews_for_faiss = [{
-        "review_id": d[ID_COLUMN],
-        # Re-associate the listing_id with the review data.
-        "listing_id": next((r["listing_id"] for r in all_reviews if r[ID_COLUMN] == d[ID_COLUMN]), ""),
-        "text": d["text"]
-    } for d in all_embedded_data]
+    # Prepare the corresponding list of review metadata for building the FAISS index.
+    # Every attribute comes from the cache itself, so this is a single linear pass and
+    # also covers cached reviews that are no longer part of `all_reviews`.
+    reviews_for_faiss = columns_to_records(columns)
 
     return embeddings_array, embedder, reviews_for_faiss
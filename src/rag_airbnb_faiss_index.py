@@ -1,23 +1,250 @@
 # This script is responsible for building, saving, loading, and querying the FAISS index.
 # FAISS (Facebook AI Similarity Search) is a library for efficient similarity search
-# and clustering of dense vectors.
+# and clustering of dense vectors. The review metadata is kept next to the index in the
+# memory-mapped columnar store implemented in `rag_airbnb_metadata_store.py`.
 
 import faiss
+import hashlib
+import json
+import math
 import numpy as np
 import os
 import pickle
 
-from src.rag_airbnb_config import FAISS_INDEX_PATH
+from src.rag_airbnb_lexical import RETRIEVAL_MODES, lexical_search, reciprocal_rank_fusion
+from src.rag_airbnb_metadata_store import ReviewMetadataStore, replace_metadata_store
+from src.rag_airbnb_metrics import span
+from src.rag_airbnb_config import (
+    FAISS_INDEX_PATH, FAISS_DELTA_COMPACT_RATIO, FAISS_INDEX_FACTORY, FAISS_METRIC,
+    FAISS_TRAIN_SAMPLE_SIZE, FAISS_NPROBE, FAISS_EF_SEARCH, FAISS_FILTER_EXACT_MAX,
+    FAISS_TWO_STAGE, FAISS_LISTING_CANDIDATES, FAISS_LISTING_VECTORS, FAISS_LISTING_MAX_REVIEWS, EMBED_MODEL,
+    FAISS_QUANTIZATION, RETRIEVAL_MODE, HYBRID_CANDIDATES,
+)
 
-# Define the path for the metadata file, which is stored alongside the FAISS index.
-METADATA_PATH = FAISS_INDEX_PATH.replace(".index", ".pkl")
+# Define the path for the metadata store directory, which is stored alongside the FAISS index.
+METADATA_PATH = FAISS_INDEX_PATH.replace(".index", ".meta")
+# Metadata written by older versions as a single pickle; it is converted on first load.
+LEGACY_METADATA_PATH = FAISS_INDEX_PATH.replace(".index", ".pkl")
+# Define the path for the delta log holding incremental updates not yet compacted into the index file.
+DELTA_PATH = FAISS_INDEX_PATH.replace(".index", ".delta")
+# Define the paths of the per-listing index used by two-stage retrieval and of the listing IDs its vectors belong to.
+LISTING_INDEX_PATH = FAISS_INDEX_PATH.replace(".index", ".listings.index")
+LISTING_IDS_PATH = FAISS_INDEX_PATH.replace(".index", ".listings.json")
+# Define the path of the file recording the embedding model and index type the index was built with.
+BUILD_INFO_PATH = FAISS_INDEX_PATH.replace(".index", ".build.json")
+# The metadata columns that retrieval can filter on. They are stored as integer codes in the
+# metadata store so that matching reviews are found without decoding every row.
+FILTER_COLUMNS = ["listing_id", "city", "property_country", "review_lang"]
+
+def review_id_to_faiss_id(review_id):
+    """Maps a review ID to the stable 64-bit integer key used inside the FAISS index.
+
+    Airbnb review IDs are numeric and are used as-is. Any other ID is hashed, so the
+    same review always maps to the same key across runs.
+
+    Args:
+        review_id (str): The unique ID of the review.
+
+    Returns:
+        int: A non-negative integer that fits in an int64.
+    """
+    try:
+        faiss_id = int(review_id)
+        if 0 <= faiss_id < 2**63:
+            return faiss_id
+    except ValueError:
+        pass
+    digest = hashlib.blake2b(str(review_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & (2**63 - 1)
+
+# Map the FAISS_METRIC setting to the FAISS metric constants.
+METRICS = {"ip": faiss.METRIC_INNER_PRODUCT, "l2": faiss.METRIC_L2}
+# Map the FAISS_QUANTIZATION setting to FAISS vector encodings ("pq<m>" is handled separately).
+QUANTIZERS = {"fp16": "SQfp16", "sq8": "SQ8", "sq4": "SQ4"}
+
+def quantized_factory(index_factory=FAISS_INDEX_FACTORY, quantization=FAISS_QUANTIZATION):
+    """Applies a FAISS_QUANTIZATION setting to an index factory string.
+
+    The encoding replaces the vector storage of the factory: "Flat" becomes "SQ8",
+    "IVF1024,Flat" becomes "IVF1024,SQ8" and "HNSW32" becomes "HNSW32,SQ8". Factories that
+    already name an encoding (e.g. "IVF1024,PQ32") have it replaced.
+
+    Args:
+        index_factory (str): A FAISS index factory string.
+        quantization (str): "none", "fp16", "sq8", "sq4" or "pq<m>".
+
+    Returns:
+        str: The factory string of the quantized index.
+    """
+    if quantization == "none":
+        return index_factory
+    if quantization in QUANTIZERS:
+        encoding = QUANTIZERS[quantization]
+    elif quantization.startswith("pq") and quantization[2:].isdigit():
+        encoding = f"PQ{quantization[2:]}"
+    else:
+        raise ValueError(f"Unknown FAISS_QUANTIZATION {quantization!r}.")
+
+    parts = index_factory.split(",")
+    if parts[-1] == "Flat" or parts[-1].startswith(("SQ", "PQ")):
+        parts[-1] = encoding
+    elif len(parts) == 1 and parts[0].startswith("HNSW"):
+        parts.append(encoding)
+    else:
+        print(f"⚠️ Cannot apply FAISS_QUANTIZATION={quantization} to '{index_factory}'. Using it unchanged.")
+    return ",".join(parts)
+
+def create_faiss_index(embeddings, faiss_ids, index_factory=None, metric=FAISS_METRIC):
+    """Creates an in-memory, ID-mapped FAISS index of the requested type and fills it.
+
+    Index types that need training (IVF, SQ, PQ) are trained on a random sample of at most
+    `FAISS_TRAIN_SAMPLE_SIZE` embeddings. If training fails, typically because the corpus
+    is smaller than the number of IVF lists, an exact flat index is used instead.
+
+    Args:
+        embeddings (np.ndarray): A 2D float32 array of embeddings.
+        faiss_ids (np.ndarray): The int64 key of each embedding.
+        index_factory (str, optional): A FAISS index factory string, e.g. "Flat" or
+                                       "IVF1024,Flat". Defaults to FAISS_INDEX_FACTORY with
+                                       FAISS_QUANTIZATION applied (see `quantized_factory`).
+        metric (str): "ip" or "l2".
+
+    Returns:
+        faiss.Index: The filled index.
+    """
+    index_factory = index_factory or quantized_factory()
+    dim = embeddings.shape[1]
+    faiss_metric = METRICS[metric]
+    inner_index = faiss.index_factory(dim, index_factory, faiss_metric)
+    if not inner_index.is_trained:
+        n_train = min(len(embeddings), FAISS_TRAIN_SAMPLE_SIZE)
+        sample = embeddings[np.random.default_rng(0).choice(len(embeddings), n_train, replace=False)]
+        try:
+            with span("index.train", rows=n_train, factory=index_factory):
+                inner_index.train(sample)
+        except RuntimeError as e:
+            print(f"⚠️ Could not train a '{index_factory}' index on {n_train} vectors ({e}). Using a flat index instead.")
+            inner_index = faiss.index_factory(dim, "Flat", faiss_metric)
+    # Wrap the index in an ID map so that every vector is addressed by its review key.
+    index = faiss.IndexIDMap2(inner_index)
+    with span("index.add", rows=len(embeddings)):
+        index.add_with_ids(embeddings, faiss_ids)
+    set_search_params(index)
+    return index
+
+def set_search_params(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH):
+    """Sets the default search-time accuracy/speed knobs on an index.
+
+    The values persist for every later search of the index, so this is only called when an
+    index is created or loaded; a single search overrides them through `search_faiss_ids`.
+
+    Parameters that do not apply to the index type (e.g. `nprobe` on an HNSW index) are
+    ignored, so this can be called on any index.
+
+    Args:
+        index (faiss.Index): The FAISS index.
+        nprobe (int, optional): The number of IVF lists to probe.
+        ef_search (int, optional): The size of the HNSW candidate list.
+    """
+    params = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        if value is None:
+            continue
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+
+def _is_id_mapped(index):
+    """Returns True if the index stores vectors under explicit IDs."""
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2))
+
+def index_build_info():
+    """Returns the embedding model, index factory string and metric the saved index was built with.
+
+    Returns:
+        dict: The "model", "index_factory" and "metric" entries, or an empty dict for indexes
+              saved before they were recorded.
+    """
+    try:
+        with open(BUILD_INFO_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _write_base_files(index, metadata_items, old_store=None):
+    """Writes the index file and metadata store, swaps them in and discards the delta log.
+
+    Args:
+        index (faiss.Index): The index to save.
+        metadata_items (Iterable[tuple[int, dict]]): (FAISS ID, review metadata) pairs.
+        old_store (ReviewMetadataStore, optional): The store being replaced. Its memory
+                                                   maps are released before the swap.
+
+    Returns:
+        ReviewMetadataStore: The newly written metadata store.
+    """
+    from src.rag_airbnb_embedding import REVIEW_ATTRIBUTE_COLUMNS
+
+    faiss.write_index(index, FAISS_INDEX_PATH + ".tmp")
+    # The new store may be streamed from the old one, so the old files are only released
+    # once it has been written. The columns are fixed up front, because rows converted from
+    # an older store can lack attributes that newer rows have.
+    replace_metadata_store(
+        METADATA_PATH, metadata_items, release=old_store.close if old_store else None,
+        columns=["review_id", "text", *REVIEW_ATTRIBUTE_COLUMNS], categorical=FILTER_COLUMNS,
+    )
+    os.replace(FAISS_INDEX_PATH + ".tmp", FAISS_INDEX_PATH)
+    with open(BUILD_INFO_PATH, "w", encoding="utf-8") as f:
+        json.dump({"model": EMBED_MODEL, "index_factory": quantized_factory(), "metric": FAISS_METRIC}, f)
+    # The base files now include every logged change. Replaying the log on top of them
+    # would be harmless, since each delta record is idempotent, but it is no longer needed.
+    if os.path.exists(DELTA_PATH):
+        os.remove(DELTA_PATH)
+    return ReviewMetadataStore(METADATA_PATH)
+
+def _apply_delta(index, reviews_for_faiss, delta):
+    """Applies one delta record (removed IDs, then added vectors) to the index and metadata."""
+    # Added IDs that are already indexed are removed first so that re-applying a record,
+    # or upserting an existing review, never leaves two vectors under the same key.
+    remove_ids = np.array(
+        [i for i in np.concatenate([delta["remove_ids"], delta["add_ids"]]).tolist() if i in reviews_for_faiss],
+        dtype=np.int64,
+    )
+    if remove_ids.size:
+        index.remove_ids(remove_ids)
+        for faiss_id in remove_ids.tolist():
+            reviews_for_faiss.pop(faiss_id, None)
+    if delta["add_ids"].size:
+        index.add_with_ids(delta["add_embeddings"], delta["add_ids"])
+        reviews_for_faiss.update(zip(delta["add_ids"].tolist(), delta["add_reviews"]))
+
+def _read_deltas():
+    """Reads every record of the delta log, ignoring a truncated trailing record."""
+    deltas = []
+    if not os.path.exists(DELTA_PATH):
+        return deltas
+    with open(DELTA_PATH, "rb") as f:
+        while True:
+            try:
+                deltas.append(pickle.load(f))
+            except EOFError:
+                break
+            except pickle.UnpicklingError:
+                # A crash during an append can leave a partial record at the end of the log.
+                print(f"⚠️ Ignoring a truncated record at the end of {DELTA_PATH}.")
+                break
+    return deltas
 
 def build_faiss_index(embeddings, reviews_for_faiss):
     """Builds and saves a FAISS index from the given embeddings.
 
-    This function creates a FAISS index using the L2 distance metric (IndexFlatL2).
-    It also saves the associated review metadata (e.g., review_id, listing_id, text)
-    to a separate pickle file.
+    This function creates a FAISS index of the type set by `FAISS_INDEX_FACTORY`,
+    `FAISS_QUANTIZATION` and `FAISS_METRIC` (see `create_faiss_index`), wrapped in an ID map so that every vector
+    is stored under its review's stable key (see `review_id_to_faiss_id`). This allows
+    later runs to add, replace and remove individual reviews with `update_faiss_index`
+    instead of rebuilding the index. It also saves the associated review metadata (e.g.,
+    review_id, listing_id, text) to a memory-mapped columnar store next to the index.
 
     Args:
         embeddings (np.ndarray): A 2D numpy array of review embeddings.
@@ -25,69 +252,800 @@ def build_faiss_index(embeddings, reviews_for_faiss):
                                       to match the embeddings array.
 
     Returns:
-        faiss.Index: The newly created FAISS index, or None if no embeddings are provided.
+        tuple: A tuple containing:
+            - faiss.Index: The newly created FAISS index, or None if no embeddings are provided.
+            - ReviewMetadataStore: The review metadata keyed by FAISS ID, or None.
     """
     if embeddings.shape[0] == 0:
         print("⚠️ No embeddings to build index from. Skipping FAISS index creation.")
-        return None
-
-    # Get the dimension of the embeddings from the shape of the embeddings array.
-    dim = embeddings.shape[1]
-    # Create a FAISS index with the L2 distance metric.
-    index = faiss.IndexFlatL2(dim)
-    # Add the embeddings to the index.
-    index.add(embeddings)
-    # Save the index to disk.
-    faiss.write_index(index, FAISS_INDEX_PATH)
+        return None, None
 
-    # Save the review metadata to a pickle file.
-    with open(METADATA_PATH, "wb") as f:
-        pickle.dump(reviews_for_faiss, f)
+    # Create the FAISS index, addressed by review key, and add the embeddings to it.
+    faiss_ids = np.array([review_id_to_faiss_id(r["review_id"]) for r in reviews_for_faiss], dtype=np.int64)
+    index = create_faiss_index(embeddings, faiss_ids)
+    # Save the index and the review metadata to disk.
+    with span("index.save", rows=len(faiss_ids)):
+        reviews_by_faiss_id = _write_base_files(index, zip(faiss_ids.tolist(), reviews_for_faiss))
+    # Build the per-listing index used by two-stage retrieval next to it.
+    with span("index.build_listings"):
+        ListingIndex.build(embeddings, [r.get("listing_id", "") for r in reviews_for_faiss]).save()
 
     print(f"[+] Index saved to {FAISS_INDEX_PATH}")
     print(f"[+] Metadata saved to {METADATA_PATH}")
-    return index
+    print(f"[+] Listing index saved to {LISTING_INDEX_PATH}")
+    return index, reviews_by_faiss_id
+
+def listing_vectors(embeddings, listing_ids, vectors_per_listing=FAISS_LISTING_VECTORS, metric=FAISS_METRIC):
+    """Computes the vectors that represent each listing in the per-listing index.
+
+    With one vector per listing, it is the centroid of the listing's review embeddings.
+    With more, the reviews of each listing are clustered with k-means and the review
+    closest to each cluster centre (a medoid) is kept, so a listing whose reviews talk
+    about several things can be found through any of them. Listings with no more reviews
+    than `vectors_per_listing` are represented by all of their reviews.
+
+    Args:
+        embeddings (np.ndarray): A 2D float32 array of review embeddings.
+        listing_ids (list[str]): The listing of each review.
+        vectors_per_listing (int): The maximum number of vectors per listing.
+        metric (str): "ip" or "l2". With "ip", centroids are re-normalized to unit length.
+
+    Returns:
+        tuple: A tuple containing:
+            - list[str]: The distinct listing IDs, sorted.
+            - np.ndarray: The representative vectors, grouped by listing.
+            - np.ndarray: For each vector, the position of its listing in the list.
+    """
+    listings, codes = np.unique(np.asarray([str(l) for l in listing_ids]), return_inverse=True)
+    codes = codes.ravel()
+    dim = embeddings.shape[1]
+    if vectors_per_listing <= 1:
+        # Sum the embeddings of each listing in one pass, then divide by the review counts.
+        sums = np.zeros((len(listings), dim), dtype=np.float64)
+        np.add.at(sums, codes, embeddings)
+        vectors = np.ascontiguousarray(sums / np.bincount(codes, minlength=len(listings))[:, None], dtype=np.float32)
+        if metric == "ip":
+            faiss.normalize_L2(vectors)
+        return listings.tolist(), vectors, np.arange(len(listings), dtype=np.int64)
+
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(listings) + 1))
+    parts, owners = [], []
+    for pos in range(len(listings)):
+        members = embeddings[order[bounds[pos]:bounds[pos + 1]]]
+        if len(members) > vectors_per_listing:
+            kmeans = faiss.Kmeans(dim, vectors_per_listing, niter=10, seed=pos, min_points_per_centroid=1)
+            kmeans.train(np.ascontiguousarray(members, dtype=np.float32))
+            _, nearest = faiss.knn(kmeans.centroids, members, 1)
+            members = members[np.unique(nearest[:, 0])]
+        parts.append(members)
+        owners.append(np.full(len(members), pos, dtype=np.int64))
+    return listings.tolist(), np.ascontiguousarray(np.concatenate(parts), dtype=np.float32), np.concatenate(owners)
+
+class ListingIndex:
+    """The per-listing index searched by the first stage of two-stage retrieval.
+
+    Every listing is represented by up to `vectors_per_listing` vectors (see
+    `listing_vectors`), kept in an exact flat index under the IDs
+    `position * vectors_per_listing + j`, where `position` is the listing's position in
+    `listing_ids`. The index holds one small vector set per listing instead of one per
+    review, so it is fast to search and cheap to keep in memory.
+    """
+
+    def __init__(self, index, listing_ids, vectors_per_listing):
+        self.index = index
+        self.listing_ids = list(listing_ids)
+        self.vectors_per_listing = vectors_per_listing
+        self.positions = {listing_id: pos for pos, listing_id in enumerate(self.listing_ids)}
+
+    @classmethod
+    def build(cls, embeddings, listing_ids, vectors_per_listing=FAISS_LISTING_VECTORS, metric=FAISS_METRIC):
+        """Builds the per-listing index from review embeddings and the listing of each review."""
+        vectors_per_listing = max(vectors_per_listing, 1)
+        listing_index = cls(faiss.IndexIDMap2(faiss.IndexFlat(embeddings.shape[1], METRICS[metric])), [],
+                            vectors_per_listing)
+        listing_index._add(embeddings, listing_ids)
+        return listing_index
+
+    def _add(self, embeddings, listing_ids):
+        """Computes and adds the vectors of listings that are not in the index yet."""
+        if len(embeddings) == 0:
+            return
+        metric = "ip" if self.index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+        listings, vectors, owners = listing_vectors(embeddings, listing_ids, self.vectors_per_listing, metric)
+        for listing_id in listings:
+            if listing_id not in self.positions:
+                self.positions[listing_id] = len(self.listing_ids)
+                self.listing_ids.append(listing_id)
+        # Number the vectors of each listing 0, 1, ... within its block of IDs.
+        positions = np.array([self.positions[listing_id] for listing_id in listings], dtype=np.int64)[owners]
+        rank = np.arange(len(owners)) - np.searchsorted(owners, owners)
+        self.index.add_with_ids(vectors, positions * self.vectors_per_listing + rank)
+
+    def replace(self, listing_ids, embeddings, review_listing_ids):
+        """Recomputes the vectors of listings whose reviews changed.
+
+        Args:
+            listing_ids (Iterable[str]): The listings to recompute. Those without reviews
+                                         in `embeddings` are removed from the index.
+            embeddings (np.ndarray): The current embeddings of every review of those listings.
+            review_listing_ids (list[str]): The listing of each row of `embeddings`.
+        """
+        positions = np.array([self.positions[l] for l in map(str, listing_ids) if l in self.positions], dtype=np.int64)
+        stale = (positions[:, None] * self.vectors_per_listing + np.arange(self.vectors_per_listing)).ravel()
+        if stale.size:
+            self.index.remove_ids(stale)
+        self._add(embeddings, review_listing_ids)
+
+    def search(self, query_vectors, n_listings, allowed=None):
+        """Returns the listings closest to each query, best first.
+
+        Args:
+            query_vectors (np.ndarray): A 2D array with one query embedding per row.
+            n_listings (int): The number of listings to return per query.
+            allowed (Iterable[str], optional): Only consider these listings.
+
+        Returns:
+            list[list[str]]: The IDs of the selected listings, one list per query.
+        """
+        params = None
+        if allowed is not None:
+            positions = np.array([self.positions[l] for l in allowed if l in self.positions], dtype=np.int64)
+            if positions.size == 0:
+                return [[] for _ in range(len(query_vectors))]
+            ids = (positions[:, None] * self.vectors_per_listing + np.arange(self.vectors_per_listing)).ravel()
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids))
+        # A listing can own several of the nearest vectors, so search enough for n distinct listings.
+        k = min(n_listings * self.vectors_per_listing, max(self.index.ntotal, 1))
+        D, I = self.index.search(np.ascontiguousarray(query_vectors, dtype=np.float32), k, params=params)
+        results = []
+        for row in I:
+            listings = []
+            for listing_id in (self.listing_ids[i // self.vectors_per_listing] for i in row.tolist() if i >= 0):
+                if listing_id not in listings:
+                    listings.append(listing_id)
+            results.append(listings[:n_listings])
+        return results
+
+    def save(self, index_path=LISTING_INDEX_PATH, ids_path=LISTING_IDS_PATH):
+        """Writes the index and the listing IDs to disk, replacing the previous files."""
+        faiss.write_index(self.index, index_path + ".tmp")
+        with open(ids_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"vectors_per_listing": self.vectors_per_listing, "listing_ids": self.listing_ids}, f)
+        os.replace(index_path + ".tmp", index_path)
+        # The listing IDs file is written last; its version identifies the saved pair.
+        os.replace(ids_path + ".tmp", ids_path)
+        stat = os.stat(ids_path)
+        _listing_index_cache["current"] = ((stat.st_mtime_ns, stat.st_size), self)
+
+# The loaded per-listing index, keyed by the version of its files on disk.
+_listing_index_cache = {}
+
+def load_listing_index():
+    """Returns the saved per-listing index, or None if it has not been built.
+
+    The index is read once and reused until its files change on disk.
+    """
+    try:
+        stat = os.stat(LISTING_IDS_PATH)
+    except FileNotFoundError:
+        return None
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _listing_index_cache.get("current")
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with open(LISTING_IDS_PATH, encoding="utf-8") as f:
+        saved = json.load(f)
+    listing_index = ListingIndex(faiss.read_index(LISTING_INDEX_PATH), saved["listing_ids"], saved["vectors_per_listing"])
+    _listing_index_cache["current"] = (version, listing_index)
+    return listing_index
+
+def _refresh_listing_index(sqlite_conn, reviews_for_faiss, listing_ids):
+    """Recomputes the per-listing vectors of listings whose reviews changed, from the SQLite cache."""
+    from src.rag_airbnb_embedding import load_embeddings_by_ids
+
+    listing_index = load_listing_index()
+    if listing_index is None or not listing_ids:
+        return
+    faiss_ids = reviews_for_faiss.ids_where({"listing_id": sorted(listing_ids)})
+    review_ids = reviews_for_faiss.values_of("review_id", faiss_ids).tolist()
+    columns, embeddings = load_embeddings_by_ids(sqlite_conn, review_ids)
+    listing_index.replace(listing_ids, embeddings, columns["listing_id"])
+    listing_index.save()
+
+def _convert_legacy_metadata():
+    """Converts metadata pickled by older versions into the columnar store.
+
+    Older metadata is a dictionary keyed by FAISS ID or, before the index was ID-mapped,
+    a list ordered like the index; list positions match the sequential IDs of a plain index.
+    """
+    print(f"[+] Converting {LEGACY_METADATA_PATH} to the columnar metadata store...")
+    with open(LEGACY_METADATA_PATH, "rb") as f:
+        reviews_for_faiss = pickle.load(f)
+    if isinstance(reviews_for_faiss, list):
+        reviews_for_faiss = dict(enumerate(reviews_for_faiss))
+    replace_metadata_store(METADATA_PATH, reviews_for_faiss.items())
+    os.remove(LEGACY_METADATA_PATH)
+
+def _load_index_with_deltas(mmap=False):
+    """Loads the base index and metadata and replays the delta log on top of them.
+
+    Args:
+        mmap (bool): Memory-map the index file read-only instead of reading it into RAM.
+                     Ignored if the delta log is not empty, since a memory-mapped index
+                     cannot be modified.
+
+    Returns:
+        tuple: (index, metadata store, number of changes replayed from the delta log),
+               or (None, None, 0) if no index has been saved yet.
+    """
+    if not os.path.exists(METADATA_PATH) and os.path.exists(LEGACY_METADATA_PATH):
+        _convert_legacy_metadata()
+    if not os.path.exists(FAISS_INDEX_PATH) or not os.path.exists(METADATA_PATH):
+        return None, None, 0
+
+    deltas = _read_deltas()
+    # Load the FAISS index from disk. With IO_FLAG_MMAP_IFC the vector storage of flat and
+    # HNSW indexes stays in the page cache, shared by every process that maps the file.
+    if mmap and not deltas:
+        index = faiss.read_index(FAISS_INDEX_PATH, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    else:
+        index = faiss.read_index(FAISS_INDEX_PATH)
+    # Open the memory-mapped review metadata store.
+    reviews_for_faiss = ReviewMetadataStore(METADATA_PATH)
+    set_search_params(index)
+
+    pending_changes = 0
+    if _is_id_mapped(index):
+        for delta in deltas:
+            _apply_delta(index, reviews_for_faiss, delta)
+            pending_changes += delta["add_ids"].size + delta["remove_ids"].size
+    return index, reviews_for_faiss, pending_changes
+
+def update_faiss_index(changed_review_ids=(), removed_review_ids=None):
+    """Brings the persisted FAISS index up to date with the SQLite embeddings cache.
+
+    The cache is the source of truth. Reviews cached but not indexed are added, reviews
+    indexed but no longer cached are removed, and `changed_review_ids` are replaced with
+    their current cached vectors. Only the embeddings of added or changed reviews are read
+    from the cache, and only the change itself is appended to the delta log on disk.
+    The log is compacted into the base index file once it grows past
+    `FAISS_DELTA_COMPACT_RATIO` of the index size.
+
+    When `removed_review_ids` is given, as after an incremental sync of the review source,
+    the change set is applied without diffing every cached ID against the index. The
+    resulting index size is checked against the number of cached reviews, and the full
+    diff is used if they disagree (e.g. after an interrupted update).
+
+    If no ID-mapped index exists yet, the index type cannot remove vectors (HNSW), or the
+    index was built with another EMBED_MODEL, index type (FAISS_INDEX_FACTORY and
+    FAISS_QUANTIZATION) or FAISS_METRIC, the index is built from the whole cache instead.
 
-def load_faiss_index_and_metadata():
+    Args:
+        changed_review_ids (Iterable[str]): IDs of reviews whose embedding was re-computed.
+        removed_review_ids (Iterable[str], optional): IDs of the reviews deleted from the cache,
+                                                      if `changed_review_ids` lists every added
+                                                      or changed review.
+
+    Returns:
+        tuple: A tuple containing:
+            - faiss.Index: The up-to-date FAISS index, or None if the cache is empty.
+            - ReviewMetadataStore: The review metadata keyed by FAISS ID, or None.
+    """
+    from src.rag_airbnb_embedding import (
+        init_sqlite, get_existing_ids, load_all_embeddings_from_sqlite, load_embeddings_by_ids, columns_to_records,
+        count_cached_reviews,
+    )
+
+    def rebuild_from_cache():
+        # The rebuild renames the metadata store directory, which fails on Windows while
+        # the open store still has its files memory-mapped.
+        if reviews_for_faiss is not None:
+            reviews_for_faiss.close()
+        columns, embeddings = load_all_embeddings_from_sqlite(sqlite_conn)
+        sqlite_conn.close()
+        return build_faiss_index(embeddings, columns_to_records(columns))
+
+    sqlite_conn = init_sqlite()
+    index, reviews_for_faiss, pending_changes = _load_index_with_deltas()
+    if index is None or not _is_id_mapped(index):
+        print("[+] No incremental FAISS index found. Building it from the SQLite cache...")
+        return rebuild_from_cache()
+    built = index_build_info()
+    if built.get("model", EMBED_MODEL) != EMBED_MODEL:
+        # Vectors of different models cannot be mixed in one index.
+        print(f"[+] The FAISS index was built with {built['model']}. Rebuilding it for {EMBED_MODEL}...")
+        return rebuild_from_cache()
+    if built.get("index_factory", quantized_factory()) != quantized_factory():
+        print(f"[+] The FAISS index type changed from '{built['index_factory']}' to '{quantized_factory()}'. "
+              "Rebuilding it from the SQLite cache...")
+        return rebuild_from_cache()
+    # Indexes saved before the metric was recorded still know their own metric.
+    built_metric = built.get("metric") or next((m for m, v in METRICS.items() if v == index.metric_type), FAISS_METRIC)
+    if built_metric != FAISS_METRIC:
+        print(f"[+] The FAISS metric changed from '{built_metric}' to '{FAISS_METRIC}'. "
+              "Rebuilding it from the SQLite cache...")
+        return rebuild_from_cache()
+
+    ids_to_add = ids_to_remove = None
+    if removed_review_ids is not None:
+        # Use the change set, if applying it yields as many vectors as there are cached reviews.
+        ids_to_remove = {i for i in removed_review_ids if review_id_to_faiss_id(i) in reviews_for_faiss}
+        ids_to_add = set(changed_review_ids) - set(removed_review_ids)
+        new_ids = sum(review_id_to_faiss_id(i) not in reviews_for_faiss for i in ids_to_add)
+        if len(reviews_for_faiss) + new_ids - len(ids_to_remove) != count_cached_reviews(sqlite_conn):
+            print("[+] The FAISS index does not match the cache plus the synced changes. Comparing every review ID...")
+            ids_to_add = ids_to_remove = None
+    if ids_to_add is None:
+        # Diff the cached review IDs against the indexed ones.
+        cached_ids = get_existing_ids(sqlite_conn)
+        indexed_ids = set(reviews_for_faiss.column("review_id"))
+        changed_ids = set(changed_review_ids) & cached_ids
+        ids_to_add = (cached_ids - indexed_ids) | changed_ids
+        ids_to_remove = indexed_ids - cached_ids
+
+    if not ids_to_add and not ids_to_remove:
+        sqlite_conn.close()
+        print("[+] FAISS index is already up to date.")
+        return index, reviews_for_faiss
+
+    columns, embeddings = load_embeddings_by_ids(sqlite_conn, ids_to_add)
+    add_reviews = columns_to_records(columns)
+    delta = {
+        "add_ids": np.array([review_id_to_faiss_id(r["review_id"]) for r in add_reviews], dtype=np.int64),
+        "add_embeddings": embeddings,
+        "add_reviews": add_reviews,
+        "remove_ids": np.array([review_id_to_faiss_id(i) for i in ids_to_remove], dtype=np.int64),
+    }
+    # The listings of added, replaced and removed reviews need new per-listing vectors.
+    touched_listings = {str(r.get("listing_id", "")) for r in add_reviews}
+    for faiss_id in np.concatenate([delta["remove_ids"], delta["add_ids"]]).tolist():
+        doc = reviews_for_faiss.get(faiss_id)
+        if doc is not None:
+            touched_listings.add(doc.get("listing_id", ""))
+    try:
+        with span("index.apply_delta", added=len(ids_to_add), removed=len(ids_to_remove)):
+            _apply_delta(index, reviews_for_faiss, delta)
+    except RuntimeError:
+        # Graph-based indexes such as HNSW do not support removing vectors.
+        print("[+] The index type does not support removals. Rebuilding it from the SQLite cache...")
+        return rebuild_from_cache()
+    with span("index.build_listings", listings=len(touched_listings)):
+        _refresh_listing_index(sqlite_conn, reviews_for_faiss, touched_listings)
+    sqlite_conn.close()
+    print(f"[+] Updated FAISS index: {len(ids_to_add)} added/replaced, {len(ids_to_remove)} removed.")
+
+    pending_changes += delta["add_ids"].size + delta["remove_ids"].size
+    if pending_changes > FAISS_DELTA_COMPACT_RATIO * max(index.ntotal, 1):
+        # The log has grown large relative to the index; fold it into new base files.
+        reviews_for_faiss = _write_base_files(index, reviews_for_faiss.items(), old_store=reviews_for_faiss)
+        print(f"[+] Compacted index saved to {FAISS_INDEX_PATH}")
+    else:
+        # Persist only the change, durably, as one record appended to the delta log.
+        with open(DELTA_PATH, "ab") as f:
+            pickle.dump(delta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        print(f"[+] Index changes appended to {DELTA_PATH}")
+    return index, reviews_for_faiss
+
+def load_embedder():
+    """Loads the sentence-transformer model used to encode queries.
+
+    Sentence Transformers is imported here rather than at module level, since importing it
+    (and PyTorch with it) takes seconds that query-only startup can spend on other work.
+
+    Returns:
+        SentenceTransformer: The initialized sentence-transformer model.
+    """
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBED_MODEL)
+
+def load_faiss_index_and_metadata(with_embedder=True):
     """Loads a FAISS index and its corresponding metadata from disk.
 
-    This function checks for the existence of both the index file and the metadata file.
+    This function checks for the existence of both the index file and the metadata store,
+    and replays any incremental updates recorded in the delta log. Both are memory-mapped
+    when possible, so only the pages touched by searches and lookups are read from disk
+    and worker processes on the same host share them through the OS page cache.
     It also re-initializes the sentence-transformer model to be used for encoding queries.
 
+    Args:
+        with_embedder (bool): Whether to also load the sentence-transformer model. Callers
+                              that load it concurrently with `load_embedder` pass False.
+
     Returns:
         tuple: A tuple containing:
             - faiss.Index: The loaded FAISS index, or None if not found.
-            - list[dict]: The loaded review metadata, or None if not found.
-            - SentenceTransformer: The initialized sentence-transformer model, or None if not found.
+            - ReviewMetadataStore: The loaded review metadata keyed by FAISS ID, or None if not found.
+            - SentenceTransformer: The initialized sentence-transformer model, or None if not
+                                   found or not requested.
     """
-    if not os.path.exists(FAISS_INDEX_PATH) or not os.path.exists(METADATA_PATH):
+    with span("index.load"):
+        index, reviews_for_faiss, _ = _load_index_with_deltas(mmap=True)
+    if index is None:
         return None, None, None
 
-    # Load the FAISS index from disk.
-    index = faiss.read_index(FAISS_INDEX_PATH)
-    # Load the review metadata from the pickle file.
-    with open(METADATA_PATH, "rb") as f:
-        reviews_for_faiss = pickle.load(f)
+    built_model = index_build_info().get("model", EMBED_MODEL)
+    if built_model != EMBED_MODEL:
+        print(f"⚠️ The index was built with {built_model}, but queries are encoded with {EMBED_MODEL}. "
+              "Update the index (option 1) before querying.")
 
     # Re-initialize the sentence-transformer model to be used for encoding queries.
-    from sentence_transformers import SentenceTransformer
-    from src.rag_airbnb_config import EMBED_MODEL
-    embedder = SentenceTransformer(EMBED_MODEL)
+    embedder = load_embedder() if with_embedder else None
 
     print(f"[+] Loaded index from {FAISS_INDEX_PATH}")
     print(f"[+] Loaded metadata from {METADATA_PATH}")
     return index, reviews_for_faiss, embedder
 
-def retrieve_from_faiss(query_vector, index, reviews_for_faiss, embedder, top_k=5):
+def index_version(index):
+    """Returns a value that changes whenever the index in memory or on disk changes.
+
+    It combines the identity and size of the loaded index with the modification time and
+    size of the index file and delta log, so caches keyed on it are invalidated by a
+    rebuild, an incremental update, or a reload.
+
+    Args:
+        index (faiss.Index): The loaded FAISS index.
+
+    Returns:
+        tuple: An opaque, comparable version value.
+    """
+    file_stats = []
+    for path in (FAISS_INDEX_PATH, DELTA_PATH):
+        try:
+            stat = os.stat(path)
+            file_stats.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            file_stats.append(None)
+    return (id(index), index.ntotal if index is not None else 0, *file_stats)
+
+def reconstruct_reviews(index, docs):
+    """Returns the indexed vectors of the given reviews, one row per review.
+
+    Args:
+        index (faiss.Index): The loaded FAISS index.
+        docs (list[dict]): Review metadata, e.g. as returned by `lookup_reviews`.
+
+    Returns:
+        np.ndarray | None: The vectors in the order of `docs`, or None if the index cannot
+                           reconstruct its vectors (e.g. IVF indexes).
+    """
+    ids = np.array([review_id_to_faiss_id(doc["review_id"]) for doc in docs], dtype=np.int64)
+    if not len(ids):
+        return np.empty((0, index.d), dtype=np.float32)
+    try:
+        return index.reconstruct_batch(ids)
+    except RuntimeError:
+        return None
+
+def _search_subset(query_vectors, index, id_filter, top_k):
+    """Scores the queries exactly against the vectors of `id_filter` only.
+
+    Returns:
+        np.ndarray | None: The IDs of the nearest reviews, or None if the index cannot
+                           reconstruct its vectors (e.g. IVF indexes).
+    """
+    try:
+        vectors = index.reconstruct_batch(id_filter)
+    except RuntimeError:
+        return None
+    D, I = faiss.knn(query_vectors, vectors, min(top_k, len(id_filter)), metric=index.metric_type)
+    ids = np.full((len(query_vectors), top_k), -1, dtype=np.int64)
+    ids[:, :I.shape[1]] = np.where(I >= 0, id_filter[np.maximum(I, 0)], -1)
+    return ids
+
+def _search_params(index, top_k, nprobe=None, ef_search=None, selector=None, n_selected=0):
+    """Returns the per-call parameters of an index search, or None to use the index defaults.
+
+    `nprobe` and `ef_search` override the defaults set on the index (see `set_search_params`)
+    for this search only, so later and concurrent searches are not affected. With a
+    `selector`, the search is restricted to the `n_selected` selected IDs, and the accuracy
+    knobs are raised with the selectivity of the filter: an IVF search probes enough lists
+    to expect several times `top_k` matching vectors, and an HNSW search widens its
+    candidate list, since most of the graph neighbours it visits are filtered out.
+    """
+    if selector is None and nprobe is None and ef_search is None:
+        return None
+    ivf = faiss.try_extract_index_ivf(index)
+    inner = faiss.downcast_index(index.index) if _is_id_mapped(index) else index
+    if ivf is not None:
+        nprobe = ivf.nprobe if nprobe is None else nprobe
+        if selector is not None:
+            nprobe = max(nprobe, math.ceil(4 * top_k * ivf.nlist / max(n_selected, 1)))
+        params = faiss.SearchParametersIVF(nprobe=min(ivf.nlist, nprobe))
+    elif hasattr(inner, "hnsw"):
+        ef_search = inner.hnsw.efSearch if ef_search is None else ef_search
+        if selector is not None:
+            fraction = n_selected / max(index.ntotal, 1)
+            ef_search = min(max(ef_search, math.ceil(top_k / max(fraction, 1e-9))), 4096)
+        params = faiss.SearchParametersHNSW(efSearch=ef_search)
+    else:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
+
+def search_faiss_ids(query_vectors, index, top_k=5, nprobe=None, ef_search=None, id_filter=None):
+    """Searches the FAISS index and returns the IDs of the nearest reviews.
+
+    With `id_filter`, only the given reviews are searched. Small filters (at most
+    `FAISS_FILTER_EXACT_MAX` reviews) are scored exactly against just their vectors; larger
+    ones restrict the index search with an ID selector, so the top-k is taken among the
+    matching vectors instead of filtering a global top-k afterwards.
+
+    Args:
+        query_vectors (np.ndarray): A 2D array with one query embedding per row.
+        index (faiss.Index): The FAISS index to search.
+        top_k (int): The number of nearest reviews to return per query.
+        nprobe (int, optional): Overrides the number of IVF lists probed in this search (IVF indexes only).
+        ef_search (int, optional): Overrides the HNSW candidate list size in this search (HNSW indexes only).
+        id_filter (np.ndarray, optional): The int64 FAISS IDs to restrict the search to.
+
+    Returns:
+        np.ndarray: An int64 array of shape (n_queries, top_k). FAISS returns -1 when
+                    fewer than top_k vectors are available.
+    """
+    query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+    if id_filter is None:
+        # D contains the distances, and I contains the IDs of the similar vectors.
+        D, I = index.search(query_vectors, top_k, params=_search_params(index, top_k, nprobe, ef_search))
+        return I
+
+    id_filter = np.ascontiguousarray(id_filter, dtype=np.int64)
+    if len(id_filter) == 0:
+        return np.full((len(query_vectors), top_k), -1, dtype=np.int64)
+    if len(id_filter) <= FAISS_FILTER_EXACT_MAX:
+        I = _search_subset(query_vectors, index, id_filter, top_k)
+        if I is not None:
+            return I
+    # The selector must stay referenced until the search has finished.
+    selector = faiss.IDSelectorBatch(id_filter)
+    params = _search_params(index, top_k, nprobe, ef_search, selector=selector, n_selected=len(id_filter))
+    D, I = index.search(query_vectors, top_k, params=params)
+    return I
+
+def lookup_reviews(reviews_for_faiss, faiss_ids):
+    """Returns the metadata of the given reviews, skipping IDs that are not in the store.
+
+    Args:
+        reviews_for_faiss (ReviewMetadataStore): The review metadata keyed by FAISS ID.
+        faiss_ids (Iterable[int]): The IDs to look up, e.g. one row of `search_faiss_ids`.
+
+    Returns:
+        list[dict]: The review metadata dictionaries, in the order of `faiss_ids`.
+    """
+    docs = []
+    with span("index.lookup"):
+        for faiss_id in faiss_ids:
+            doc = reviews_for_faiss.get(int(faiss_id))
+            if doc is not None:
+                docs.append(doc)
+    return docs
+
+def _validated_filters(filters):
+    """Returns the non-empty entries of a metadata filter, after checking their columns.
+
+    Raises:
+        ValueError: If a filter names a column that cannot be filtered on.
+    """
+    filters = {column: values for column, values in (filters or {}).items() if values}
+    unknown = set(filters) - set(FILTER_COLUMNS)
+    if unknown:
+        raise ValueError(f"Cannot filter on {sorted(unknown)}; use one of {FILTER_COLUMNS}.")
+    return filters
+
+def filter_ids(reviews_for_faiss, filters):
+    """Returns the FAISS IDs of the reviews matching a metadata filter.
+
+    Args:
+        reviews_for_faiss (ReviewMetadataStore): The review metadata keyed by FAISS ID.
+        filters (dict[str, str | list[str]], optional): Accepted values per column of
+            FILTER_COLUMNS, e.g. {"city": "Paris", "review_lang": ["en", "fr"]}. Empty
+            values are ignored.
+
+    Returns:
+        np.ndarray | None: The matching IDs, or None if there is nothing to filter on.
+
+    Raises:
+        ValueError: If a filter names a column that cannot be filtered on.
+    """
+    filters = _validated_filters(filters)
+    if not filters:
+        return None
+    return reviews_for_faiss.ids_where(filters)
+
+def search_two_stage(query_vectors, index, reviews_for_faiss, listing_index, top_k=5, nprobe=None, ef_search=None,
+                     filters=None, n_listings=FAISS_LISTING_CANDIDATES, max_per_listing=FAISS_LISTING_MAX_REVIEWS):
+    """Searches the reviews of the listings closest to each query.
+
+    The first stage searches the per-listing index for the `n_listings` best listings. The
+    second stage searches only the reviews of those listings (with `search_faiss_ids` and an
+    ID filter). To keep at most `max_per_listing` reviews of each listing, a listing that
+    reaches the cap is dropped from the filter and the search is repeated for the missing
+    reviews, until `top_k` reviews are found or the listings have no more reviews.
+
+    Args:
+        query_vectors (np.ndarray): A 2D array with one query embedding per row.
+        index (faiss.Index): The FAISS index of review embeddings.
+        reviews_for_faiss (ReviewMetadataStore): The review metadata keyed by FAISS ID.
+        listing_index (ListingIndex): The per-listing index.
+        top_k (int): The number of reviews to return per query.
+        nprobe (int, optional): Overrides the number of IVF lists probed (IVF indexes only).
+        ef_search (int, optional): Overrides the HNSW candidate list size (HNSW indexes only).
+        filters (dict, optional): Only retrieve reviews matching these metadata values.
+                                  Only listings with matching reviews are selected.
+        n_listings (int): The number of listings selected per query.
+        max_per_listing (int): The maximum number of reviews per listing. 0 means no cap.
+
+    Returns:
+        np.ndarray: An int64 array of shape (n_queries, top_k), padded with -1.
+    """
+    filters = {column: values for column, values in (filters or {}).items() if values}
+    allowed = reviews_for_faiss.values_where("listing_id", filters) if filters else None
+    I = np.full((len(query_vectors), top_k), -1, dtype=np.int64)
+    for row, listings in enumerate(listing_index.search(query_vectors, n_listings, allowed)):
+        if not listings:
+            continue
+        candidate_ids = reviews_for_faiss.ids_where({**filters, "listing_id": listings})
+        owners = reviews_for_faiss.values_of("listing_id", candidate_ids)
+        kept, per_listing = [], {}
+        while len(kept) < top_k and candidate_ids.size:
+            found = search_faiss_ids(query_vectors[row:row + 1], index, top_k - len(kept), nprobe=nprobe,
+                                     ef_search=ef_search, id_filter=candidate_ids)[0]
+            found = found[found >= 0]
+            if not found.size:
+                break
+            # `candidate_ids` is sorted, so the listing of each hit is found by bisection.
+            for faiss_id, owner in zip(found.tolist(), owners[np.searchsorted(candidate_ids, found)].tolist()):
+                if max_per_listing and per_listing.get(owner, 0) >= max_per_listing:
+                    continue
+                per_listing[owner] = per_listing.get(owner, 0) + 1
+                kept.append(faiss_id)
+            if not max_per_listing:
+                break
+            # Search the remaining reviews of the listings that are still under the cap.
+            capped = [owner for owner, count in per_listing.items() if count >= max_per_listing]
+            remaining = ~np.isin(candidate_ids, found) & ~np.isin(owners, capped)
+            candidate_ids, owners = candidate_ids[remaining], owners[remaining]
+        I[row, :len(kept)] = kept
+    return I
+
+def search_hybrid(query_texts, query_vectors, index, reviews_for_faiss, top_k=5, nprobe=None, ef_search=None,
+                  filters=None, two_stage=FAISS_TWO_STAGE, mode="hybrid", n_candidates=HYBRID_CANDIDATES):
+    """Combines keyword (BM25) matches from the SQLite full-text index with the vector search.
+
+    In "hybrid" mode, the `n_candidates` best keyword matches and the `n_candidates` nearest
+    vectors of each query are merged by reciprocal-rank fusion (see `reciprocal_rank_fusion`).
+    In "lexical_filter" mode, only the vectors of the keyword matches are searched, which is
+    much cheaper than searching the whole index; queries with fewer than `top_k` matches are
+    filled up from the regular vector search. Without a full-text index, both modes return
+    the results of the vector search.
+
+    Args:
+        query_texts (list[str]): The user questions, one per row of `query_vectors`.
+        query_vectors (np.ndarray): A 2D array with one query embedding per row.
+        index (faiss.Index): The FAISS index of review embeddings.
+        reviews_for_faiss (ReviewMetadataStore): The review metadata keyed by FAISS ID.
+        top_k (int): The number of reviews to return per query.
+        nprobe (int, optional): Overrides the number of IVF lists probed (IVF indexes only).
+        ef_search (int, optional): Overrides the HNSW candidate list size (HNSW indexes only).
+        filters (dict, optional): Only retrieve reviews matching these metadata values (see `filter_ids`).
+        two_stage (bool): Whether the vector search selects listings first (see `search_two_stage`).
+        mode (str): "hybrid" or "lexical_filter".
+        n_candidates (int): The number of keyword and vector candidates per query.
+
+    Returns:
+        np.ndarray: An int64 array of shape (n_queries, top_k), padded with -1.
+    """
+    # The filter columns are checked before they are inserted into the keyword query. The
+    # matching IDs are only resolved by the vector search that needs them.
+    filters = _validated_filters(filters)
+    n_candidates = max(n_candidates, top_k)
+    I = np.full((len(query_vectors), top_k), -1, dtype=np.int64)
+    dense = None
+    if mode == "hybrid":
+        dense = search_reviews(query_vectors, index, reviews_for_faiss, n_candidates, nprobe=nprobe,
+                               ef_search=ef_search, filters=filters, two_stage=two_stage)
+    missing = []
+    for row, text in enumerate(query_texts):
+        # Reviews cached but not indexed yet cannot be returned.
+        keyword_ids = [faiss_id for faiss_id in map(review_id_to_faiss_id, lexical_search(text, n_candidates, filters))
+                       if faiss_id in reviews_for_faiss]
+        if mode == "hybrid":
+            ids = reciprocal_rank_fusion([dense[row][dense[row] >= 0].tolist(), keyword_ids], top_k)
+        else:
+            ids = []
+            if keyword_ids:
+                with span("index.search", queries=1, lexical_filter=True):
+                    found = search_faiss_ids(query_vectors[row:row + 1], index, top_k, nprobe=nprobe, ef_search=ef_search,
+                                             id_filter=np.array(sorted(keyword_ids), dtype=np.int64))[0]
+                ids = found[found >= 0].tolist()
+            if len(ids) < top_k:
+                missing.append(row)
+        I[row, :len(ids)] = ids
+    if missing:
+        # Too few keyword matches: fill up with the nearest vectors in the whole index.
+        dense = search_reviews(query_vectors[missing], index, reviews_for_faiss, top_k, nprobe=nprobe,
+                               ef_search=ef_search, filters=filters, two_stage=two_stage)
+        for row, found in zip(missing, dense):
+            ids = I[row][I[row] >= 0].tolist()
+            ids += [faiss_id for faiss_id in found[found >= 0].tolist() if faiss_id not in ids][:top_k - len(ids)]
+            I[row, :len(ids)] = ids
+    return I
+
+# Whether the missing per-listing index has already been reported.
+_missing_listing_index_reported = False
+
+def search_reviews(query_vectors, index, reviews_for_faiss, top_k=5, nprobe=None, ef_search=None, filters=None,
+                   two_stage=FAISS_TWO_STAGE, query_texts=None, mode=RETRIEVAL_MODE):
+    """Searches the review index for each query, in one stage or in two.
+
+    Single-stage retrieval searches every review (see `search_faiss_ids`); two-stage
+    retrieval first selects listings (see `search_two_stage`). Two-stage retrieval falls
+    back to a single stage if no per-listing index has been built yet. With `query_texts`
+    and a `mode` other than "dense", keyword matches are combined with the vector search
+    (see `search_hybrid`).
+
+    Args:
+        query_vectors (np.ndarray): A 2D array with one query embedding per row.
+        index (faiss.Index): The FAISS index of review embeddings.
+        reviews_for_faiss (ReviewMetadataStore): The review metadata keyed by FAISS ID.
+        top_k (int): The number of reviews to return per query.
+        nprobe (int, optional): Overrides the number of IVF lists probed (IVF indexes only).
+        ef_search (int, optional): Overrides the HNSW candidate list size (HNSW indexes only).
+        filters (dict, optional): Only retrieve reviews matching these metadata values (see `filter_ids`).
+        two_stage (bool): Whether to select listings first.
+        query_texts (list[str], optional): The user questions, needed by the hybrid modes.
+        mode (str): One of `RETRIEVAL_MODES` (see RETRIEVAL_MODE).
+
+    Returns:
+        np.ndarray: An int64 array of shape (n_queries, top_k), padded with -1.
+
+    Raises:
+        ValueError: If a filter names an unknown column or the mode is unknown.
+    """
+    global _missing_listing_index_reported
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown RETRIEVAL_MODE '{mode}'; use one of {RETRIEVAL_MODES}.")
+    filters = _validated_filters(filters)
+    if mode != "dense" and query_texts is not None:
+        return search_hybrid(query_texts, query_vectors, index, reviews_for_faiss, top_k, nprobe=nprobe,
+                             ef_search=ef_search, filters=filters, two_stage=two_stage, mode=mode)
+    if two_stage:
+        listing_index = load_listing_index()
+        if listing_index is not None:
+            with span("index.search", queries=len(query_vectors), two_stage=True):
+                return search_two_stage(query_vectors, index, reviews_for_faiss, listing_index, top_k,
+                                        nprobe=nprobe, ef_search=ef_search, filters=filters)
+        if not _missing_listing_index_reported:
+            print(f"⚠️ No listing index found at {LISTING_INDEX_PATH}. Rebuild the index (option 2) "
+                  f"to enable two-stage retrieval. Searching all reviews instead.")
+            _missing_listing_index_reported = True
+    # Only the single-stage search needs the filter resolved to the matching reviews.
+    id_filter = filter_ids(reviews_for_faiss, filters)
+    with span("index.search", queries=len(query_vectors), two_stage=False):
+        return search_faiss_ids(query_vectors, index, top_k, nprobe=nprobe, ef_search=ef_search, id_filter=id_filter)
+
+def retrieve_from_faiss(query_vector, index, reviews_for_faiss, embedder, top_k=5, nprobe=None, ef_search=None,
+                        filters=None, two_stage=FAISS_TWO_STAGE, query_text=None, mode=RETRIEVAL_MODE):
     """Retrieves the top-k most similar reviews from the FAISS index for a given query vector.
 
     Args:
         query_vector (np.ndarray): The embedding vector of the user's query.
         index (faiss.Index): The FAISS index to search.
-        reviews_for_faiss (list[dict]): The list of review metadata.
+        reviews_for_faiss (ReviewMetadataStore): The review metadata keyed by FAISS ID. Only
+                                                 the rows of the top-k hits are read.
         embedder (SentenceTransformer): The sentence-transformer model (not used in this function,
                                         but kept for consistency with the previous version).
         top_k (int): The number of most similar reviews to retrieve.
+        nprobe (int, optional): Overrides the number of IVF lists probed (IVF indexes only).
+        ef_search (int, optional): Overrides the HNSW candidate list size (HNSW indexes only).
+        filters (dict, optional): Only retrieve reviews matching these metadata values,
+                                  e.g. {"city": "Paris"} (see `filter_ids`).
+        two_stage (bool): Whether to select the closest listings first (see `search_two_stage`).
+        query_text (str, optional): The user's question, needed to add keyword matches.
+        mode (str): "dense", "hybrid" or "lexical_filter" (see `search_reviews`).
 
     Returns:
         list[dict]: A list of the retrieved review metadata dictionaries.
@@ -97,12 +1055,9 @@ def retrieve_from_faiss(query_vector, index, reviews_for_faiss, embedder, top_k=
         return []
 
     # Search the FAISS index for the top-k most similar vectors.
-    # D contains the distances, and I contains the indices of the similar vectors.
-    D, I = index.search(np.array(query_vector, dtype=np.float32), top_k)
-
-    # Retrieve the metadata for the top-k reviews using their indices.
-    retrieved_docs = []
-    for idx in I[0]:
-        if 0 <= idx < len(reviews_for_faiss):
-            retrieved_docs.append(reviews_for_faiss[idx])
-    return retrieved_docs
+    # With filters, the search is restricted to the matching reviews inside the index.
+    I = search_reviews(query_vector, index, reviews_for_faiss, top_k, nprobe=nprobe, ef_search=ef_search,
+                       filters=filters, two_stage=two_stage,
+                       query_texts=None if query_text is None else [query_text], mode=mode)
+    # Retrieve the metadata for the top-k reviews using their IDs.
+    return lookup_reviews(reviews_for_faiss, I[0])
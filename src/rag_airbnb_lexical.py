@@ -0,0 +1,144 @@
+# This script implements keyword (lexical) retrieval over the FTS5 full-text index that the
+# SQLite cache keeps of the review texts (see `init_sqlite` and FTS_INDEX), and the
+# reciprocal-rank fusion used to merge its results with the FAISS search.
+# Dense retrieval is weak on queries that hinge on rare words, such as place names
+# ("Sagrada Familia") or street names, which BM25 ranks well. The hybrid retrieval modes of
+# `search_reviews` combine both (see RETRIEVAL_MODE).
+
+import re
+import sqlite3
+import threading
+
+from src.rag_airbnb_config import SQLITE_PATH, ID_COLUMN, HYBRID_CANDIDATES, HYBRID_RRF_K, HYBRID_MAX_TERM_SHARE
+from src.rag_airbnb_metrics import span, count
+
+# The values of RETRIEVAL_MODE.
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical_filter")
+# Words left out of keyword queries. They appear in most reviews, so they would match nearly
+# every row without changing the BM25 ranking much.
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from had has have how i if in is it its me my no not of "
+    "on or our so that the their there these this to was we were what when where which who why will with "
+    "would you your any some about near best good".split()
+)
+
+# One read-only connection per thread: sqlite3 connections cannot be shared between threads.
+_local = threading.local()
+# Whether a missing full-text index has already been reported.
+_missing_index_reported = False
+
+def _connection():
+    """Returns this thread's read-only connection to the SQLite cache."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = sqlite3.connect(f"file:{SQLITE_PATH}?mode=ro", uri=True)
+    return conn
+
+def _review_count(conn):
+    """Returns the number of cached reviews, counted again only after the cache has changed.
+
+    `PRAGMA data_version` changes whenever another connection commits to the database, so
+    the count is kept per connection until the next sync or build writes to the cache.
+    """
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if getattr(_local, "count_version", None) != data_version:
+        _local.review_count = conn.execute("SELECT COUNT(*) FROM reviews").fetchone()[0]
+        _local.count_version = data_version
+    return _local.review_count
+
+def query_terms(text):
+    """Returns the keywords of a question: its distinct lower-cased words, without stopwords."""
+    terms = []
+    for word in re.findall(r"\w+", text.lower()):
+        if len(word) > 1 and word not in STOPWORDS and word not in terms:
+            terms.append(word)
+    return terms
+
+def fts_query(terms):
+    """Builds an FTS5 query matching any of the given keywords.
+
+    Every keyword is quoted, so punctuation and FTS5 operators in the question are taken
+    literally. Reviews containing more of the keywords, or rarer ones, rank higher in BM25.
+
+    Args:
+        terms (list[str]): The keywords (see `query_terms`).
+
+    Returns:
+        str: The FTS5 MATCH expression.
+    """
+    return " OR ".join(f'"{term}"' for term in terms)
+
+def _selective_terms(conn, terms, max_share=HYBRID_MAX_TERM_SHARE):
+    """Drops the keywords found in more than `max_share` of the reviews, keeping at least the rarest one."""
+    # Row IDs are not a count: replaced reviews get new ones and deleted ones leave gaps.
+    total = _review_count(conn)
+    doc_counts = dict(conn.execute(
+        f"SELECT term, doc FROM reviews_fts_vocab WHERE term IN ({', '.join('?' * len(terms))})", terms
+    ))
+    # Keywords missing from the vocabulary (e.g. written with diacritics) are kept.
+    selective = [term for term in terms if doc_counts.get(term, 0) <= max_share * total]
+    return selective or [min(terms, key=lambda term: doc_counts.get(term, 0))]
+
+def lexical_search(query, top_k=HYBRID_CANDIDATES, filters=None):
+    """Returns the reviews that best match the keywords of a question, ranked by BM25.
+
+    Args:
+        query (str): The user's question.
+        top_k (int): The maximum number of reviews to return.
+        filters (dict, optional): Only return reviews matching these metadata values, compared
+                                  case-insensitively. The columns must have been validated
+                                  (see `filter_ids`), as they are inserted into the SQL.
+
+    Returns:
+        list[str]: The review IDs, best match first. Empty if the question has no keywords or
+                   the cache has no full-text index.
+    """
+    global _missing_index_reported
+    terms = query_terms(query)
+    if not terms:
+        return []
+    conditions, params = ["reviews_fts MATCH ?"], []
+    for column, values in (filters or {}).items():
+        values = [str(v).lower() for v in ([values] if isinstance(values, str) else values)]
+        if values:
+            conditions.append(f"LOWER(r.{column}) IN ({', '.join('?' * len(values))})")
+            params += values
+    with span("index.lexical_search"):
+        try:
+            conn = _connection()
+            params.insert(0, fts_query(_selective_terms(conn, terms)))
+            rows = conn.execute(f"""
+                SELECT r.{ID_COLUMN} FROM reviews_fts JOIN reviews r ON r.rowid = reviews_fts.rowid
+                WHERE {" AND ".join(conditions)} ORDER BY reviews_fts.rank LIMIT ?
+            """, params + [top_k]).fetchall()
+        except sqlite3.OperationalError as e:
+            # The cache is missing, predates the full-text index, or FTS_INDEX is off.
+            if not _missing_index_reported:
+                print(f"⚠️ Keyword search is unavailable ({e}). Set FTS_INDEX=true and run option 1 "
+                      "to build the full-text index. Using FAISS results only.")
+                _missing_index_reported = True
+            return []
+    count("lexical_searches")
+    return [row[0] for row in rows]
+
+def reciprocal_rank_fusion(rankings, top_k, k=HYBRID_RRF_K):
+    """Merges several rankings of the same items with reciprocal-rank fusion.
+
+    Each item scores the sum of 1 / (k + rank) over the rankings it appears in (ranks start
+    at 1), so items ranked well by several retrievers come first, without having to compare
+    their BM25 scores with vector similarities.
+
+    Args:
+        rankings (list[list]): The rankings, best item first.
+        top_k (int): The number of items to return.
+        k (int): The fusion constant (see HYBRID_RRF_K).
+
+    Returns:
+        list: The `top_k` items with the highest fused score. Ties keep the order of the
+              first ranking they appear in.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda item: -scores[item])[:top_k]
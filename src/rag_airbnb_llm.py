@@ -1,12 +1,52 @@
 # This script defines the core components of the RAG (Retrieval-Augmented Generation) pipeline.
 # It includes functions for loading the generative language model and for answering queries
 # by combining retrieved context with a language model.
+# Transformers, PyTorch, LangChain and FAISS take seconds to import, so they are imported by
+# the functions that use them rather than at module level; importing this module is cheap.
 
-from langchain_huggingface import HuggingFacePipeline
-from langchain_core.prompts import PromptTemplate
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
-from src.rag_airbnb_config import GEN_MODEL
-from src.rag_airbnb_faiss_index import retrieve_from_faiss
+import copy
+import json
+import threading
+import time
+import numpy as np
+from src.rag_airbnb_config import (
+    GEN_MODEL, GEN_MAX_NEW_TOKENS, GEN_STOP_SEQUENCES, GEN_BATCH_SIZE, GEN_PREFIX_CACHE, QUERY_BATCH_SIZE,
+    QUERY_CACHE_SIZE, QUERY_CACHE_TTL, CONTEXT_TOKEN_BUDGET, CONTEXT_CANDIDATE_FACTOR,
+)
+from src.rag_airbnb_context import format_review, pack_contexts
+from src.rag_airbnb_query_cache import QueryCache, filters_key
+from src.rag_airbnb_metrics import span, count, is_enabled, record_generation
+
+# Cache of query embeddings and retrieved review IDs shared by every `answer_query` call.
+query_cache = QueryCache(max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+# The prompt template for the language model.
+# The template instructs the model to act as an assistant summarizing Airbnb reviews,
+# using only the provided context and citing listing IDs.
+PROMPT_TEXT = (
+    """You are a helpful assistant that analyzes Airbnb guest reviews to provide comprehensive answers to user questions.
+Your goal is to synthesize information from the provided reviews with your own knowledge to present a clear and informative answer.
+
+Based on the following reviews and your own knowledge:
+Context from reviews:
+{context}
+
+Please provide a comprehensive answer to the following question:
+Question: {question}
+
+Your answer should:
+1.  Start with a direct answer to the question, combining your general knowledge with insights from the reviews.
+2.  Elaborate on the answer with details. When you use information from a review, cite the listing ID and you can quote the relevant part of the review. For example: "A review for listing [12345] mentions that 'the apartment was very clean and modern'."
+3.  If the reviews present conflicting information, acknowledge the different perspectives.
+4.  End with a summary of the key takeaways.
+
+Answer:"""
+)
+# The static instruction block every prompt starts with, up to the retrieved context.
+PROMPT_PREFIX = PROMPT_TEXT.split("{context}")[0]
+
+# The key/value cache of PROMPT_PREFIX, computed by `load_hf_model` (see `PromptPrefixCache`).
+prompt_prefix_cache = None
 
 def load_hf_model():
     """Loads the Hugging Face generative model and tokenizer.
@@ -15,37 +55,486 @@ def load_hf_model():
     configuration. It then creates a text generation pipeline, which is wrapped in a
     LangChain HuggingFacePipeline for seamless integration.
 
+    When GEN_PREFIX_CACHE is enabled, it also precomputes the key/value cache of the static
+    prompt prefix (see `PromptPrefixCache`), which streamed answers then reuse.
+
     Returns:
         HuggingFacePipeline: A LangChain-compatible pipeline for text generation.
     """
+    global prompt_prefix_cache
+    from langchain_huggingface import HuggingFacePipeline
+    from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+
     # Initialize the tokenizer for the generative model.
     tokenizer = AutoTokenizer.from_pretrained(GEN_MODEL)
     # Load the pre-trained causal language model.
     # `device_map="auto"` automatically selects the best device (GPU or CPU).
     model = AutoModelForCausalLM.from_pretrained(GEN_MODEL, device_map="auto", torch_dtype="auto")
+    # Batched generation pads prompts to a common length. Causal models must be padded on the
+    # left so that every prompt ends right where generation starts.
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
     # Create a text generation pipeline from the model and tokenizer.
-    text_gen = pipeline("text-generation", model=model, tokenizer=tokenizer, max_new_tokens=512)
+    text_gen = pipeline("text-generation", model=model, tokenizer=tokenizer, max_new_tokens=GEN_MAX_NEW_TOKENS)
+    # Run the prefill of the instruction block once, instead of once per question.
+    if GEN_PREFIX_CACHE:
+        prompt_prefix_cache = PromptPrefixCache(model, tokenizer)
     # Wrap the pipeline in a LangChain HuggingFacePipeline.
-    return HuggingFacePipeline(pipeline=text_gen)
+    # `batch_size` is the number of prompts `llm.batch` feeds through the model at once.
+    return HuggingFacePipeline(pipeline=text_gen, batch_size=GEN_BATCH_SIZE)
+
+class PromptPrefixCache:
+    """The key/value cache of the prompt prefix that is identical for every question.
+
+    The instruction block before the retrieved context is the same in every prompt, so its
+    attention keys and values are computed once. Generating with a copy of that cache makes
+    the model prefill only the context and question. A prompt is served from the cache only
+    if its tokens start with exactly the prefix tokens; otherwise (e.g. when the tokenizer
+    merges tokens across the boundary) generation falls back to a full prefill, so the
+    output is always the same as without the cache.
+    """
+
+    def __init__(self, model, tokenizer, prefix_text=PROMPT_PREFIX):
+        """Runs the prefill of `prefix_text` and keeps its key/value cache.
+
+        Args:
+            model (AutoModelForCausalLM): The generative model.
+            tokenizer (AutoTokenizer): Its tokenizer.
+            prefix_text (str): The static text every prompt starts with.
+        """
+        import torch
+
+        self.model = model
+        self.prefix_ids = tokenizer(prefix_text, return_tensors="pt")["input_ids"].to(model.device)
+        with torch.no_grad():
+            self.cache = model(input_ids=self.prefix_ids, use_cache=True).past_key_values
+        self.hits = 0
+        self.misses = 0
+
+    def generation_kwargs(self, input_ids):
+        """Returns the extra `generate` arguments that reuse the cache for a prompt.
+
+        Args:
+            input_ids (torch.Tensor): The token IDs of the full prompt, shape (1, n).
+
+        Returns:
+            dict: {"past_key_values": <copy of the prefix cache>} if the prompt starts with
+                  the prefix tokens, else an empty dict.
+        """
+        import torch
+
+        n = self.prefix_ids.shape[1]
+        if input_ids.shape[0] == 1 and input_ids.shape[1] > n and torch.equal(input_ids[0, :n], self.prefix_ids[0]):
+            self.hits += 1
+            # `generate` appends to the cache it is given, so each request gets its own copy.
+            return {"past_key_values": copy.deepcopy(self.cache)}
+        self.misses += 1
+        return {}
+
+class _GenerationMonitor:
+    """Counts generated tokens and stops generation once the stream is cancelled.
+
+    `generate` calls stopping criteria once per decoding step, which makes this the
+    cheapest place to observe progress and to interrupt the model between two tokens.
+    It implements the `transformers.StoppingCriteria` call signature without subclassing
+    it, so that defining it does not import Transformers.
+    """
+
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+        self.generated_tokens = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.generated_tokens += 1
+        return self.cancel_event.is_set()
+
+class TokenStream:
+    """Streams the answer of the generative model as it is produced.
+
+    Generation runs on a background thread and the decoded text is yielded piece by piece
+    when iterating over the stream. The stream stops early when `cancel` is called (from any
+    thread) or when the text contains one of the stop sequences, which are not included in
+    the output. Once iteration ends, `stats` holds the timings of the answer.
+
+    Example:
+        stream = TokenStream(llm, prompt_text)
+        for text in stream:
+            print(text, end="", flush=True)
+        print(stream.stats)
+    """
+
+    def __init__(self, llm, prompt_text, stop=None, max_new_tokens=GEN_MAX_NEW_TOKENS, use_prefix_cache=True):
+        """Starts generating an answer.
+
+        Args:
+            llm (HuggingFacePipeline): The pipeline returned by `load_hf_model`.
+            prompt_text (str): The full prompt.
+            stop (list[str], optional): Stop sequences. Defaults to GEN_STOP_SEQUENCES.
+            max_new_tokens (int): The maximum number of tokens to generate.
+            use_prefix_cache (bool): Whether to reuse the key/value cache of the prompt prefix.
+        """
+        from transformers import StoppingCriteriaList, TextIteratorStreamer
+
+        model, tokenizer = llm.pipeline.model, llm.pipeline.tokenizer
+        self.stop = GEN_STOP_SEQUENCES if stop is None else stop
+        self.max_new_tokens = max_new_tokens
+        self._cancel = threading.Event()
+        self._monitor = _GenerationMonitor(self._cancel)
+        self._streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        inputs = tokenizer(prompt_text, return_tensors="pt").to(model.device)
+        cache_kwargs = {}
+        if use_prefix_cache and prompt_prefix_cache is not None and prompt_prefix_cache.model is model:
+            cache_kwargs = prompt_prefix_cache.generation_kwargs(inputs["input_ids"])
+        self.stats = {
+            "prompt_tokens": int(inputs["input_ids"].shape[1]),
+            "prefix_cached": bool(cache_kwargs),
+            "generated_tokens": 0,
+            "time_to_first_token_s": None,
+            "total_s": None,
+            "tokens_per_s": None,
+            "finish_reason": None,
+        }
+        self._error = None
+        self._start = time.perf_counter()
+
+        def generate():
+            try:
+                model.generate(
+                    **inputs,
+                    **cache_kwargs,
+                    streamer=self._streamer,
+                    max_new_tokens=max_new_tokens,
+                    stopping_criteria=StoppingCriteriaList([self._monitor]),
+                    pad_token_id=tokenizer.pad_token_id,
+                )
+            except Exception as e:
+                self._error = e
+                # Unblock the consumer, which is waiting on the streamer queue.
+                self._streamer.end()
+
+        self._thread = threading.Thread(target=generate, name="rag-generate", daemon=True)
+        self._thread.start()
+        self._iterator = self._iterate()
+
+    def cancel(self):
+        """Stops generation after the token currently being produced."""
+        self._cancel.set()
+
+    def __iter__(self):
+        # A stream can only be consumed once; iterating again resumes the same generator.
+        return self._iterator
+
+    def _iterate(self):
+        """Yields the decoded answer text and fills in `stats` when generation ends."""
+        text = ""
+        emitted = 0
+        # Text that could be the start of a stop sequence is held back until it is resolved.
+        hold = max((len(stop) for stop in self.stop), default=1) - 1
+        finish_reason = None
+        try:
+            for piece in self._streamer:
+                if self._cancel.is_set():
+                    finish_reason = "cancelled"
+                    break
+                text += piece
+                stops = [i for i in (text.find(stop, emitted) for stop in self.stop) if i >= 0]
+                if stops:
+                    finish_reason = "stop_sequence"
+                    self._cancel.set()
+                    end = min(stops)
+                else:
+                    end = len(text) - hold
+                if end > emitted:
+                    if self.stats["time_to_first_token_s"] is None:
+                        self.stats["time_to_first_token_s"] = time.perf_counter() - self._start
+                    yield text[emitted:end]
+                    emitted = end
+                if finish_reason:
+                    break
+            else:
+                # Generation ended on its own; release the held-back tail.
+                if emitted < len(text):
+                    yield text[emitted:]
+        except BaseException:
+            # The consumer stopped iterating early or was interrupted (e.g. Ctrl+C).
+            finish_reason = "cancelled"
+            raise
+        finally:
+            if finish_reason is None and self._cancel.is_set():
+                finish_reason = "cancelled"
+            # Make sure the model stops and the background thread finishes.
+            self._cancel.set()
+            self._thread.join()
+            total = time.perf_counter() - self._start
+            generated = self._monitor.generated_tokens
+            if finish_reason is None:
+                finish_reason = "length" if generated >= self.max_new_tokens else "end"
+            self.stats.update({
+                "generated_tokens": generated,
+                "total_s": total,
+                "tokens_per_s": generated / total if total > 0 else 0.0,
+                "finish_reason": finish_reason,
+            })
+        if self._error is not None:
+            raise self._error
+
+    def text(self):
+        """Consumes the stream and returns the complete answer."""
+        return "".join(self)
+
+def format_generation_stats(stats):
+    """Returns a one-line, human-readable summary of `TokenStream.stats`."""
+    ttft = stats["time_to_first_token_s"]
+    return (f"[+] {stats['generated_tokens']} tokens in {stats['total_s']:.1f}s "
+            f"({stats['tokens_per_s']:.1f} tokens/s), first token after "
+            f"{'n/a' if ttft is None else f'{ttft:.2f}s'}, prompt {stats['prompt_tokens']} tokens"
+            f"{' (prefix cached)' if stats.get('prefix_cached') else ''}, "
+            f"finished: {stats['finish_reason']}.")
+
+def retrieve_context_batch(queries, index, reviews, embedder, top_k=5, return_vectors=False, filters=None):
+    """Returns the reviews most relevant to each of several queries.
+
+    Queries found in the query cache are served from it. All remaining queries are encoded
+    in a single `embedder.encode` call and searched with a single multi-row `index.search`.
+
+    Args:
+        queries (list[str]): The user questions.
+        index (faiss.Index): The FAISS index of review embeddings.
+        reviews (ReviewMetadataStore): The review metadata keyed by FAISS ID.
+        embedder (SentenceTransformer): The sentence-transformer model for encoding the queries.
+        top_k (int): The number of reviews to retrieve per query.
+        return_vectors (bool): Whether to also return the query embeddings.
+        filters (dict, optional): Only retrieve reviews matching these metadata values,
+                                  e.g. {"city": "Paris"} (see `filter_ids`).
+
+    Returns:
+        list[list[dict]]: The metadata of the retrieved reviews, one list per query.
+            With `return_vectors`, a tuple of that list and an array of the query embeddings.
+    """
+    from src.rag_airbnb_faiss_index import index_version, search_reviews, lookup_reviews
+
+    version = index_version(index)
+    faiss_ids = [None] * len(queries)
+    vectors = [None] * len(queries)
+    misses = []
+    for i, query in enumerate(queries):
+        cached = query_cache.get(query, top_k, version, filters)
+        if cached is not None:
+            vectors[i], faiss_ids[i] = cached
+        else:
+            misses.append(i)
+    count("query_cache_hits", len(queries) - len(misses))
+
+    if misses:
+        with span("query.encode", queries=len(misses)):
+            query_vectors = embedder.encode([queries[i] for i in misses], normalize_embeddings=True)
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        # With filters, the search is restricted to the matching reviews inside the index.
+        I = search_reviews(query_vectors, index, reviews, top_k, filters=filters, query_texts=[queries[i] for i in misses])
+        for row, i in enumerate(misses):
+            faiss_ids[i] = I[row]
+            vectors[i] = query_vectors[row:row + 1]
+            query_cache.put(queries[i], top_k, version, vectors[i], I[row], filters)
+    docs = [lookup_reviews(reviews, ids) for ids in faiss_ids]
+    if return_vectors:
+        return docs, np.concatenate(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+    return docs
 
-def answer_query(query, index, reviews, embedder, llm):
+def build_contexts(queries, index, reviews, embedder, llm, top_k=5, filters=None):
+    """Retrieves the reviews of each query and packs them into the context token budget.
+
+    `CONTEXT_CANDIDATE_FACTOR` times `top_k` candidates are retrieved so that reviews
+    dropped as near-duplicates or over the per-listing cap can be replaced by the next
+    best ones (see `pack_contexts`). With `CONTEXT_TOKEN_BUDGET` set to 0, the top-k
+    reviews are used as retrieved.
+
+    Args:
+        queries (list[str]): The user questions.
+        index (faiss.Index): The FAISS index of review embeddings.
+        reviews (ReviewMetadataStore): The review metadata keyed by FAISS ID.
+        embedder (SentenceTransformer): The sentence-transformer model for encoding the queries.
+        llm (HuggingFacePipeline): The generative language model pipeline, whose tokenizer counts tokens.
+        top_k (int): The maximum number of reviews in each context.
+        filters (dict, optional): Only retrieve reviews matching these metadata values.
+
+    Returns:
+        tuple[list[list[dict]], list[dict | None]]: The context reviews of each query and the
+            packing statistics of each query (None when packing is disabled).
+    """
+    if CONTEXT_TOKEN_BUDGET <= 0:
+        return retrieve_context_batch(queries, index, reviews, embedder, top_k, filters=filters), [None] * len(queries)
+    candidates, query_vectors = retrieve_context_batch(
+        queries, index, reviews, embedder, top_k * CONTEXT_CANDIDATE_FACTOR, return_vectors=True, filters=filters,
+    )
+    from src.rag_airbnb_faiss_index import reconstruct_reviews
+
+    with span("context.pack", queries=len(queries)):
+        # Near-duplicates are detected on the review vectors already in the index, so only
+        # the reviews that must be trimmed have their sentences encoded.
+        review_vectors = [reconstruct_reviews(index, docs) for docs in candidates]
+        if any(vectors is None for vectors in review_vectors):
+            review_vectors = None
+        packed = pack_contexts(query_vectors, candidates, embedder, llm.pipeline.tokenizer, top_k,
+                               review_vectors=review_vectors)
+    return [docs for docs, _ in packed], [stats for _, stats in packed]
+
+def format_context_stats(stats):
+    """Returns a one-line, human-readable summary of the packing statistics of a query."""
+    return (f"[+] Context: {stats['packed_tokens']} tokens from {stats['reviews']} reviews "
+            f"(raw: {stats['raw_tokens']} tokens; {stats['duplicates']} near-duplicates dropped, "
+            f"{stats['listing_capped']} over the per-listing cap, {stats['trimmed']} trimmed).")
+
+def build_prompt(query, context_docs):
+    """Formats the prompt for a query from its retrieved reviews.
+
+    Args:
+        query (str): The user's question.
+        context_docs (list[dict]): The metadata of the retrieved reviews.
+
+    Returns:
+        str: The prompt text for the language model.
+    """
+    # Format the retrieved documents into a single context string.
+    context = "\n\n".join([format_review(d) for d in context_docs])
+    # The same substitution as a LangChain f-string PromptTemplate, without importing LangChain.
+    return PROMPT_TEXT.format(context=context, question=query)
+
+def answer_queries(queries, index, reviews, embedder, llm, top_k=5, filters=None):
+    """Answers several user queries at once with batched retrieval and generation.
+
+    This is the batch counterpart of `answer_query` for offline use. Retrieval encodes and
+    searches every query in one call (see `retrieve_context_batch`), and `llm.batch` feeds
+    the prompts through the model in padded batches of `GEN_BATCH_SIZE`.
+
+    Args:
+        queries (list[str]): The user questions.
+        index (faiss.Index): The FAISS index of review embeddings.
+        reviews (ReviewMetadataStore): The review metadata keyed by FAISS ID.
+        embedder (SentenceTransformer): The sentence-transformer model for encoding the queries.
+        llm (HuggingFacePipeline): The generative language model pipeline.
+        top_k (int): The number of reviews to retrieve as context per query.
+        filters (dict, optional): Only retrieve reviews matching these metadata values,
+                                  e.g. {"city": "Paris"}, for every query.
+
+    Returns:
+        list[dict]: One result per query with its "question", "answer", retrieved
+                    "review_ids" and, when packing is enabled, "context_tokens" (raw and packed).
+    """
+    if not queries:
+        return []
+    contexts, context_stats = build_contexts(queries, index, reviews, embedder, llm, top_k, filters)
+    prompts = [build_prompt(query, docs) for query, docs in zip(queries, contexts)]
+    with span("llm.generate", prompts=len(prompts)):
+        answers = llm.batch(prompts)
+    if is_enabled():
+        # Counting tokens costs a tokenizer pass, so it is only done when it is recorded.
+        tokenizer = llm.pipeline.tokenizer
+        count("prompt_tokens", sum(map(len, tokenizer(prompts, add_special_tokens=False)["input_ids"])))
+        count("generated_tokens", sum(map(len, tokenizer(answers, add_special_tokens=False)["input_ids"])))
+        count("answers", len(answers))
+    results = []
+    for query, answer, docs, stats in zip(queries, answers, contexts, context_stats):
+        result = {"question": query, "answer": answer, "review_ids": [doc.get("review_id") for doc in docs]}
+        if stats is not None:
+            result["context_tokens"] = {"raw": stats["raw_tokens"], "packed": stats["packed_tokens"]}
+        results.append(result)
+    return results
+
+def answer_queries_from_file(input_path, output_path, index, reviews, embedder, llm, top_k=5,
+                             batch_size=QUERY_BATCH_SIZE, filters=None):
+    """Answers the questions of a JSONL file and writes the results to another JSONL file.
+
+    Each input line is either a JSON object with a "question" field (and an optional "id"
+    that is copied to the output, and optional "filters" such as {"city": "Paris"}) or a
+    bare JSON string. Questions are processed in chunks
+    of `batch_size` with `answer_queries`, and each result is written as soon as its chunk
+    is done, so memory use does not grow with the size of the file.
+
+    Args:
+        input_path (str): The JSONL file of questions.
+        output_path (str): The JSONL file to write the answers and retrieved review IDs to.
+        index (faiss.Index): The FAISS index of review embeddings.
+        reviews (ReviewMetadataStore): The review metadata keyed by FAISS ID.
+        embedder (SentenceTransformer): The sentence-transformer model for encoding the queries.
+        llm (HuggingFacePipeline): The generative language model pipeline.
+        top_k (int): The number of reviews to retrieve as context per query.
+        batch_size (int): The number of questions answered together.
+        filters (dict, optional): Default metadata filters for lines without their own.
+
+    Returns:
+        int: The number of questions answered.
+    """
+    def flush(records, out):
+        # Questions sharing the same filters are retrieved together; output keeps the input order.
+        groups = {}
+        for i, record in enumerate(records):
+            record_filters = record.get("filters") or filters
+            groups.setdefault(filters_key(record_filters), (record_filters, []))[1].append(i)
+        results = [None] * len(records)
+        for group_filters, positions in groups.values():
+            answers = answer_queries([records[i]["question"] for i in positions], index, reviews, embedder, llm,
+                                     top_k, group_filters)
+            for i, result in zip(positions, answers):
+                results[i] = result
+        for record, result in zip(records, results):
+            if "id" in record:
+                result = {"id": record["id"], **result}
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+        return len(results)
+
+    answered = 0
+    chunk = []
+    with open(input_path, encoding="utf-8") as f, open(output_path, "w", encoding="utf-8") as out:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"question": record}
+            if not record.get("question"):
+                print(f"⚠️ Skipping line {line_no} of {input_path}: no question.")
+                continue
+            chunk.append(record)
+            if len(chunk) >= batch_size:
+                answered += flush(chunk, out)
+                chunk = []
+                print(f"[+] Answered {answered} questions...")
+        if chunk:
+            answered += flush(chunk, out)
+    print(f"[+] Answered {answered} questions. Results saved to {output_path}")
+    return answered
+
+def answer_query(query, index, reviews, embedder, llm, top_k=5, stream=True, filters=None):
     """Answers a user query using the RAG pipeline.
 
     This function orchestrates the entire RAG process:
     1. Encodes the user's query into an embedding.
     2. Retrieves relevant review documents from the FAISS index.
     3. Constructs a detailed prompt for the language model, including the retrieved context.
-    4. Invokes the language model to generate an answer based on the prompt.
+    4. Invokes the language model to generate an answer based on the prompt, printing the
+       tokens as they are produced. Ctrl+C stops the answer without leaving the query loop.
 
     Args:
         query (str): The user's question.
         index (faiss.Index): The FAISS index of review embeddings.
-        reviews (list[dict]): The list of review metadata.
+        reviews (ReviewMetadataStore): The review metadata keyed by FAISS ID.
         embedder (SentenceTransformer): The sentence-transformer model for encoding the query.
         llm (HuggingFacePipeline): The generative language model pipeline.
+        top_k (int): The number of reviews to retrieve as context.
+        stream (bool): Whether to print the answer token by token or all at once at the end.
+        filters (dict, optional): Only retrieve reviews matching these metadata values,
+                                  e.g. {"city": "Paris"}.
+
+    Returns:
+        dict | None: The generation statistics (see `TokenStream`) when streaming, else None.
     """
     # 1. Encode the query and retrieve relevant documents from the FAISS index.
-    context_docs = retrieve_from_faiss(embedder.encode([query], normalize_embeddings=True), index, reviews, embedder)
+    # Repeated queries are served from the query cache without re-encoding or searching.
+    # The reviews are then packed into the context token budget.
+    contexts, context_stats = build_contexts([query], index, reviews, embedder, llm, top_k, filters)
+    context_docs = contexts[0]
 
     # 2. Print a summary of the retrieved context for debugging and transparency.
     print("\n--- Retrieved Context (Summary) ---")
@@ -55,37 +544,32 @@ def answer_query(query, index, reviews, embedder, llm):
     else:
         print("No relevant documents retrieved.")
     print("-----------------------------------")
+    if context_stats[0] is not None:
+        print(format_context_stats(context_stats[0]))
 
-    # 3. Format the retrieved documents into a single context string.
-    context = "\n\n".join([f"[{d['listing_id']}] {d['text']}" for d in context_docs])
-
-    # 4. Define the prompt template for the language model.
-    # The template instructs the model to act as an assistant summarizing Airbnb reviews,
-    # using only the provided context and citing listing IDs.
-    prompt = PromptTemplate.from_template(
-        """You are a helpful assistant that analyzes Airbnb guest reviews to provide comprehensive answers to user questions.
-Your goal is to synthesize information from the provided reviews with your own knowledge to present a clear and informative answer.
-
-Based on the following reviews and your own knowledge:
-Context from reviews:
-{context}
+    # 3. Format the prompt with the retrieved context and the user's query.
+    prompt_text = build_prompt(query, context_docs)
 
-Please provide a comprehensive answer to the following question:
-Question: {question}
-
-Your answer should:
-1.  Start with a direct answer to the question, combining your general knowledge with insights from the reviews.
-2.  Elaborate on the answer with details. When you use information from a review, cite the listing ID and you can quote the relevant part of the review. For example: "A review for listing [12345] mentions that 'the apartment was very clean and modern'."
-3.  If the reviews present conflicting information, acknowledge the different perspectives.
-4.  End with a summary of the key takeaways.
-
-Answer:"""
-    )
-
-    # 5. Format the prompt with the retrieved context and the user's query.
-    prompt_text = prompt.format(context=context, question=query)
-
-    # 6. Invoke the language model to generate and print the answer.
+    # 4. Invoke the language model to generate and print the answer.
     print("\n---\n")
-    print(llm.invoke(prompt_text))
-    print("\n---\n")
\ No newline at end of file
+    if not stream:
+        with span("llm.generate", prompts=1):
+            print(llm.invoke(prompt_text))
+        print("\n---\n")
+        return None
+
+    token_stream = TokenStream(llm, prompt_text)
+    with span("llm.generate", prompts=1):
+        try:
+            for text in token_stream:
+                print(text, end="", flush=True)
+        except KeyboardInterrupt:
+            # Stop generating but keep the application running.
+            token_stream.cancel()
+            for _ in token_stream:
+                pass
+            print("\n[Answer cancelled]")
+    print("\n\n---\n")
+    print(format_generation_stats(token_stream.stats))
+    record_generation(token_stream.stats)
+    return token_stream.stats
\ No newline at end of file
@@ -0,0 +1,351 @@
+# This script implements the on-disk store for the review metadata that accompanies the FAISS index.
+# Metadata is kept in a compact columnar layout (an offsets array plus a UTF-8 blob per column)
+# that is memory-mapped, so a process only reads the rows it looks up, and several worker
+# processes on one host share the same pages through the OS page cache.
+# Low-cardinality columns used for filtering (city, country, language, listing) are also
+# stored as integer codes, so the rows matching a filter are found with vectorized scans.
+
+from array import array
+from collections import OrderedDict
+import json
+import os
+import shutil
+
+import numpy as np
+
+# Version of the on-disk layout, recorded in the manifest. Format 1 stores have no
+# categorical codes; they are still readable.
+STORE_FORMAT = 2
+SUPPORTED_FORMATS = (1, 2)
+
+# The number of filter results kept by `ReviewMetadataStore.ids_where`.
+FILTER_CACHE_SIZE = 32
+
+def _column_paths(path, column):
+    """Returns the offsets and data file paths of a column."""
+    return os.path.join(path, f"{column}.offsets.npy"), os.path.join(path, f"{column}.data")
+
+def _code_paths(path, column):
+    """Returns the codes and vocabulary file paths of a categorical column."""
+    return os.path.join(path, f"{column}.codes.npy"), os.path.join(path, f"{column}.values.json")
+
+def write_metadata_store(path, items, columns=None, categorical=()):
+    """Writes review metadata to a columnar store directory.
+
+    Rows are streamed to one data file per column in the order they are given, so the
+    records never have to be held in memory at once. A sorted copy of the FAISS IDs, with
+    the row each ID points to, is written at the end to allow binary-search lookups.
+
+    Args:
+        path (str): The directory to create. It must not exist yet.
+        items (Iterable[tuple[int, dict]]): (FAISS ID, review metadata) pairs.
+        columns (list[str], optional): The columns to store. Records missing a column store
+                                       an empty string. Defaults to the keys of the first record.
+        categorical (Iterable[str]): Columns to also store as integer codes for filtering
+                                     (see `ReviewMetadataStore.ids_where`).
+
+    Returns:
+        int: The number of rows written.
+    """
+    os.makedirs(path)
+    ids = array("q")
+    data_files = {}
+    offsets = {}
+    vocabularies = {}
+    codes = {}
+    try:
+        for faiss_id, record in items:
+            if not data_files:
+                # Unless given, the columns are taken from the first record.
+                if columns is None:
+                    columns = list(record)
+                categorical = [c for c in categorical if c in columns]
+                for column in columns:
+                    data_files[column] = open(_column_paths(path, column)[1], "wb")
+                    offsets[column] = array("q", [0])
+                for column in categorical:
+                    vocabularies[column] = {}
+                    codes[column] = array("i")
+            ids.append(faiss_id)
+            for column in columns:
+                value = record.get(column)
+                value = "" if value is None else str(value)
+                data = value.encode("utf-8")
+                data_files[column].write(data)
+                offsets[column].append(offsets[column][-1] + len(data))
+                if column in vocabularies:
+                    vocabulary = vocabularies[column]
+                    codes[column].append(vocabulary.setdefault(value, len(vocabulary)))
+    finally:
+        for f in data_files.values():
+            f.close()
+
+    columns = columns or []
+    for column in columns:
+        np.save(_column_paths(path, column)[0], np.frombuffer(offsets[column], dtype=np.int64))
+    for column, vocabulary in vocabularies.items():
+        codes_path, values_path = _code_paths(path, column)
+        np.save(codes_path, np.frombuffer(codes[column], dtype=np.int32))
+        with open(values_path, "w", encoding="utf-8") as f:
+            json.dump(list(vocabulary), f, ensure_ascii=False)
+
+    ids = np.frombuffer(ids, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    np.save(os.path.join(path, "ids.npy"), ids[order])
+    np.save(os.path.join(path, "rows.npy"), order.astype(np.int64))
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump({"format": STORE_FORMAT, "columns": columns, "categorical": list(vocabularies),
+                   "count": len(ids)}, f)
+    return len(ids)
+
+def replace_metadata_store(path, items, release=None, columns=None, categorical=()):
+    """Writes a new store next to `path` and swaps it in place of the existing one.
+
+    Args:
+        path (str): The store directory to replace (it may not exist yet).
+        items (Iterable[tuple[int, dict]]): (FAISS ID, review metadata) pairs.
+        columns, categorical: See `write_metadata_store`.
+        release (Callable, optional): Called after the new store is written and before the
+                                      swap, e.g. to close an open store of `path` that
+                                      `items` was streamed from (required on Windows).
+    """
+    tmp_path, old_path = path + ".tmp", path + ".old"
+    for leftover in (tmp_path, old_path):
+        if os.path.exists(leftover):
+            shutil.rmtree(leftover)
+    write_metadata_store(tmp_path, items, columns=columns, categorical=categorical)
+    if release is not None:
+        release()
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path, ignore_errors=True)
+
+class ReviewMetadataStore:
+    """A read-mostly, memory-mapped mapping from FAISS ID to review metadata dictionary.
+
+    It supports the dictionary operations the index code relies on (`get`, `in`, `len`,
+    `pop`, `update`, `items`), plus `ids_where` to find the reviews matching a metadata
+    filter. Changes are kept in an in-memory overlay on top of the files and only reach
+    the disk when the store is rewritten with `replace_metadata_store`.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest["format"] not in SUPPORTED_FORMATS:
+            raise ValueError(f"Unsupported metadata store format {manifest['format']} in {path}.")
+        self.path = path
+        self.columns = manifest["columns"]
+        self._ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self._rows = np.load(os.path.join(path, "rows.npy"), mmap_mode="r")
+        self._offsets = {}
+        self._data = {}
+        for column in self.columns:
+            offsets_path, data_path = _column_paths(path, column)
+            self._offsets[column] = np.load(offsets_path, mmap_mode="r")
+            # np.memmap cannot map an empty file.
+            if os.path.getsize(data_path) > 0:
+                self._data[column] = np.memmap(data_path, dtype=np.uint8, mode="r")
+            else:
+                self._data[column] = np.empty(0, dtype=np.uint8)
+        self.categorical = manifest.get("categorical", [])
+        self._codes = {}
+        self._vocabularies = {}
+        for column in self.categorical:
+            codes_path, values_path = _code_paths(path, column)
+            self._codes[column] = np.load(codes_path, mmap_mode="r")
+            with open(values_path, encoding="utf-8") as f:
+                self._vocabularies[column] = json.load(f)
+        self._row_ids = None
+        self._filter_cache = OrderedDict()
+        self._overlay = {}
+        self._removed = set()
+        self._len = len(self._ids)
+
+    def close(self):
+        """Releases the memory maps so that the files can be replaced or deleted."""
+        self._ids = self._rows = np.empty(0, dtype=np.int64)
+        self._offsets = {}
+        self._data = {}
+        self._codes = {}
+        self._row_ids = None
+        self._filter_cache.clear()
+
+    def _row(self, faiss_id):
+        """Returns the row of `faiss_id` in the files, or None if it is not stored there."""
+        pos = int(np.searchsorted(self._ids, faiss_id))
+        if pos < len(self._ids) and self._ids[pos] == faiss_id:
+            return int(self._rows[pos])
+        return None
+
+    def _read_value(self, column, row):
+        """Decodes a single column value of a row from its blob."""
+        offsets = self._offsets[column]
+        return bytes(self._data[column][offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    def _read_row(self, row):
+        """Decodes every column of a row into a metadata dictionary."""
+        return {column: self._read_value(column, row) for column in self.columns}
+
+    def get(self, faiss_id, default=None):
+        """Returns the metadata of a review, reading only that row from disk."""
+        if faiss_id in self._overlay:
+            return self._overlay[faiss_id]
+        if faiss_id in self._removed:
+            return default
+        row = self._row(faiss_id)
+        return default if row is None else self._read_row(row)
+
+    def __getitem__(self, faiss_id):
+        record = self.get(faiss_id)
+        if record is None:
+            raise KeyError(faiss_id)
+        return record
+
+    def __contains__(self, faiss_id):
+        if faiss_id in self._overlay:
+            return True
+        return faiss_id not in self._removed and self._row(faiss_id) is not None
+
+    def __len__(self):
+        return self._len
+
+    def pop(self, faiss_id, default=None):
+        """Removes a review from the store and returns its metadata."""
+        record = self.get(faiss_id)
+        if record is None:
+            return default
+        self._overlay.pop(faiss_id, None)
+        if self._row(faiss_id) is not None:
+            self._removed.add(faiss_id)
+        self._len -= 1
+        self._filter_cache.clear()
+        return record
+
+    def update(self, items):
+        """Adds or replaces reviews from (FAISS ID, metadata) pairs."""
+        self._filter_cache.clear()
+        for faiss_id, record in items:
+            if faiss_id not in self:
+                self._len += 1
+            self._overlay[faiss_id] = record
+
+    def items(self):
+        """Yields every (FAISS ID, metadata) pair, including the in-memory changes."""
+        for faiss_id, row in zip(self._ids.tolist(), self._rows.tolist()):
+            if faiss_id not in self._overlay and faiss_id not in self._removed:
+                yield faiss_id, self._read_row(row)
+        yield from self._overlay.items()
+
+    def column(self, name):
+        """Yields the values of one column for every review, without decoding the others."""
+        for faiss_id, row in zip(self._ids.tolist(), self._rows.tolist()):
+            if faiss_id not in self._overlay and faiss_id not in self._removed:
+                yield self._read_value(name, row)
+        for record in self._overlay.values():
+            yield record.get(name, "")
+
+    def _file_mask(self, column, wanted):
+        """Returns a boolean mask over the file rows whose `column` value is in `wanted`."""
+        n = len(self._ids)
+        if column in self._codes:
+            # Compare the small vocabulary, then scan the integer codes.
+            wanted_codes = [code for code, value in enumerate(self._vocabularies[column]) if value.lower() in wanted]
+            return np.isin(self._codes[column], wanted_codes)
+        if column in self.columns:
+            # Columns without codes are decoded row by row, which is much slower.
+            return np.fromiter((self._read_value(column, row).lower() in wanted for row in range(n)), dtype=bool, count=n)
+        # Stores written before the column existed have no values for it.
+        return np.zeros(n, dtype=bool)
+
+    def ids_where(self, filters):
+        """Returns the FAISS IDs of the reviews matching a metadata filter.
+
+        Values are compared case-insensitively. The result of recent filters is cached
+        until the store is modified.
+
+        Args:
+            filters (dict[str, str | list[str]]): Column name to the accepted value or values.
+                                                  A review must match every column.
+
+        Returns:
+            np.ndarray: The sorted int64 FAISS IDs of the matching reviews.
+        """
+        key = tuple(sorted(
+            (column, tuple(sorted({str(v).lower() for v in ([values] if isinstance(values, str) else values)})))
+            for column, values in filters.items()
+        ))
+        if key in self._filter_cache:
+            self._filter_cache.move_to_end(key)
+            return self._filter_cache[key]
+
+        mask = np.ones(len(self._ids), dtype=bool)
+        for column, wanted in key:
+            mask &= self._file_mask(column, set(wanted))
+        if self._row_ids is None:
+            # The FAISS ID of every row, in file order.
+            self._row_ids = np.empty(len(self._ids), dtype=np.int64)
+            self._row_ids[self._rows] = self._ids
+        matches = self._row_ids[mask]
+
+        # Apply the in-memory changes on top of the files.
+        if self._overlay or self._removed:
+            stale = np.fromiter(set(self._overlay) | self._removed, dtype=np.int64)
+            matches = matches[~np.isin(matches, stale)]
+            overlay_matches = [
+                faiss_id for faiss_id, record in self._overlay.items()
+                if all(str(record.get(column, "")).lower() in wanted for column, wanted in key)
+            ]
+            matches = np.concatenate([matches, np.array(overlay_matches, dtype=np.int64)])
+        matches = np.sort(matches)
+
+        self._filter_cache[key] = matches
+        if len(self._filter_cache) > FILTER_CACHE_SIZE:
+            self._filter_cache.popitem(last=False)
+        return matches
+
+    def values_of(self, column, faiss_ids):
+        """Returns the value of one column for each of the given reviews.
+
+        Coded columns are looked up without decoding the rows, so this is much faster than
+        calling `get` for each review.
+
+        Args:
+            column (str): The column to read.
+            faiss_ids (np.ndarray): The FAISS IDs of the reviews.
+
+        Returns:
+            np.ndarray: An object array of the values, "" for IDs that are not stored.
+        """
+        faiss_ids = np.asarray(faiss_ids, dtype=np.int64)
+        values = np.full(len(faiss_ids), "", dtype=object)
+        if len(self._ids):
+            pos = np.minimum(np.searchsorted(self._ids, faiss_ids), len(self._ids) - 1)
+            changed = np.fromiter(set(self._overlay) | self._removed, dtype=np.int64)
+            in_files = (self._ids[pos] == faiss_ids) & ~np.isin(faiss_ids, changed)
+            rows = self._rows[pos[in_files]]
+            if column in self._codes:
+                values[in_files] = np.asarray(self._vocabularies[column], dtype=object)[self._codes[column][rows]]
+            elif column in self.columns:
+                values[in_files] = [self._read_value(column, row) for row in rows.tolist()]
+        for i, faiss_id in enumerate(faiss_ids.tolist()):
+            if faiss_id in self._overlay:
+                values[i] = str(self._overlay[faiss_id].get(column, ""))
+        return values
+
+    def values_where(self, column, filters):
+        """Returns the distinct values of a column among the reviews matching a filter.
+
+        For example, `values_where("listing_id", {"city": "Paris"})` returns the listings
+        that have at least one review in Paris.
+
+        Args:
+            column (str): The column whose values are collected.
+            filters (dict[str, str | list[str]]): The filter, as for `ids_where`.
+
+        Returns:
+            set[str]: The distinct values.
+        """
+        return set(self.values_of(column, self.ids_where(filters)).tolist())
@@ -0,0 +1,283 @@
+# This script implements a lightweight instrumentation layer for the RAG pipeline.
+# Stages are wrapped in named spans (`with span("index.search"): ...`), and token counts and
+# other quantities are recorded as counters and gauges. Everything is off by default: a
+# disabled span is a shared no-op object, so instrumented code only pays for one function
+# call and a flag check. When enabled, the results can be exported as structured JSON log
+# lines, a Prometheus text dump, and a trace of the spans that opens in speedscope (the
+# format `py-spy record --format speedscope` writes).
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from src.rag_airbnb_config import METRICS_ENABLED, METRICS_LOG_PATH
+
+# Whether spans and counters are recorded. Set with `enable`.
+_enabled = False
+_lock = threading.Lock()
+# Span name -> [count, total seconds, max seconds].
+_timings = {}
+# Counter name -> value.
+_counters = {}
+# Gauge name -> value.
+_gauges = {}
+# The open JSON log file, or None.
+_log_file = None
+# Thread name -> list of (event type, span name, seconds since `_trace_start`), or None when not tracing.
+_trace_events = None
+_trace_start = 0.0
+_local = threading.local()
+
+class _NullSpan:
+    """The span returned while instrumentation is disabled. It does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    """A timed stage of the pipeline. Use through `span`."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """Adds attributes to the span's log line, e.g. the number of rows it processed."""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.start = time.perf_counter()
+        if _trace_events is not None:
+            _trace(("O", self.name, self.start - _trace_start))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        seconds = end - self.start
+        _local.stack.pop()
+        if _trace_events is not None:
+            _trace(("C", self.name, end - _trace_start))
+        with _lock:
+            timing = _timings.get(self.name)
+            if timing is None:
+                _timings[self.name] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+        if _log_file is not None:
+            log("span", name=self.name, seconds=seconds, parent=self.parent,
+                error=exc_type.__name__ if exc_type else None, **self.attributes)
+        return False
+
+def _trace(event):
+    """Appends a span open/close event to the current thread's trace."""
+    events = _trace_events.get(threading.current_thread().name)
+    if events is None:
+        with _lock:
+            events = _trace_events.setdefault(threading.current_thread().name, [])
+    events.append(event)
+
+def enable(log_path=METRICS_LOG_PATH, trace=False):
+    """Turns instrumentation on.
+
+    Args:
+        log_path (str): The file JSON log lines are appended to ("" for none).
+        trace (bool): Whether to also record every span for `write_trace`.
+    """
+    global _enabled, _log_file, _trace_events, _trace_start
+    _enabled = True
+    if log_path and _log_file is None:
+        _log_file = open(log_path, "a", encoding="utf-8", buffering=1)
+    if trace and _trace_events is None:
+        _trace_events = {}
+        _trace_start = time.perf_counter()
+
+def is_enabled():
+    """Returns True if instrumentation is on, e.g. to skip computing a value only recorded as a metric."""
+    return _enabled
+
+def span(name, **attributes):
+    """Returns a context manager that times a stage of the pipeline.
+
+    Args:
+        name (str): The stage, as "<area>.<step>" (e.g. "ingest.encode").
+        **attributes: Values added to the span's JSON log line (e.g. rows=1000).
+
+    Returns:
+        A context manager; its `set` method adds attributes from inside the block.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, attributes)
+
+def count(name, value=1):
+    """Adds `value` to a counter, e.g. the number of generated tokens."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def set_gauge(name, value):
+    """Sets a gauge to its latest value, e.g. the last generation speed."""
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[name] = value
+
+def log(event, **fields):
+    """Writes one structured JSON log line, if a log file is open."""
+    if _log_file is None:
+        return
+    line = json.dumps({"time": time.time(), "event": event, "thread": threading.current_thread().name, **fields},
+                      default=str)
+    with _lock:
+        _log_file.write(line + "\n")
+
+def record_generation(stats):
+    """Records the token counts and timings of one generated answer.
+
+    Args:
+        stats (dict): The statistics of a `TokenStream`, or a dict with at least
+                      "prompt_tokens", "generated_tokens" and "total_s".
+    """
+    if not _enabled:
+        return
+    count("prompt_tokens", stats.get("prompt_tokens") or 0)
+    count("generated_tokens", stats.get("generated_tokens") or 0)
+    count("answers")
+    if stats.get("total_s"):
+        set_gauge("tokens_per_second", stats["generated_tokens"] / stats["total_s"])
+    if stats.get("time_to_first_token_s") is not None:
+        set_gauge("time_to_first_token_seconds", stats["time_to_first_token_s"])
+    log("generation", **stats)
+
+def peak_rss_bytes():
+    """Returns the peak resident memory of the process in bytes, or None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        # Windows has no resource module; psutil reports the peak working set if installed.
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def snapshot():
+    """Returns every recorded metric.
+
+    Returns:
+        dict: "spans" (count, total and max seconds per span), "counters" and "gauges".
+    """
+    peak = peak_rss_bytes()
+    with _lock:
+        gauges = dict(_gauges)
+        if peak is not None:
+            gauges["peak_rss_bytes"] = peak
+        return {
+            "spans": {name: {"count": c, "total_s": total, "max_s": longest}
+                      for name, (c, total, longest) in _timings.items()},
+            "counters": dict(_counters),
+            "gauges": gauges,
+        }
+
+def _metric_name(name):
+    """Turns a span or counter name into a valid Prometheus metric name component."""
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def prometheus_text():
+    """Returns the metrics in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = [
+        "# HELP rag_span_seconds Time spent in each stage of the pipeline.",
+        "# TYPE rag_span_seconds summary",
+    ]
+    for name, s in sorted(data["spans"].items()):
+        lines.append(f'rag_span_seconds_sum{{span="{name}"}} {s["total_s"]:.6f}')
+        lines.append(f'rag_span_seconds_count{{span="{name}"}} {s["count"]}')
+    lines += ["# HELP rag_span_max_seconds The longest single run of each stage.", "# TYPE rag_span_max_seconds gauge"]
+    for name, s in sorted(data["spans"].items()):
+        lines.append(f'rag_span_max_seconds{{span="{name}"}} {s["max_s"]:.6f}')
+    for name, value in sorted(data["counters"].items()):
+        lines += [f"# TYPE rag_{_metric_name(name)}_total counter", f"rag_{_metric_name(name)}_total {value}"]
+    for name, value in sorted(data["gauges"].items()):
+        lines += [f"# TYPE rag_{_metric_name(name)} gauge", f"rag_{_metric_name(name)} {value}"]
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path):
+    """Writes `prometheus_text` to a file, e.g. for the node exporter's textfile collector."""
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(path + ".tmp", path)
+
+def write_trace(path):
+    """Writes the recorded spans as a speedscope file, one timeline per thread.
+
+    Open it at https://www.speedscope.app, next to a `py-spy record --format speedscope` profile.
+    """
+    if _trace_events is None:
+        return
+    frames, frame_index, profiles = [], {}, []
+    with _lock:
+        threads = {name: list(events) for name, events in _trace_events.items()}
+    for thread, events in threads.items():
+        # Close the spans still open (e.g. the query loop) at the last recorded time.
+        end = events[-1][2] if events else 0.0
+        open_spans = []
+        speedscope_events = []
+        for kind, name, at in events:
+            if name not in frame_index:
+                frame_index[name] = len(frames)
+                frames.append({"name": name})
+            speedscope_events.append({"type": kind, "frame": frame_index[name], "at": at})
+            if kind == "O":
+                open_spans.append(name)
+            elif open_spans:
+                open_spans.pop()
+        for name in reversed(open_spans):
+            speedscope_events.append({"type": "C", "frame": frame_index[name], "at": end})
+        profiles.append({
+            "type": "evented", "name": thread, "unit": "seconds",
+            "startValue": events[0][2] if events else 0.0, "endValue": end, "events": speedscope_events,
+        })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames}, "profiles": profiles,
+            "name": "RAG pipeline spans", "exporter": "rag_airbnb_metrics",
+        }, f)
+
+def format_report():
+    """Returns a human-readable table of the spans, counters and gauges."""
+    data = snapshot()
+    lines = ["[+] Pipeline metrics:", f"    {'stage':<32} {'count':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9}"]
+    for name, s in sorted(data["spans"].items(), key=lambda item: -item[1]["total_s"]):
+        lines.append(f"    {name:<32} {s['count']:>7} {s['total_s']:>9.2f} "
+                     f"{1000 * s['total_s'] / s['count']:>9.2f} {1000 * s['max_s']:>9.2f}")
+    for name, value in sorted({**data["counters"], **data["gauges"]}.items()):
+        value = f"{value / 2**20:.0f} MB" if name.endswith("_bytes") else f"{value:.6g}"
+        lines.append(f"    {name:<32} {value}")
+    return "\n".join(lines)
+
+if METRICS_ENABLED:
+    enable()
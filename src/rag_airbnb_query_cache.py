@@ -0,0 +1,142 @@
+# This script implements a small in-memory cache for query embeddings and retrieval results.
+# User traffic repeats the same questions often ("is it safe", "best area near the beach"),
+# so remembering the query vector and the IDs retrieved for it lets a repeated question skip
+# both the sentence-transformer encoding and the FAISS search.
+
+from collections import OrderedDict
+import threading
+import time
+
+def normalize_query(query):
+    """Normalizes a query so that trivially different spellings share a cache entry.
+
+    The text is lower-cased, runs of whitespace are collapsed and trailing punctuation is
+    dropped, so "Is it safe?" and "is it  safe" map to the same key.
+
+    Args:
+        query (str): The user's question.
+
+    Returns:
+        str: The normalized query text.
+    """
+    return " ".join(query.lower().split()).strip(" ?!.")
+
+def filters_key(filters):
+    """Returns a hashable, order-independent key for a metadata filter (None if empty)."""
+    if not filters:
+        return None
+    return tuple(sorted(
+        (column, tuple(sorted({str(v).lower() for v in ([values] if isinstance(values, str) else values)})))
+        for column, values in filters.items() if values
+    )) or None
+
+class QueryCache:
+    """A bounded, thread-safe LRU cache with a time-to-live for query results.
+
+    Entries are keyed on the normalized query text, `top_k` and the metadata filters, and
+    hold the query vector together with the FAISS IDs retrieved for it. Every lookup passes the current index
+    version; when it differs from the version the entries were stored under, the whole
+    cache is dropped, so a rebuilt or updated index never serves stale results.
+    """
+
+    def __init__(self, max_size=1024, ttl=3600):
+        """Initializes an empty cache.
+
+        Args:
+            max_size (int): The maximum number of entries. 0 disables the cache.
+            ttl (float): The number of seconds an entry stays valid. 0 or less never expires.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        """Clears the cache if the index version changed. The lock must be held."""
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+            self._version = version
+
+    def get(self, query, top_k, version, filters=None):
+        """Returns the cached (query vector, FAISS IDs) pair of a query, or None on a miss.
+
+        Args:
+            query (str): The user's question.
+            top_k (int): The number of documents retrieved for it.
+            version: The current index version (see `index_version`).
+            filters (dict, optional): The metadata filters of the search.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray] | None: The cached query vector and retrieved IDs.
+        """
+        if self.max_size <= 0:
+            return None
+        key = (normalize_query(query), top_k, filters_key(filters))
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0 and time.monotonic() - entry[0] > self.ttl:
+                # The entry is too old; drop it and treat the lookup as a miss.
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, query, top_k, version, query_vector, faiss_ids, filters=None):
+        """Stores the query vector and retrieved IDs of a query.
+
+        Args:
+            query (str): The user's question.
+            top_k (int): The number of documents retrieved for it.
+            version: The index version the IDs were retrieved from.
+            query_vector (np.ndarray): The normalized query embedding.
+            faiss_ids (np.ndarray): The FAISS IDs returned by the search.
+            filters (dict, optional): The metadata filters of the search.
+        """
+        if self.max_size <= 0:
+            return
+        key = (normalize_query(query), top_k, filters_key(filters))
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.monotonic(), query_vector, faiss_ids)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                # Evict the least recently used entry.
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drops every entry. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the cache counters.
+
+        Returns:
+            dict: The hits, misses, hit rate, evictions, expirations, invalidations and size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+            }
@@ -0,0 +1,407 @@
+# This script implements a long-lived local HTTP service for the RAG pipeline.
+# The models, index and metadata are loaded once by the caller. An asyncio front end accepts
+# concurrent requests and a micro-batching scheduler groups the questions that arrive within
+# a short window into a single batched encode/search/generate call, so throughput grows with
+# load instead of requests queueing one behind the other.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import time
+
+from src.rag_airbnb_config import (
+    SERVER_HOST, SERVER_PORT, SERVER_MAX_BATCH_SIZE, SERVER_MAX_WAIT_MS,
+    SERVER_REQUEST_TIMEOUT, SERVER_MAX_CONCURRENCY, SERVER_MAX_TOP_K,
+)
+from src.rag_airbnb_faiss_index import FILTER_COLUMNS
+from src.rag_airbnb_llm import (
+    answer_queries, build_contexts, build_prompt, query_cache, TokenStream,
+)
+from src.rag_airbnb_query_cache import filters_key
+from src.rag_airbnb_metrics import prometheus_text, record_generation, set_gauge, span
+
+# Marks the end of a streamed answer on the queue between the worker thread and the event loop.
+_END = object()
+
+# The largest request body accepted, in bytes.
+MAX_BODY_SIZE = 1 << 20
+
+HTTP_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+class MicroBatcher:
+    """Collects concurrent questions into batches and answers each batch with one call.
+
+    The first question of a batch waits at most `max_wait_ms` for others to join it, and a
+    batch is dispatched as soon as it holds `max_batch_size` questions. Batches run one at a
+    time on a dedicated worker thread, because the models are not safe to call concurrently
+    and the event loop must stay free to accept new requests meanwhile.
+    """
+
+    def __init__(self, index, reviews, embedder, llm, max_batch_size=SERVER_MAX_BATCH_SIZE,
+                 max_wait_ms=SERVER_MAX_WAIT_MS):
+        self.index = index
+        self.reviews = reviews
+        self.embedder = embedder
+        self.llm = llm
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-batch")
+        self._task = None
+        self.batches = 0
+        self.questions = 0
+        self.streams = 0
+
+    def start(self):
+        """Starts the scheduler task on the running event loop."""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stops the scheduler and the worker thread."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, question, top_k, filters=None):
+        """Queues a question and waits for its result.
+
+        Returns:
+            dict: The "question", "answer" and retrieved "review_ids".
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((question, top_k, filters, future))
+        return await future
+
+    async def stream(self, question, top_k, filters=None):
+        """Answers a single question and yields the answer text as it is generated.
+
+        Streamed answers are not batched, but they run on the same worker thread as the
+        batches so that the model is never used concurrently. Closing the generator (e.g.
+        when the client disconnects or times out) cancels the generation.
+
+        Yields:
+            str | dict: Pieces of the answer text, then a final dict with the retrieved
+                        "review_ids", the "context_stats" and the generation "stats".
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+        state = {}
+
+        def generate():
+            try:
+                if cancelled.is_set():
+                    return
+                contexts, context_stats = build_contexts(
+                    [question], self.index, self.reviews, self.embedder, self.llm, top_k, filters,
+                )
+                docs = contexts[0]
+                state["review_ids"] = [doc.get("review_id") for doc in docs]
+                state["context_stats"] = context_stats[0]
+                state["stream"] = token_stream = TokenStream(self.llm, build_prompt(question, docs))
+                if cancelled.is_set():
+                    token_stream.cancel()
+                with span("llm.generate", prompts=1):
+                    for text in token_stream:
+                        loop.call_soon_threadsafe(queue.put_nowait, text)
+                record_generation(token_stream.stats)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, _END)
+
+        future = loop.run_in_executor(self._executor, generate)
+        try:
+            while (text := await queue.get()) is not _END:
+                yield text
+            await future
+            self.streams += 1
+            yield {"review_ids": state.get("review_ids", []), "context_stats": state.get("context_stats"),
+                   "stats": state["stream"].stats}
+        finally:
+            cancelled.set()
+            if "stream" in state:
+                state["stream"].cancel()
+
+    async def _collect(self):
+        """Waits for the next batch of pending questions."""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Drop the questions whose callers already gave up (timed out or disconnected).
+        return [item for item in batch if not item[-1].done()]
+
+    async def _run(self):
+        """Dispatches batches to the worker thread until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # `answer_queries` retrieves the same number of reviews with the same filters for
+            # every question, so questions differing in either are answered in separate calls.
+            groups = {}
+            for item in batch:
+                try:
+                    key = (item[1], filters_key(item[2]))
+                except Exception as e:
+                    # A malformed filter fails its own question, not the scheduler.
+                    item[-1].set_exception(e)
+                    continue
+                groups.setdefault(key, []).append(item)
+            for items in groups.values():
+                questions = [question for question, _, _, _ in items]
+                _, top_k, filters, _ = items[0]
+                try:
+                    set_gauge("server_batch_size", len(questions))
+                    results = await loop.run_in_executor(
+                        self._executor, answer_queries, questions, self.index, self.reviews,
+                        self.embedder, self.llm, top_k, filters,
+                    )
+                except Exception as e:
+                    for *_, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.batches += 1
+                self.questions += len(items)
+                for (*_, future), result in zip(items, results):
+                    if not future.done():
+                        future.set_result(result)
+
+def _valid_filters(filters):
+    """Returns True if `filters` maps known columns to a string or a list of scalar values."""
+    if not isinstance(filters, dict) or set(filters) - set(FILTER_COLUMNS):
+        return False
+    scalar = (str, int, float)
+    return all(
+        isinstance(values, str)
+        or isinstance(values, list) and all(isinstance(v, scalar) and not isinstance(v, bool) for v in values)
+        for values in filters.values()
+    )
+
+class RAGServer:
+    """A minimal HTTP/1.1 JSON server in front of a `MicroBatcher`.
+
+    Endpoints:
+        POST /query   {"question": "...", "top_k": 5} -> {"question", "answer", "review_ids"}
+                      With "stream": true, the answer is streamed as NDJSON lines instead.
+                      With "filters": {"city": "Paris", ...}, only matching reviews are retrieved.
+        GET  /health  -> {"status": "ok"}
+        GET  /stats   -> batching and query cache counters
+        GET  /metrics -> per-stage timings and token counters in the Prometheus text format
+                         (recorded when METRICS_ENABLED or --metrics is set)
+    """
+
+    def __init__(self, batcher, request_timeout=SERVER_REQUEST_TIMEOUT,
+                 max_concurrency=SERVER_MAX_CONCURRENCY):
+        self.batcher = batcher
+        self.request_timeout = request_timeout
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    async def _read_request(self, reader):
+        """Parses the request line, headers and body of one HTTP request."""
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            return None
+        method, path, _ = request_line.split(" ", 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_SIZE:
+            return method, path, None
+        body = await reader.readexactly(length) if length else b""
+        return method, path, body
+
+    async def _write_response(self, writer, status, payload, content_type="application/json"):
+        """Writes a JSON response, or a text one if `payload` is a string, and closes the connection."""
+        if isinstance(payload, str):
+            body = payload.encode("utf-8")
+        else:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            f"Content-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def _stream_answer(self, writer, question, top_k, filters=None):
+        """Streams an answer as newline-delimited JSON with chunked transfer encoding.
+
+        Each line is {"text": "..."} while the answer is generated, followed by a final
+        {"done": true, "review_ids": [...], "stats": {...}} (or {"error": "..."}).
+        """
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/x-ndjson; charset=utf-8\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+
+        async def send(payload):
+            line = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+            writer.write(f"{len(line):x}\r\n".encode("latin-1") + line + b"\r\n")
+            await writer.drain()
+
+        deadline = time.monotonic() + self.request_timeout
+        pieces = self.batcher.stream(question, top_k, filters)
+        try:
+            while True:
+                try:
+                    piece = await asyncio.wait_for(pieces.__anext__(), max(deadline - time.monotonic(), 0))
+                except StopAsyncIteration:
+                    break
+                if isinstance(piece, str):
+                    await send({"text": piece})
+                else:
+                    await send({"done": True, **piece})
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            await send({"error": f"The request did not complete within {self.request_timeout} seconds."})
+        except ConnectionError:
+            raise
+        except Exception as e:
+            await send({"error": str(e)})
+        finally:
+            # Cancels the generation if it is still running (timeout or client gone).
+            await pieces.aclose()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _answer(self, body, writer):
+        """Validates a /query request and answers it.
+
+        Returns:
+            tuple[int, dict] | None: The status and payload, or None if the response was
+                                     already streamed to `writer`.
+        """
+        try:
+            request = json.loads(body or b"{}")
+            question = request["question"]
+            top_k = int(request.get("top_k", 5))
+            stream = bool(request.get("stream", False))
+            filters = request.get("filters") or None
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return 400, {"error": 'Expected a JSON body like {"question": "...", "top_k": 5, "stream": false}.'}
+        if not isinstance(question, str) or not question.strip() or not 0 < top_k <= SERVER_MAX_TOP_K:
+            return 400, {"error": f"The question must be a non-empty string and top_k between 1 and {SERVER_MAX_TOP_K}."}
+        if filters is not None and not _valid_filters(filters):
+            return 400, {"error": f"Filters must be an object with keys among {FILTER_COLUMNS}, "
+                                  "each mapped to a string or a list of strings or numbers."}
+
+        # Shed load instead of queueing without bound once the concurrency limit is reached.
+        if self.in_flight >= self.max_concurrency:
+            self.rejected += 1
+            return 503, {"error": "Too many concurrent requests, try again later."}
+        self.in_flight += 1
+        try:
+            if stream:
+                await self._stream_answer(writer, question, top_k, filters)
+                return None
+            result = await asyncio.wait_for(self.batcher.submit(question, top_k, filters), self.request_timeout)
+            return 200, result
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return 504, {"error": f"The request did not complete within {self.request_timeout} seconds."}
+        except Exception as e:
+            return 500, {"error": str(e)}
+        finally:
+            self.in_flight -= 1
+
+    def stats(self):
+        """Returns the server, batching and query cache counters."""
+        return {
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "batches": self.batcher.batches,
+            "questions": self.batcher.questions,
+            "avg_batch_size": self.batcher.questions / self.batcher.batches if self.batcher.batches else 0.0,
+            "streams": self.batcher.streams,
+            "query_cache": query_cache.stats(),
+        }
+
+    async def handle(self, reader, writer):
+        """Serves one connection."""
+        try:
+            request = await self._read_request(reader)
+            if request is None:
+                return
+            method, path, body = request
+            content_type = "application/json"
+            if body is None:
+                status, payload = 413, {"error": "Request body too large."}
+            elif path == "/query":
+                response = (await self._answer(body, writer)) if method == "POST" else (405, {"error": "Use POST."})
+                if response is None:
+                    # The answer was streamed.
+                    return
+                status, payload = response
+            elif path == "/health":
+                status, payload = 200, {"status": "ok"}
+            elif path == "/stats":
+                status, payload = 200, self.stats()
+            elif path == "/metrics":
+                set_gauge("server_in_flight", self.in_flight)
+                status, payload = 200, prometheus_text()
+                content_type = "text/plain; version=0.0.4"
+            else:
+                status, payload = 404, {"error": f"Unknown path {path}."}
+            await self._write_response(writer, status, payload, content_type)
+        except (ValueError, asyncio.IncompleteReadError):
+            await self._write_response(writer, 400, {"error": "Malformed HTTP request."})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def _serve(index, reviews, embedder, llm, host, port):
+    """Starts the batcher and the HTTP server and serves until cancelled."""
+    batcher = MicroBatcher(index, reviews, embedder, llm)
+    batcher.start()
+    server = RAGServer(batcher)
+    http_server = await asyncio.start_server(server.handle, host, port)
+    print(f"[+] Serving on http://{host}:{port} (POST /query, GET /health, GET /stats, GET /metrics). Press Ctrl+C to stop.")
+    try:
+        async with http_server:
+            await http_server.serve_forever()
+    finally:
+        await batcher.stop()
+
+def serve(index, reviews, embedder, llm, host=SERVER_HOST, port=SERVER_PORT):
+    """Runs the HTTP service until interrupted.
+
+    Args:
+        index (faiss.Index): The FAISS index of review embeddings.
+        reviews (ReviewMetadataStore): The review metadata keyed by FAISS ID.
+        embedder (SentenceTransformer): The sentence-transformer model for encoding the queries.
+        llm (HuggingFacePipeline): The generative language model pipeline.
+        host (str): The interface to listen on.
+        port (int): The TCP port to listen on.
+    """
+    try:
+        asyncio.run(_serve(index, reviews, embedder, llm, host, port))
+    except KeyboardInterrupt:
+        print("\n[+] Server stopped.")
@@ -0,0 +1,191 @@
+# This script reads reviews from Parquet and CSV exports of the review database, for machines
+# that cannot reach the SQL Server warehouse (Linux ingest workers, CI).
+# An export holds one row per review with the columns selected by `REVIEW_SELECT` in
+# rag_airbnb_database.py: review_id, listing_id, comments, review_lang, property_city and
+# property_country. It can be a single file or a directory of files.
+# Files are read with pyarrow in columnar record batches: only the needed columns are read, and
+# the language, city and non-empty comment filters are pushed down to the scan, so Parquet row
+# groups whose statistics exclude them are skipped. pyarrow is optional; without it, CSV exports
+# are read row by row with the csv module and Parquet exports cannot be read.
+
+import csv
+import glob
+import os
+
+from src.rag_airbnb_config import BATCH_SIZE, REVIEW_LANGUAGES, REVIEW_CITIES
+
+try:
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:
+    pc = ds = None
+
+# The review keys and the export columns they are read from, in order of preference. The
+# alternative names are those of `cleaned_reviews_view`.
+SOURCE_COLUMNS = {
+    "review_id": ("review_id",),
+    "listing_id": ("listing_id",),
+    "text": ("comments", "review_text"),
+    "review_lang": ("review_lang",),
+    "city": ("property_city", "city"),
+    "property_country": ("property_country",),
+}
+
+def resolve_columns(available):
+    """Maps each review key to the export column it is read from.
+
+    Args:
+        available (Iterable[str]): The column names of the export.
+
+    Returns:
+        dict[str, str | None]: The column of each key of `SOURCE_COLUMNS`, or None if the
+                               export lacks it (the key is then filled with empty strings).
+
+    Raises:
+        ValueError: If the export has no review ID or comment column.
+    """
+    available = set(available)
+    columns = {key: next((c for c in names if c in available), None) for key, names in SOURCE_COLUMNS.items()}
+    missing = [SOURCE_COLUMNS[key][0] for key in ("review_id", "text") if columns[key] is None]
+    if missing:
+        raise ValueError(f"The review export has no {' or '.join(missing)} column (found {sorted(available)}).")
+    return columns
+
+def _to_reviews(data, columns, n):
+    """Converts columnar data (key column -> list of values) into review dictionaries."""
+    values = {key: data[column] if column else [""] * n for key, column in columns.items()}
+    # The IDs are converted to strings and missing attributes to empty strings, as with the database.
+    return [
+        {
+            "review_id": str(review_id),
+            "listing_id": "" if listing_id is None else str(listing_id),
+            "text": text,
+            "review_lang": review_lang or "",
+            "city": city or "",
+            "property_country": property_country or "",
+        }
+        for review_id, listing_id, text, review_lang, city, property_country in zip(
+            values["review_id"], values["listing_id"], values["text"],
+            values["review_lang"], values["city"], values["property_country"],
+        )
+    ]
+
+def _rebatch(review_chunks, limit, chunk_size):
+    """Regroups chunks of reviews into chunks of `chunk_size`, stopping after `limit` reviews."""
+    pending = []
+    total = 0
+    for reviews in review_chunks:
+        if limit > 0:
+            reviews = reviews[:limit - total]
+        pending += reviews
+        total += len(reviews)
+        while len(pending) >= chunk_size:
+            yield pending[:chunk_size]
+            pending = pending[chunk_size:]
+        if limit > 0 and total >= limit:
+            break
+    if pending:
+        yield pending
+
+def iter_arrow_batches(path, file_format, languages=None, cities=None, batch_size=BATCH_SIZE):
+    """Scans a Parquet or CSV export with pyarrow, with column projection and filter pushdown.
+
+    Args:
+        path (str): The export file, or a directory of export files.
+        file_format (str): "parquet" or "csv".
+        languages (list[str], optional): Only keep reviews in these languages. Defaults to REVIEW_LANGUAGES.
+        cities (list[str], optional): Only keep reviews of listings in these cities. Defaults to REVIEW_CITIES.
+        batch_size (int): The maximum number of rows per record batch.
+
+    Yields:
+        tuple[pyarrow.RecordBatch, dict]: The record batches, holding only the needed columns
+            and matching rows, and the column of each review key (see `resolve_columns`).
+    """
+    if ds is None:
+        raise ImportError(f"Reading {file_format} review exports needs pyarrow: pip install pyarrow")
+    languages = REVIEW_LANGUAGES if languages is None else languages
+    cities = REVIEW_CITIES if cities is None else cities
+    dataset = ds.dataset(path, format=file_format)
+    columns = resolve_columns(dataset.schema.names)
+
+    # As in `cleaned_reviews_view`, reviews whose comments are null or only whitespace are left out.
+    text = ds.field(columns["text"])
+    condition = text.is_valid() & (pc.utf8_trim_whitespace(text) != "")
+    for key, accepted in (("review_lang", languages), ("city", cities)):
+        if accepted:
+            if columns[key] is None:
+                raise ValueError(f"Cannot filter on {key}: the review export has no {SOURCE_COLUMNS[key][0]} column.")
+            condition &= ds.field(columns[key]).isin(accepted)
+
+    projection = sorted({column for column in columns.values() if column})
+    scanner = dataset.scanner(columns=projection, filter=condition, batch_size=batch_size)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch, columns
+
+def _iter_csv_rows(path, languages, cities, chunk_size):
+    """Reads a CSV export with the csv module when pyarrow is not installed.
+
+    Yields:
+        list[dict]: Chunks of matching reviews.
+    """
+    paths = sorted(glob.glob(os.path.join(path, "*.csv"))) if os.path.isdir(path) else [path]
+    for file_path in paths:
+        with open(file_path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            columns = resolve_columns(reader.fieldnames or [])
+            for key, accepted in (("review_lang", languages), ("city", cities)):
+                if accepted and columns[key] is None:
+                    raise ValueError(f"Cannot filter on {key}: the review export has no {SOURCE_COLUMNS[key][0]} column.")
+            chunk = {column: [] for column in columns.values() if column}
+            n = 0
+            for row in reader:
+                if not (row[columns["text"]] or "").strip():
+                    continue
+                if languages and row[columns["review_lang"]] not in languages:
+                    continue
+                if cities and row[columns["city"]] not in cities:
+                    continue
+                for column, values in chunk.items():
+                    values.append(row[column])
+                n += 1
+                if n == chunk_size:
+                    yield _to_reviews(chunk, columns, n)
+                    chunk = {column: [] for column in chunk}
+                    n = 0
+            if n:
+                yield _to_reviews(chunk, columns, n)
+
+def iter_file_batches(path, file_format, limit=0, chunk_size=BATCH_SIZE):
+    """Streams reviews from a Parquet or CSV export in chunks.
+
+    Rows are delivered in file order; the record batches are converted to review dictionaries
+    one column at a time, so only about one chunk is held in memory at a time.
+
+    Args:
+        path (str): The export file, or a directory of export files.
+        file_format (str): "parquet" or "csv".
+        limit (int): The maximum number of reviews to load (0 = all).
+        chunk_size (int): The number of reviews per chunk.
+
+    Yields:
+        list[dict]: Chunks of reviews, as in `iter_review_batches`.
+
+    Raises:
+        ValueError: If no path is given or the export lacks a required column.
+        ImportError: If a Parquet export is read without pyarrow installed.
+    """
+    if not path:
+        raise ValueError(f"REVIEW_SOURCE_PATH must name the {file_format} file or directory to read reviews from.")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No review export found at {path}.")
+    if ds is None and file_format == "csv":
+        chunks = _iter_csv_rows(path, REVIEW_LANGUAGES, REVIEW_CITIES, chunk_size)
+    else:
+        chunks = (_to_reviews(batch.to_pydict(), columns, batch.num_rows)
+                  for batch, columns in iter_arrow_batches(path, file_format, batch_size=chunk_size))
+    total = 0
+    for chunk in _rebatch(chunks, limit, chunk_size):
+        total += len(chunk)
+        yield chunk
+    print(f"[+] Streamed {total} reviews from {path}.")
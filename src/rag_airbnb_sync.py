@@ -0,0 +1,253 @@
+# This script keeps the SQLite cache in sync with a review source that is ordered by review_id
+# (SQL Server or a SQLite copy of its tables), so that a refresh only transfers, encodes and
+# indexes the reviews that were added, edited or deleted since the last one.
+# The synced reviews are split into consecutive review_id ranges of about SYNC_RANGE_SIZE
+# reviews. The `sync_ranges` table of the cache keeps, for each range, the row count and
+# checksum the source reported when it was last synced, and every cached review records its
+# range in `reviews.sync_range`. A refresh then:
+# 1. Asks the source for the row count and checksum of every stored range. The summaries are
+#    computed by the source database, so only the ranges whose values changed are read and
+#    diffed against the cache, which finds edited reviews, reviews inserted below the
+#    watermark and deleted reviews (tombstones).
+# 2. Streams the reviews past the `sync_watermark` (the last synced review_id) through the
+#    ingest pipeline and groups them into new ranges.
+# 3. Checks the cached reviews that belong to no range, i.e. those cached before the first
+#    sync, and deletes the ones the source no longer has.
+
+import json
+
+from src.rag_airbnb_config import (
+    ID_COLUMN, LIMIT, SYNC_RANGE_SIZE, REVIEW_SOURCE, REVIEW_SOURCE_PATH, TABLE,
+    REVIEW_LANGUAGES, REVIEW_CITIES, REVIEW_MODIFIED_COLUMN,
+)
+from src.rag_airbnb_database import (
+    connect_review_source, iter_review_batches, source_range_summary, source_range_reviews, source_existing_ids,
+)
+from src.rag_airbnb_embedding import (
+    REVIEW_ATTRIBUTE_COLUMNS, embed_new_reviews, upsert_reviews, delete_embeddings_from_sqlite,
+    get_cache_metadata, text_hash,
+)
+from src.rag_airbnb_metrics import span, count
+
+# The number of review IDs per query when looking up cached reviews by ID.
+LOOKUP_CHUNK_SIZE = 500
+
+def _sync_settings():
+    """Returns the settings that decide which reviews the stored ranges describe, as a string."""
+    return json.dumps({
+        "source": REVIEW_SOURCE, "path": REVIEW_SOURCE_PATH, "table": TABLE, "languages": REVIEW_LANGUAGES,
+        "cities": REVIEW_CITIES, "modified_column": REVIEW_MODIFIED_COLUMN,
+    }, sort_keys=True)
+
+def _set_metadata(sqlite_conn, key, value):
+    """Stores a cache_metadata entry in the current transaction (see `set_cache_metadata`)."""
+    sqlite_conn.execute("INSERT OR REPLACE INTO cache_metadata (key, value) VALUES (?, ?)", (key, str(value)))
+
+def reset_sync_state(sqlite_conn):
+    """Forgets the change capture state, so that the next sync re-reads the whole source.
+
+    Cached reviews are kept: the next sync only encodes the texts it has no vector for, and
+    deletes the cached reviews that the source no longer has.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+    """
+    with sqlite_conn:
+        sqlite_conn.execute("DELETE FROM sync_ranges")
+        sqlite_conn.execute("UPDATE reviews SET sync_range = NULL WHERE sync_range IS NOT NULL")
+        sqlite_conn.execute("DELETE FROM cache_metadata WHERE key IN ('sync_watermark', 'sync_settings')")
+
+def _cached_reviews(sqlite_conn, where, params):
+    """Returns the cached reviews matching a WHERE clause, as review ID -> (text hash, *attributes)."""
+    rows = sqlite_conn.execute(
+        f"SELECT {ID_COLUMN}, text_hash, {', '.join(REVIEW_ATTRIBUTE_COLUMNS)} FROM reviews WHERE {where}", params
+    )
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def _cached_reviews_by_ids(sqlite_conn, review_ids):
+    """Returns the cached reviews with the given IDs, as in `_cached_reviews`."""
+    review_ids = list(review_ids)
+    cached = {}
+    for start in range(0, len(review_ids), LOOKUP_CHUNK_SIZE):
+        chunk = review_ids[start:start + LOOKUP_CHUNK_SIZE]
+        cached.update(_cached_reviews(sqlite_conn, f"{ID_COLUMN} IN ({', '.join('?' * len(chunk))})", chunk))
+    return cached
+
+def _changed_reviews(reviews, cached):
+    """Returns the reviews that are not cached, or whose text or attributes differ from the cache."""
+    return [
+        r for r in reviews
+        if cached.get(r[ID_COLUMN]) != (text_hash(r["text"]), *(r.get(c) for c in REVIEW_ATTRIBUTE_COLUMNS))
+    ]
+
+def _assign_range(sqlite_conn, review_ids, range_id):
+    """Records the range of the given cached reviews, in the current transaction."""
+    sqlite_conn.executemany(f"UPDATE reviews SET sync_range = ? WHERE {ID_COLUMN} = ?",
+                            ((range_id, review_id) for review_id in review_ids))
+
+def _sync_changed_ranges(sqlite_conn, source_conn, embedder):
+    """Re-reads the stored ranges whose row count or checksum changed in the source.
+
+    Returns:
+        tuple[list[str], list[str]]: The IDs of the added or edited reviews, and of the deleted ones.
+    """
+    ranges = sqlite_conn.execute(
+        "SELECT range_id, lo, hi, row_count, checksum FROM sync_ranges ORDER BY range_id"
+    ).fetchall()
+    changed_ids, removed_ids = [], []
+    stale = 0
+    with span("sync.check_ranges", ranges=len(ranges)):
+        for range_id, lo, hi, row_count, checksum in ranges:
+            # The summary is taken before the rows are read: a change made in between makes
+            # the stored summary differ from the source again, so the next sync re-reads the range.
+            summary = source_range_summary(source_conn, lo, hi)
+            if summary == (row_count, checksum):
+                continue
+            stale += 1
+            with span("sync.read_range", range_id=range_id) as s:
+                reviews = source_range_reviews(source_conn, lo, hi)
+                cached = _cached_reviews(sqlite_conn, "sync_range = ?", (range_id,))
+                source_ids = {r[ID_COLUMN] for r in reviews}
+                deleted = [review_id for review_id in cached if review_id not in source_ids]
+                upserts = _changed_reviews(reviews, cached)
+                s.set(rows=len(reviews), upserted=len(upserts), deleted=len(deleted))
+                if deleted:
+                    delete_embeddings_from_sqlite(sqlite_conn, deleted)
+                if upserts:
+                    upsert_reviews(sqlite_conn, embedder, upserts)
+                with sqlite_conn:
+                    # Writing a review resets its range, so it is assigned again.
+                    _assign_range(sqlite_conn, [r[ID_COLUMN] for r in upserts], range_id)
+                    sqlite_conn.execute("UPDATE sync_ranges SET row_count = ?, checksum = ? WHERE range_id = ?",
+                                        (*summary, range_id))
+            changed_ids += [r[ID_COLUMN] for r in upserts]
+            removed_ids += deleted
+    count("sync_ranges_checked", len(ranges))
+    count("sync_ranges_changed", stale)
+    if ranges:
+        print(f"[+] Checked {len(ranges)} synced review ranges: {stale} changed, "
+              f"{len(changed_ids)} reviews added or edited, {len(removed_ids)} deleted.")
+    return changed_ids, removed_ids
+
+def _sync_new_reviews(sqlite_conn, source_conn, embedder):
+    """Embeds the reviews past the sync watermark and groups them into new ranges.
+
+    Returns:
+        list[str]: The IDs of the reviews that were written to the cache.
+    """
+    watermark = get_cache_metadata(sqlite_conn).get("sync_watermark")
+    synced = sqlite_conn.execute("SELECT COALESCE(SUM(row_count), 0) FROM sync_ranges").fetchone()[0]
+    if LIMIT > 0 and synced >= LIMIT:
+        print(f"[+] {synced} reviews are synced, which reaches LIMIT; no new reviews are read.")
+        return []
+    last = sqlite_conn.execute(
+        "SELECT range_id, lo, row_count FROM sync_ranges ORDER BY range_id DESC LIMIT 1"
+    ).fetchone()
+    # The last range keeps growing until it holds SYNC_RANGE_SIZE reviews.
+    if last is not None and last[2] < SYNC_RANGE_SIZE:
+        current = {"range_id": last[0], "lo": last[1], "size": last[2]}
+    else:
+        current = {"range_id": None, "lo": watermark, "size": 0}
+    pending_ids = []
+    changed_ids = []
+
+    def close_range(hi):
+        # The summary is taken after the rows were read, so an edit made in the meantime is
+        # only noticed once the range changes again.
+        row_count, checksum = source_range_summary(source_conn, current["lo"], hi)
+        with sqlite_conn:
+            if current["range_id"] is None:
+                current["range_id"] = sqlite_conn.execute(
+                    "INSERT INTO sync_ranges (lo, hi, row_count, checksum) VALUES (?, ?, ?, ?)",
+                    (current["lo"], hi, row_count, checksum),
+                ).lastrowid
+            else:
+                sqlite_conn.execute("UPDATE sync_ranges SET hi = ?, row_count = ?, checksum = ? WHERE range_id = ?",
+                                    (hi, row_count, checksum, current["range_id"]))
+            _assign_range(sqlite_conn, pending_ids, current["range_id"])
+            _set_metadata(sqlite_conn, "sync_watermark", hi)
+        pending_ids.clear()
+        current.update(range_id=None, lo=hi, size=0)
+
+    def on_written(batch, written):
+        changed_ids.extend(r[ID_COLUMN] for r in written)
+        # Reviews that were already cached (before the first sync) may have been edited since.
+        written_ids = {r[ID_COLUMN] for r in written}
+        cached = [r for r in batch if r[ID_COLUMN] not in written_ids]
+        if cached:
+            edited = _changed_reviews(cached, _cached_reviews_by_ids(sqlite_conn, (r[ID_COLUMN] for r in cached)))
+            if edited:
+                upsert_reviews(sqlite_conn, embedder, edited)
+                changed_ids.extend(r[ID_COLUMN] for r in edited)
+        pending_ids.extend(r[ID_COLUMN] for r in batch)
+        current["size"] += len(batch)
+        if current["size"] >= SYNC_RANGE_SIZE:
+            close_range(batch[-1][ID_COLUMN])
+
+    if watermark is not None:
+        print(f"[+] Reading the reviews added after review_id {watermark}...")
+    limit = LIMIT - synced if LIMIT > 0 else 0
+    embed_new_reviews(sqlite_conn, iter_review_batches(limit=limit, start_after=watermark), embedder,
+                      on_written=on_written)
+    if pending_ids:
+        close_range(pending_ids[-1])
+    return changed_ids
+
+def _remove_tombstones(sqlite_conn, source_conn):
+    """Deletes the cached reviews outside every range that the source no longer has.
+
+    Returns:
+        list[str]: The IDs of the deleted reviews.
+    """
+    unranged = [row[0] for row in sqlite_conn.execute(f"SELECT {ID_COLUMN} FROM reviews WHERE sync_range IS NULL")]
+    if not unranged:
+        return []
+    with span("sync.tombstones", rows=len(unranged)):
+        existing = source_existing_ids(source_conn, unranged)
+        deleted = [review_id for review_id in unranged if review_id not in existing]
+        if deleted:
+            delete_embeddings_from_sqlite(sqlite_conn, deleted)
+    # The remaining ones are past LIMIT; they are checked again on every sync.
+    print(f"[+] Checked {len(unranged)} cached reviews outside the synced ranges: {len(deleted)} were deleted "
+          "from the source.")
+    return deleted
+
+def sync_reviews(sqlite_conn, embedder):
+    """Applies the changes of the review source since the last sync to the SQLite cache.
+
+    The first sync reads every review (up to LIMIT), like a full load; later ones read the
+    ranges whose row count or checksum changed and the reviews past the watermark. If the
+    source or its filters (REVIEW_LANGUAGES, REVIEW_CITIES) changed, the sync state is reset
+    first (see `reset_sync_state`). An interrupted sync resumes after the last range it closed.
+
+    Args:
+        sqlite_conn (sqlite3.Connection): An active connection to the SQLite database.
+        embedder (SentenceTransformer): The model used to encode new and edited texts.
+
+    Returns:
+        tuple[list[str], list[str]]: The IDs of the added or edited reviews, and of the
+                                     deleted reviews, for `update_faiss_index`.
+
+    Raises:
+        ValueError: If REVIEW_SOURCE is not one of ORDERED_SOURCES.
+    """
+    metadata = get_cache_metadata(sqlite_conn)
+    settings = _sync_settings()
+    if metadata.get("sync_settings", settings) != settings:
+        print("[+] The review source or its filters changed since the last sync. Re-reading the source...")
+        reset_sync_state(sqlite_conn)
+    with sqlite_conn:
+        _set_metadata(sqlite_conn, "sync_settings", settings)
+        # The resume watermark of older versions is superseded by the sync watermark.
+        sqlite_conn.execute("DELETE FROM cache_metadata WHERE key = 'load_watermark'")
+
+    source_conn = connect_review_source()
+    try:
+        changed_ids, removed_ids = _sync_changed_ranges(sqlite_conn, source_conn, embedder)
+        changed_ids += _sync_new_reviews(sqlite_conn, source_conn, embedder)
+        removed_ids += _remove_tombstones(sqlite_conn, source_conn)
+    finally:
+        source_conn.close()
+    count("reviews_deleted", len(removed_ids))
+    print(f"[+] Sync complete: {len(changed_ids)} reviews added or edited, {len(removed_ids)} deleted.")
+    return changed_ids, removed_ids